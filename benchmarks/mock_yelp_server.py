@@ -0,0 +1,100 @@
+import zlib
+import asyncio
+import random
+import threading
+from aiohttp import web
+from synthetic import make_business
+
+"""
+Local mock of the Yelp Fusion /v3/businesses/search endpoint for the fetch benchmarks.
+
+Every (term, latitude, longitude, radius) query has a fixed number of matching businesses, generated
+from a seed derived from the query, and is paginated with offset/limit like the real endpoint, including
+the 1000 result cap. Each response can be delayed by a configurable latency, and a configurable share of
+the requests is answered with 429 and a Retry-After header so the retry path of the client is exercised.
+"""
+
+SEARCH_PATH = '/v3/businesses/search'
+
+
+class MockYelpServer:
+    """
+    The mock endpoint running on its own event loop in a background thread.
+
+        with MockYelpServer(latency=0.05, rate_limit_rate=0.02) as server:
+            fetch_term_across_locations(server.url, {}, 'Restaurants', coordinates)
+    """
+
+    def __init__(self, total=240, latency=0.02, rate_limit_rate=0.0, retry_after=0.05, seed=0, port=0):
+        """
+        :param total: The number of businesses every query matches.
+        :param latency: Seconds every response is delayed by.
+        :param rate_limit_rate: The share of requests answered with 429.
+        :param retry_after: The Retry-After value of 429 responses, in seconds.
+        :param seed: Seed of the rate limiting decisions and of the businesses.
+        :param port: The port to listen on; 0 picks a free one.
+        """
+        self.total = total
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.port = port
+        self.requests = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}{SEARCH_PATH}"
+
+    async def search(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self._rng.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return web.json_response({'error': {'code': 'TOO_MANY_REQUESTS_PER_SECOND'}}, status=429,
+                                      headers={'Retry-After': str(self.retry_after)})
+
+        query = request.query
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 20))
+        if offset + limit > 1000:
+            return web.json_response({'error': {'code': 'VALIDATION_ERROR'}}, status=400)
+        # the same query always returns the same businesses
+        query_seed = zlib.crc32('|'.join([str(self.seed), query.get('term', ''), query.get('latitude', ''),
+                                          query.get('longitude', ''), query.get('radius', '')]).encode('utf-8'))
+        city = {'Name': 'Torrance', 'Latitude': float(query['latitude']), 'Longitude': float(query['longitude'])}
+        businesses = [make_business(random.Random(query_seed + i), query_seed % 100000 * 1000 + i, city)
+                      for i in range(offset, min(offset + limit, self.total, 1000))]
+        return web.json_response({'businesses': businesses, 'total': self.total,
+                                  'region': {'center': {'latitude': city['Latitude'], 'longitude': city['Longitude']}}})
+
+    def _serve(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_get(SEARCH_PATH, self.search)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def __enter__(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
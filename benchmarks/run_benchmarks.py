@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'prefect'))
+from synthetic import CITIES, make_businesses, write_payload, mysql_frame
+from mock_yelp_server import MockYelpServer
+from yelp_search_client import fetch_location_data, fetch_term_across_locations
+from yelp_transform import clean_businesses, export_businesses
+
+"""
+Repeatable benchmarks of the three hot paths of the pipeline, written as JSON to catch regressions.
+
+(1) fetch: get_api_data (one location at a time) and pull_data_across_locations (all locations of a
+    term through one pooled session) against the local mock search endpoint, in pages and businesses
+    per second. Both flows go through yelp_search_client, so that is what is measured; Prefect, GCS
+    and MySQL are left out.
+(2) transform: the cleaning of read_json_transform_df (clean_businesses + export_businesses) over
+    landed JSON files, in rows per second. Geocoding is network bound and left out.
+(3) pandas_transformation: time and peak traced memory of main.pandas_transformation on MySQL shaped
+    frames of growing size.
+
+Run from the repository root:
+    python benchmarks/run_benchmarks.py --output benchmark_results.json
+    python benchmarks/run_benchmarks.py --quick
+"""
+
+
+def best_of(repeats, function):
+    """
+    Run a function repeats times.
+
+    :return: The result of the last run and the fastest wall time in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def bench_fetch(locations=20, concurrency=(1, 8), total=240, latency=0.02, rate_limit_rate=0.02, repeats=3):
+    """
+    Pages and businesses per second of the search client against the mock endpoint.
+    """
+    coordinates = list(zip(CITIES['Latitude'], CITIES['Longitude']))[:locations]
+    results = []
+    with MockYelpServer(total=total, latency=latency, rate_limit_rate=rate_limit_rate) as server:
+        runs = [('get_api_data', 1,
+                 lambda: [fetch_location_data(server.url, {}, 'Restaurants', lat, long) for lat, long in coordinates])]
+        runs += [('pull_data_across_locations', workers,
+                  lambda workers=workers: fetch_term_across_locations(server.url, {}, 'Restaurants', coordinates,
+                                                                      concurrency=workers))
+                 for workers in concurrency]
+        for name, workers, run in runs:
+            requests_before, limited_before = server.requests, server.rate_limited
+            data, seconds = best_of(repeats, run)
+            businesses = sum(len(location) for location in data)
+            requests = (server.requests - requests_before) / repeats
+            results.append({'benchmark': name, 'concurrency': workers, 'locations': locations,
+                            'seconds': seconds, 'businesses': businesses,
+                            'requests_per_run': requests,
+                            'rate_limited_per_run': (server.rate_limited - limited_before) / repeats,
+                            'pages_per_sec': requests / seconds, 'businesses_per_sec': businesses / seconds})
+    return results
+
+
+def bench_transform(files=10, rows_per_file=1000, repeats=3):
+    """
+    Rows per second of the read_json_transform_df cleaning over landed JSON files.
+    """
+    set_cities = set(CITIES['Name'])
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [write_payload(os.path.join(directory, f"Restaurants-bench-{i}.json"), rows_per_file, seed=i)
+                 for i in range(files)]
+
+        def run():
+            return sum(export_businesses(clean_businesses(path, set_cities))[1] for path in paths)
+
+        rows_out, seconds = best_of(repeats, run)
+    rows_in = files * rows_per_file
+    return {'benchmark': 'read_json_transform_df', 'files': files, 'rows_in': rows_in, 'rows_out': rows_out,
+            'seconds': seconds, 'rows_per_sec': rows_in / seconds}
+
+
+def bench_pandas_transformation(sizes=(1000, 10000)):
+    """
+    Time and peak traced memory of main.pandas_transformation.
+    """
+    import main
+    # geocoding is network bound; keep Nominatim out of the measurement
+    main.geolocate_with_address = lambda df: df
+    results = []
+    for size in sizes:
+        df = mysql_frame(make_businesses(size, seed=size))
+        tracemalloc.start()
+        start = time.perf_counter()
+        rows = len(main.pandas_transformation(df))
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({'benchmark': 'pandas_transformation', 'rows_in': size, 'rows_out': rows,
+                        'seconds': seconds, 'rows_per_sec': size / seconds,
+                        'peak_memory_mb': peak / 2 ** 20, 'peak_bytes_per_row': peak / size})
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1] if __doc__ else None)
+    parser.add_argument('--output', default='benchmark_results.json', help='Path of the JSON results file')
+    parser.add_argument('--quick', action='store_true', help='Smaller workloads for a fast smoke run')
+    parser.add_argument('--only', choices=['fetch', 'transform', 'pandas_transformation'], action='append',
+                        help='Run only the given benchmark; may be repeated')
+    args = parser.parse_args()
+    only = set(args.only or ['fetch', 'transform', 'pandas_transformation'])
+
+    results = []
+    if 'fetch' in only:
+        results += bench_fetch(locations=5 if args.quick else 20, repeats=1 if args.quick else 3)
+    if 'transform' in only:
+        results.append(bench_transform(files=3 if args.quick else 10, repeats=1 if args.quick else 3))
+    if 'pandas_transformation' in only:
+        results += bench_pandas_transformation((1000,) if args.quick else (1000, 10000))
+
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'pandas': pd.__version__,
+              'platform': platform.platform(), 'quick': args.quick, 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        print(json.dumps(result))
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
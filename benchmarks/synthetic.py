@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import random
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prefect'))
+from category_index import FOOD_AND_BARS_CATEGORIES, NONFOOD_CATEGORIES, ETHNICITIES_CATEGORIES
+
+"""
+Synthetic Yelp Fusion business payloads for the benchmarks.
+
+Businesses have the shape the search endpoint returns (categories, coordinates, location, price...).
+The rates of the irregularities the transforms have to handle default to what we see in real pulls:
+about a third of the businesses have no price, a few have no coordinates, some carry non-food categories
+or an address2, and some report a neighbourhood instead of a city of the city list.
+Payloads are generated from a seed, so every run of a benchmark transforms the same data.
+"""
+
+MISSING_PRICE_RATE = 0.33
+MISSING_COORDINATES_RATE = 0.005
+NONFOOD_RATE = 0.15
+ADDRESS2_RATE = 0.1
+NEIGHBOURHOOD_RATE = 0.05
+
+CITIES = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'california_lat_long_cities.csv'))
+FOOD = sorted(FOOD_AND_BARS_CATEGORIES)
+ETHNIC = sorted(ETHNICITIES_CATEGORIES)
+NONFOOD = sorted(NONFOOD_CATEGORIES)
+NEIGHBOURHOODS = ['North Hollywood', 'Van Nuys', 'Koreatown', 'Silver Lake', 'Pacific Palisades', 'Encino']
+
+
+def make_business(rng, index, city=None, missing_price_rate=MISSING_PRICE_RATE,
+                  missing_coordinates_rate=MISSING_COORDINATES_RATE):
+    """
+    One business dictionary as returned by /v3/businesses/search.
+
+    :param rng: A random.Random.
+    :param index: A number that makes the id unique.
+    :param city: A row of the city list the business is placed around; a random city when None.
+    """
+    if city is None:
+        city = CITIES.iloc[rng.randrange(len(CITIES))]
+    aliases = rng.sample(FOOD, rng.randint(1, 2))
+    if rng.random() < 0.4:
+        aliases.append(rng.choice(ETHNIC))
+    if rng.random() < NONFOOD_RATE:
+        aliases.append(rng.choice(NONFOOD))
+    latitude = float(city['Latitude']) + rng.uniform(-0.05, 0.05)
+    longitude = float(city['Longitude']) + rng.uniform(-0.05, 0.05)
+    if rng.random() < missing_coordinates_rate:
+        latitude = longitude = None
+    city_name = rng.choice(NEIGHBOURHOODS) if rng.random() < NEIGHBOURHOOD_RATE else city['Name']
+    address1 = f"{rng.randint(1, 9999)} {rng.choice(['Main', 'Oak', 'Pine', 'Sepulveda', 'El Camino'])} St"
+    address2 = f"Ste {rng.randint(1, 300)}" if rng.random() < ADDRESS2_RATE else rng.choice(['', None])
+    zip_code = str(rng.randint(90001, 96162))
+    business = {
+        'id': f"bench{index:08d}",
+        'alias': f"business-{index}",
+        'name': f"Business {index}",
+        'image_url': f"https://s3-media1.fl.yelpcdn.com/bphoto/{index}/o.jpg",
+        'is_closed': False,
+        'url': f"https://www.yelp.com/biz/business-{index}",
+        'review_count': rng.randint(1, 5000),
+        'categories': [{'alias': alias, 'title': alias.title()} for alias in aliases],
+        'rating': rng.choice([1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]),
+        'coordinates': {'latitude': latitude, 'longitude': longitude},
+        'transactions': rng.sample(['delivery', 'pickup', 'restaurant_reservation'], rng.randint(0, 2)),
+        'location': {'address1': address1, 'address2': address2, 'address3': '', 'city': city_name,
+                     'zip_code': zip_code, 'country': 'US', 'state': 'CA',
+                     'display_address': [address1, f"{city_name}, CA {zip_code}"]},
+        'phone': f"+1{rng.randint(2000000000, 9999999999)}",
+        'display_phone': '',
+        'distance': rng.uniform(0, 10000),
+    }
+    if rng.random() >= missing_price_rate:
+        business['price'] = '$' * rng.randint(1, 4)
+    return business
+
+
+def make_businesses(n, seed=0, **rates):
+    """
+    :return: A list of n business dictionaries.
+    """
+    rng = random.Random(seed)
+    return [make_business(rng, i, **rates) for i in range(n)]
+
+
+def write_payload(path, n, seed=0, **rates):
+    """
+    Write n businesses the way write_local lands one location.
+    """
+    with open(path, 'w') as f:
+        json.dump(make_businesses(n, seed, **rates), f)
+    return path
+
+
+def mysql_frame(businesses):
+    """
+    The DataFrame fetch_data_from_mysql returns for businesses written by insert_data_to_db:
+    nested fields are JSON strings.
+    """
+    df = pd.DataFrame(businesses)
+    for column in ['categories', 'coordinates', 'transactions', 'location']:
+        df[column] = df[column].map(json.dumps)
+    return df
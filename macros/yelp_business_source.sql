@@ -0,0 +1,20 @@
+{#
+    This macro returns the relation the staging models read a term from.
+    With --vars 'load_mode: cdc' it is the open businesses of the current-state table the GCS to BQ flow
+    merges into (see prefect/cdc.py), which holds each business once; otherwise the raw append table.
+    DuckDB (the local warehouse of prefect/duckdb_warehouse.py) spells SELECT * EXCEPT as EXCLUDE.
+#}
+
+{% macro yelp_business_source(raw_table) -%}
+
+    {%- if var('load_mode', 'append') == 'cdc' -%}
+    (
+        select * {{ 'exclude' if target.type == 'duckdb' else 'except' }} (row_hash, location, is_closed, updated_at)
+        from {{ source('current', raw_table | replace('_data_raw', '_current')) }}
+        where not is_closed
+    )
+    {%- else -%}
+    {{ source('staging', raw_table) }}
+    {%- endif %}
+
+{%- endmacro %}
@@ -0,0 +1,44 @@
+{#
+    This macro returns the restaurants/desserts/cafe label of a business with the LIKE rules fact_yelp_all
+    used before the label was computed in the transform (see prefect/business_type.py).
+    It labels the rows loaded before the type column existed, and the golden test checks it against
+    seeds/business_type_golden.csv. categories is the ', '-joined string of the staging models.
+#}
+
+{% macro yelp_type(source_group, categories='categories', alias='alias', name='name') -%}
+
+    {%- if source_group == 'restaurants' -%}
+    'restaurants'
+    {%- elif source_group == 'desserts' -%}
+    CASE WHEN ({{categories}} != 'coffee')
+      AND ({{categories}} NOT LIKE '%coffeeroasteries%')
+      AND ({{categories}} NOT LIKE '%wine%')
+      AND ({{categories}} NOT LIKE '%burgers%')
+      AND ({{categories}} NOT LIKE '%hotdogs%')
+      AND ({{categories}} NOT LIKE '%breakfast_brunch%')
+      AND ({{categories}} NOT LIKE '%breweries%')
+      AND ({{categories}} NOT LIKE '%brewpubs%')
+      AND ({{categories}} NOT LIKE '%pizza%')
+      AND ({{categories}} NOT LIKE '%coffee, sandwiches%')
+      AND ({{categories}} NOT LIKE '%foodtrucks%')
+      AND ({{categories}} NOT LIKE '%sandwiches, coffee%')
+      AND ({{categories}} NOT LIKE '%market%')
+      AND ({{categories}} NOT LIKE '%poke%')
+      AND ({{categories}} NOT LIKE '%pretzel%')
+      AND ({{categories}} NOT LIKE '%chicken%')
+      AND ({{alias}} NOT LIKE 'pho')
+    THEN 'desserts' END
+    {%- elif source_group == 'cafe' -%}
+    CASE WHEN ({{categories}} LIKE '%desserts%' AND {{categories}} LIKE '%juicebars%' AND {{categories}} LIKE '%coffee%')
+        OR ({{categories}} LIKE '%cafes%')
+        OR (LOWER({{name}}) LIKE '%cafe%' AND {{categories}} LIKE '%cafes%')
+        OR (LOWER({{name}}) LIKE '%coffee%' AND {{categories}} LIKE '%cafes%')
+        OR ({{categories}} LIKE '%coffee%' AND {{categories}} LIKE '%desserts%')
+        OR ({{categories}} LIKE '%coffee%' AND ARRAY_LENGTH(SPLIT({{categories}}, ',')) = 1)
+        OR ({{categories}} LIKE '%tea%')
+    THEN 'cafe' END
+    {%- else -%}
+    CAST(NULL AS STRING)
+    {%- endif %}
+
+{%- endmacro %}
@@ -10,14 +10,22 @@ documentation.
 Second part of the script is meant to store the queried data into a db format
 """
 import os
+import sys
 import mysql.connector
-import requests
 import time
 import json
 import pandas as pd
 from geopy.geocoders import Nominatim
 import numpy as np
 import matplotlib.pyplot as plt
+from mysql_writer import MySQLBulkWriter
+
+# shared helpers live next to the prefect flows
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prefect'))
+from yelp_search_client import fetch_location_data, stream_term_across_locations
+from category_index import CATEGORY_INDEX, FOOD_AND_BARS, DEFINITELY_NO
+from geocode_cache import GeocodeCache
+from location_normalizer import CITIES, build_addresses, normalization_stats
 
 
 start_time = time.time()
@@ -58,20 +66,15 @@ db_USER = os.getenv("DB_USER")
 db_PASSWORD = os.getenv("DB_PWD")
 db_DATABASE = 'yelpdb'
 db_TABLE_NAME = "yelp_cafe" # yelp_cafe_desserts_boba_etc
+DB_BATCH_SIZE = 1000 # rows per INSERT ... ON DUPLICATE KEY UPDATE statement
+db_writers = {} # pooled bulk writers, see get_db_writer
 
 # Food AtoL and MtoZ on yelp_data; delete yelp_restaurants; copy distinct over to yelp_restaurants
 
 
-NONFOOD_CATEGORIES = {'copyshops', 'bikes', 'seafoodmarkets', 'cheese','importedfood','buildingsupplies', 'pumpkinpatches', 'hardware', 'vitaminssupplements', 'cannabisdispensaries', 'artclasses', 'horse_boarding', 'pilates', 'sewingalterations', 'reiki', 'musicians', 'educationservices', 'servicestations', 'skishops',  'marketing', 'fleamarkets', 'spiritual_shop', 'tiling', 'carwash', 'selfstorage',  'hiking', 'accessories', 'alternativemedicine', 'localservices', 'convenience', 'indoor_playcenter', 'saunas', 'grocery', 'shipping_centers', 'playgrounds', 'markets', 'weddingchappels', 'bouncehouserentals', 'tabletopgames', 'doulas', 'photographystores', 'tcm', 'icedelivery', 'pettingzoos', 'wholesalers', 'pianobars', 'surfshop', 'couriers', 'homecleaning', 'foodbanks', 'acupuncture', 'personal_shopping', 'computers', 'oilchange', 'boattours', 'escapegames', 'shavedice', 'brasseries', 'custommerchandise', 'sportswear', 'drivethrubars', 'buddhist_temples', 'weightlosscenters', 'balloonservices', 'registrationservices', 'catering', 'usedbooks', 'karaoke', 'thrift_stores', 'vintage', 'autocustomization', 'souvenirs', 'brewingsupplies', 'parking', 'vocation', 'beautysvc', 'tastingclasses', 'hottubandpool', 'flowers', 'distilleries', 'csa', 'ranches', 'eventservices', 'paintball', 'interiordesign', 'wigs', 'magicians', 'appliances', 'limos', 'plumbing', 'irrigation', 'spraytanning', 'organic_stores', 'candlestores', 'airport_shuttles', 'fishing', 'dog_parks', 'horseracing', 'bingo', 'cookingclasses', 'bike_repair_maintenance', 'animalshelters', 'homedecor', 'gardens', 'tours', 'womenscloth', 'laboratorytesting', 'firewood', 'paydayloans', 'eventplanning', 'headshops', 'hobbyshops', 'publicmarkets', 'bocceball', 'gyms', 'grillservices', 'cardioclasses', 'countryclubs', 'reststops', 'nonprofit', 'shoppingcenters', 'gamemeat', 'religiousitems', 'electronics', 'eatertainment', 'aerialfitness', 'pest_control', 'florists', 'stadiumsarenas', 'kitchenincubators', 'costumes', 'waterpurification', 'hookah_bars', 'djs', 'football', 'shopping', 'physicaltherapy', 'cafeteria', 'barcrawl', 'amateursportsteams', 'suppliesrestaurant', 'bikerentals', 'campgrounds', 'tobaccoshops', 'boating', 'beaches', 'farms', 'vapeshops', 'countrydancehalls', 'gardening', 'cyclingclasses', 'partyequipmentrentals', 'pet_sitting', 'gemstonesandminerals', 'religiousorgs', 'cigarbars', 'elementaryschools', 'supperclubs', 'watersuppliers', 'culturalcenter', 'hotels', 'travelservices', 'mini_golf', 'evchargingstations', 'childcloth', 'artschools', 'outdoorgear', 'vinyl_records', 'reflexology', 'waterdelivery', 'international', 'butcher', 'fitness', 'laundryservices', 'videoandgames', 'paintandsip', 'visitorcenters', 'attractionfarms', 'bootcamps', 'farmersmarket', 'beachequipmentrental', 'trains', 'landmarks', 'golf', 'resorts', 'petadoption', 'winetasteclasses', 'partycharacters', 'mobilephones', 'outlet_stores', 'boatcharters', 'groomer', 'itservices', 'petboarding', 'homehealthcare', 'customcakes', 'chiropractors', 'sommelierservices', 'healthcoach', 'nutritionists', 'artmuseums', 'popupshops', 'museums', 'service_stations', 'fireworks', 'wholesale_stores', 'battingcages', 'fueldocks', 'antiques', 'homeandgarden', 'artsandcrafts', 'galleries', 'livestocksupply', 'surfing', 'personalchefs', 'vacation_rentals', 'amusementparks', 'hats', 'bodyshops', 'cosmetics', 'casinos', 'hospitals', 'eyebrowservices', 'postoffices', 'musicvenues', 'giftshops', 'tennis', 'guesthouses', 'opticians', 'swimmingpools', 'yoga', 'stationery', 'christmastrees', 'beer_and_wine', 'cookingschools', 'bedbreakfast', 'rvparks', 'rugs', 'autorepair', 'autopartssupplies', 'discountstore', 'tradclothing', 'discgolf', 'fashion', 'foodtours', 'recreation', 'pharmacy', 'petstore', 'meats', 'paddleboarding', 'hotelstravel', 'kiteboarding', 'psychic_astrology', 'parks', 'internetcafe', 'specialtyschools', 'kitchensupplies', 'lingerie', 'bookstores', 'arcades', 'lancenters', 'toys', 'threadingservices', 'lifecoach', 'herbsandspices', 'publicservicesgovt', 'auto', 'marinas', 'taxis', 'huntingfishingsupplies', 'health', 'medcenters', 'kitchenandbath', 'kids_activities', 'dancestudio', 'massage_therapy', 'pet_training', 'oliveoil', 'axethrowing', 'bowling', 'barbers', 'kiosk', 'intlgrocery', 'localflavor', 'bartenders', 'petbreeders', 'laundromat', 'musicvideo', 'arts', 'yelpevents', 'candy', 'watches', 'churches', 'waterstores', 'winetours', 'herbalshops', 'popcorn', 'deptstores', 'medicalspa', 'pickyourown', 'jewelry', 'fabricstores', 'truckrepair', 'movietheaters', 'guns_and_ammo', 'education', 'advertising', 'sportgoods', 'partysupplies', 'floraldesigners', 'skincare', 'popuprestaurants', 'horsebackriding', 'healthtrainers', 'poolhalls', 'mags', 'homeappliancerepair', 'golflessons', 'beverage_stores', 'smog_check_stations', 'businessconsulting', 'beertours', 'propane', 'nikkei', 'walkingtours', 'cosmeticdentists', 'artspacerentals', 'sharedofficespaces', 'fooddeliveryservices', 'menscloth', 'clothingrental', 'venues', 'shoes', 'nightlife', 'massage', 'drugstores', 'cabaret', 'lounges', 'active', 'healthmarkets', 'specialed', 'photoboothrentals', 'spas', 'wedding_planning', 'teambuilding', 'festivals', 'naturopathic', 'comedyclubs', 'social_clubs', 'danceclubs', 'jazzandblues', 'wildlifecontrol', 'outdoormovies', 'furniture', 'mobilephonerepair', 'internalmed', 'meditationcenters', 'theater', 'virtualrealitycenters'}
-DEFINITELY_NO_CATEGORIES = {'grocery', 'convenience', 'drugstores'}
-ALL_CATEGORIES = {'delis', 'copyshops', 'japanese', 'bikes', 'buildingsupplies', 'pumpkinpatches', 'hardware', 'greek', 'honey', 'winetastingroom', 'vitaminssupplements', 'cannabisdispensaries', 'acaibowls', 'artclasses', 'horse_boarding', 'diners', 'foodtrucks', 'pilates', 'sewingalterations', 'reiki', 'musicians', 'educationservices', 'servicestations', 'skishops', 'bistros', 'mideastern', 'raw_food', 'marketing', 'fleamarkets', 'cheesesteaks', 'hotpot', 'uzbek', 'spiritual_shop', 'tiling', 'breweries', 'diyfood', 'carwash', 'selfstorage', 'southern', 'arabian', 'coffee', 'eritrean', 'hiking', 'fishnchips', 'accessories', 'alternativemedicine', 'kombucha', 'localservices', 'convenience', 'indoor_playcenter', 'sushi', 'pubs', 'irish', 'oaxacan', 'cantonese', 'japacurry', 'saunas', 'grocery', 'colombian', 'szechuan', 'shipping_centers', 'izakaya', 'playgrounds', 'markets', 'weddingchappels', 'bouncehouserentals', 'tabletopgames', 'cocktailbars', 'doulas', 'photographystores', 'chocolate', 'tcm', 'dinnertheater', 'icedelivery', 'food', 'pettingzoos', 'puertorican', 'halal', 'wholesalers', 'pianobars', 'surfshop', 'laotian', 'couriers', 'homecleaning', 'foodbanks', 'armenian', 'divebars', 'acupuncture', 'basque', 'austrian', 'personal_shopping', 'computers', 'korean', 'oilchange', 'boattours', 'escapegames', 'shavedice', 'brasseries', 'custommerchandise', 'falafel', 'sportswear', 'drivethrubars', 'buddhist_temples', 'bangladeshi', 'poutineries', 'weightlosscenters', 'balloonservices', 'somali', 'gourmet', 'registrationservices', 'catering', 'streetvendors', 'usedbooks', 'karaoke', 'thrift_stores', 'themedcafes', 'vintage', 'autocustomization', 'souvenirs', 'brewingsupplies', 'italian', 'bulgarian', 'parking', 'yucatan', 'russian', 'cakeshop', 'vocation', 'beautysvc', 'tastingclasses', 'hottubandpool', 'flowers', 'distilleries', 'csa', 'ranches', 'teppanyaki', 'cupcakes', 'eventservices', 'paintball', 'interiordesign', 'dominican', 'latin', 'wigs', 'magicians', 'sardinian', 'appliances', 'limos', 'plumbing', 'irrigation', 'churros', 'spraytanning', 'filipino', 'lebanese', 'organic_stores', 'candlestores', 'airport_shuttles', 'coffeeroasteries', 'fishing', 'asianfusion', 'newmexican', 'dog_parks', 'horseracing', 'bingo', 'cookingclasses', 'bike_repair_maintenance', 'animalshelters', 'champagne_bars', 'homedecor', 'senegalese', 'ukrainian', 'gardens', 'tours', 'womenscloth', 'laboratorytesting', 'firewood', 'paydayloans', 'eventplanning', 'headshops', 'noodles', 'hobbyshops', 'publicmarkets', 'wine_bars', 'sicilian', 'tea', 'bocceball', 'gyms', 'juicebars', 'grillservices', 'cardioclasses', 'comfortfood', 'soup', 'wraps', 'countryclubs', 'reststops', 'nonprofit', 'australian', 'restaurants', 'vermouthbars', 'shoppingcenters', 'gastropubs', 'gamemeat', 'bakeries', 'bagels', 'religiousitems', 'desserts', 'electronics', 'eatertainment', 'aerialfitness', 'pest_control', 'florists', 'chicken_wings', 'stadiumsarenas', 'seafood', 'kitchenincubators', 'costumes', 'waterpurification', 'hookah_bars', 'djs', 'football', 'shopping', 'physicaltherapy', 'cafeteria', 'rotisserie_chicken', 'cideries', 'barcrawl', 'amateursportsteams', 'suppliesrestaurant', 'bikerentals', 'campgrounds', 'vietnamese', 'tobaccoshops', 'boating', 'gaybars', 'polynesian', 'beaches', 'pancakes', 'farms', 'vapeshops', 'countrydancehalls', 'gardening', 'cyclingclasses', 'partyequipmentrentals', 'pet_sitting', 'gemstonesandminerals', 'religiousorgs', 'cigarbars', 'elementaryschools', 'supperclubs', 'watersuppliers', 'georgian', 'macarons', 'culturalcenter', 'southafrican', 'hotels', 'travelservices', 'mini_golf', 'evchargingstations', 'hkcafe', 'childcloth', 'artschools', 'outdoorgear', 'vinyl_records', 'reflexology', 'waterdelivery', 'international', 'butcher', 'pakistani', 'fitness', 'piadina', 'mexican', 'tamales', 'brewpubs', 'laundryservices', 'poke', 'videoandgames', 'empanadas', 'paintandsip', 'visitorcenters', 'attractionfarms', 'buffets', 'chickenshop', 'peruvian', 'tradamerican', 'bootcamps', 'mongolian', 'farmersmarket', 'beachequipmentrental', 'trains', 'landmarks', 'golf', 'resorts', 'portuguese', 'tikibars', 'petadoption', 'winetasteclasses', 'partycharacters', 'shavedsnow', 'pastashops', 'gelato', 'burmese', 'mobilephones', 'outlet_stores', 'boatcharters', 'gluten_free', 'chimneycakes', 'moroccan', 'cajun', 'breakfast_brunch', 'speakeasies', 'hainan', 'groomer', 'itservices', 'petboarding', 'homehealthcare', 'customcakes', 'brazilian', 'caribbean', 'chiropractors', 'sommelierservices', 'healthcoach', 'nutritionists', 'artmuseums', 'popupshops', 'museums', 'honduran', 'service_stations', 'fireworks', 'himalayan', 'wholesale_stores', 'venezuelan', 'battingcages', 'fueldocks', 'kosher', 'antiques', 'foodstands', 'bubbletea', 'scottish', 'homeandgarden', 'artsandcrafts', 'galleries', 'livestocksupply', 'surfing', 'pretzels', 'personalchefs', 'hotdogs', 'donuts', 'vacation_rentals', 'amusementparks', 'hats', 'bodyshops', 'cosmetics', 'casinos', 'northernmexican', 'hospitals', 'eyebrowservices', 'vegetarian', 'postoffices', 'musicvenues', 'giftshops', 'cheese', 'calabrian', 'tennis', 'guesthouses', 'opticians', 'swimmingpools', 'yoga', 'stationery', 'tuscan', 'singaporean', 'cuban', 'christmastrees', 'beer_and_wine', 'cookingschools', 'bedbreakfast', 'chinese', 'rvparks', 'rugs', 'autorepair', 'autopartssupplies', 'discountstore', 'tradclothing', 'discgolf', 'fashion', 'foodtours', 'recreation', 'pharmacy', 'petstore', 'hungarian', 'srilankan', 'panasian', 'food_court', 'meats', 'paddleboarding', 'syrian', 'hotelstravel', 'kiteboarding', 'sandwiches', 'seafoodmarkets', 'soulfood', 'psychic_astrology', 'conveyorsushi', 'parks', 'internetcafe', 'specialtyschools', 'kitchensupplies', 'lingerie', 'bookstores', 'arcades', 'lancenters', 'toys', 'kebab', 'threadingservices', 'lifecoach', 'herbsandspices', 'publicservicesgovt', 'auto', 'cafes', 'afghani', 'marinas', 'taxis', 'huntingfishingsupplies', 'fondue', 'argentine', 'health', 'sportsbars', 'spanish', 'modern_european', 'medcenters', 'kitchenandbath', 'kids_activities', 'dancestudio', 'massage_therapy', 'tex-mex', 'pe'
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                 't_training', 'slovakian', 'importedfood', 'oliveoil', 'burgers', 'axethrowing', 'bowling', 'barbers', 'kiosk', 'intlgrocery', 'cambodian', 'localflavor', 'bartenders', 'petbreeders', 'laundromat', 'musicvideo', 'arts', 'yelpevents', 'candy', 'thai', 'watches', 'churches', 'belgian', 'waterstores', 'winetours', 'herbalshops', 'czech', 'popcorn', 'deptstores', 'jaliscan', 'medicalspa', 'taiwanese', 'meaderies', 'pickyourown', 'jewelry', 'icecream', 'fabricstores', 'creperies', 'truckrepair', 'newamerican', 'scandinavian', 'salad', 'movietheaters', 'malaysian', 'guns_and_ammo', 'education', 'advertising', 'sportgoods', 'partysupplies', 'floraldesigners', 'skincare', 'african', 'popuprestaurants', 'horsebackriding', 'mediterranean', 'vegan', 'healthtrainers', 'poolhalls', 'french', 'guamanian', 'beerbar', 'mags', 'beergardens', 'homeappliancerepair', 'golflessons', 'beverage_stores', 'smog_check_stations', 'shanghainese', 'businessconsulting', 'beertours', 'propane', 'smokehouse', 'tapas', 'nikkei', 'british', 'walkingtours', 'indonesian', 'cosmeticdentists', 'artspacerentals', 'wineries', 'sharedofficespaces', 'irish_pubs', 'fooddeliveryservices', 'menscloth', 'clothingrental', 'venues', 'shoes', 'nightlife', 'massage', 'bars', 'drugstores', 'trinidadian', 'cabaret', 'lounges', 'iberian', 'ramen', 'salvadoran', 'steak', 'dimsum', 'indpak', 'pizza', 'waffles', 'active', 'healthmarkets', 'ethiopian', 'persian', 'specialed', 'photoboothrentals', 'spas', 'wedding_planning', 'teambuilding', 'tapasmallplates', 'polish', 'hotdog', 'nicaraguan', 'festivals', 'newcanadian', 'hawaiian', 'naturopathic', 'comedyclubs', 'haitian', 'social_clubs', 'danceclubs', 'whiskeybars', 'german', 'jazzandblues', 'wildlifecontrol', 'outdoormovies', 'furniture', 'mobilephonerepair', 'internalmed', 'bbq', 'meditationcenters', 'tacos', 'theater', 'egyptian', 'virtualrealitycenters', 'turkish'}
-FOOD_AND_BARS_CATEGORIES = {'poutineries', 'sardinian', 'bars', 'divebars', 'tamales', 'winetastingroom', 'comfortfood', 'somali', 'rotisserie_chicken', 'cuban', 'puertorican', 'pastashops', 'meaderies', 'whiskeybars', 'indpak', 'vermouthbars', 'moroccan', 'cupcakes', 'newmexican', 'polynesian', 'falafel', 'pancakes', 'yucatan', 'bbq', 'oaxacan', 'ukrainian', 'arabian', 'foodstands', 'brazilian', 'wineries', 'japacurry', 'pubs', 'himalayan', 'newcanadian', 'tacos', 'australian', 'hainan', 'dinnertheater', 'foodtrucks', 'acaibowls', 'georgian', 'sicilian', 'calabrian', 'irish_pubs', 'dimsum', 'kebab', 'teppanyaki', 'colombian', 'newamerican', 'chinese', 'vietnamese', 'delis', 'irish', 'eritrean', 'southern', 'wraps', 'senegalese', 'tapasmallplates', 'hawaiian', 'guamanian', 'mediterranean', 'hotdog', 'vegan', 'laotian', 'panasian', 'polish', 'beerbar', 'argentine', 'steak', 'sandwiches', 'tex-mex', 'bagels', 'german', 'salad', 'creperies', 'gluten_free', 'pretzels', 'poke', 'jaliscan', 'noodles', 'buffets', 'basque', 'iberian', 'chickenshop', 'singaporean', 'modern_european', 'desserts', 'donuts', 'food_court', 'breweries', 'mexican', 'sushi', 'dominican', 'salvadoran', 'restaurants', 'hotdogs', 'gelato', 'kosher', 'bulgarian', 'burgers', 'raw_food', 'icecream', 'brewpubs', 'mideastern', 'syrian', 'cheesesteaks', 'belgian', 'food', 'peruvian', 'filipino', 'korean', 'soulfood', 'pizza', 'russian', 'bangladeshi', 'caribbean', 'cocktailbars', 'churros', 'tradamerican', 'indonesian', 'wine_bars', 'coffeeroasteries', 'greek', 'french', 'cambodian', 'conveyorsushi', 'themedcafes', 'thai', 'piadina', 'honey', 'fondue', 'sportsbars', 'asianfusion', 'cakeshop', 'slovakian', 'ramen', 'british', 'southafrican', 'empanadas', 'chimneycakes', 'latin', 'tapas', 'diners', 'chicken_wings', 'northernmexican', 'macarons', 'italian', 'beergardens', 'hungarian', 'hotpot', 'cideries', 'shavedsnow', 'vegetarian', 'egyptian', 'ethiopian', 'trinidadian', 'taiwanese', 'portuguese', 'chocolate', 'cafes', 'lebanese', 'soup', 'hkcafe', 'burmese', 'bubbletea', 'bistros', 'malaysian', 'seafood', 'austrian', 'japanese', 'cantonese', 'halal', 'nicaraguan', 'srilankan', 'juicebars', 'diyfood', 'scottish', 'honduran', 'scandinavian', 'gastropubs', 'venezuelan', 'armenian', 'speakeasies', 'coffee', 'spanish', 'tikibars', 'bakeries', 'tea', 'smokehouse', 'turkish', 'izakaya', 'champagne_bars', 'waffles', 'gaybars', 'cajun', 'haitian', 'szechuan', 'fishnchips', 'afghani', 'african', 'czech', 'kombucha', 'shanghainese', 'breakfast_brunch', 'mongolian', 'pakistani', 'gourmet', 'tuscan', 'uzbek', 'persian', 'streetvendors'}
-BARS_CATEGORIES = {'bars', 'divebars', 'winetastingroom', 'meaderies', 'whiskeybars', 'vermouthbars', 'wineries', 'pubs', 'irish_pubs', 'beerbar', 'tapas', 'breweries', 'brewpubs', 'cocktailbars', 'winebars', 'sportsbars', 'beergardens', 'gastropubs', 'tikibars', 'champagne_bars', 'gaybars'}
-FOOD_CATEGORIES = {'waffles', 'haitian', 'filipino', 'diners', 'afghani', 'belgian', 'teppanyaki', 'lebanese', 'piadina', 'hotpot', 'cuban', 'bistros', 'singaporean', 'comfortfood', 'buffets', 'soup', 'vegetarian', 'newcanadian', 'tradamerican', 'himalayan', 'dominican', 'themedcafes', 'austrian', 'japanese', 'modern_european', 'ramen', 'hotdog', 'cakeshop', 'portuguese', 'newmexican', 'taiwanese', 'vegan', 'uzbek', 'fishnchips', 'british', 'kosher', 'guamanian', 'szechuan', 'mexican', 'macarons', 'acaibowls', 'georgian', 'bagels', 'cheesesteaks', 'food', 'bakeries', 'persian', 'arabian', 'mediterranean', 'colombian', 'burgers', 'food_court', 'sandwiches', 'shavedsnow', 'coffee', 'trinidadian', 'russian', 'italian', 'diyfood', 'sicilian', 'ukrainian', 'churros', 'tuscan', 'cantonese', 'spanish', 'foodtrucks', 'moroccan', 'sardinian', 'cideries', 'hawaiian', 'soulfood', 'thai', 'falafel', 'gourmet', 'chimneycakes', 'scandinavian', 'izakaya', 'honey', 'cupcakes', 'japacurry', 'bulgarian', 'streetvendors', 'pretzels', 'pancakes', 'salvadoran', 'srilankan', 'delis', 'tex-mex', 'cajun', 'polish', 'dimsum', 'bangladeshi', 'eritrean', 'halal', 'african', 'turkish', 'somali', 'hotdogs', 'slovakian', 'chicken_wings', 'southern', 'brazilian', 'hainan', 'venezuelan', 'winebars', 'dinnertheater', 'empanadas', 'hungarian', 'pakistani', 'poutineries', 'irish', 'cafes', 'asianfusion', 'speakeasies', 'chocolate', 'basque', 'chinese', 'syrian', 'calabrian', 'armenian', 'puertorican', 'southafrican', 'polynesian', 'senegalese', 'donuts', 'german', 'scottish', 'kombucha', 'jaliscan', 'seafood', 'indpak', 'czech', 'juicebars', 'mongolian', 'tapasmallplates', 'australian', 'noodles', 'oaxacan', 'shanghainese', 'wraps', 'bbq', 'burmese', 'foodstands', 'kebab', 'honduran', 'salad', 'gelato', 'korean', 'panasian', 'rotisserie_chicken', 'pizza', 'greek', 'ethiopian', 'laotian', 'malaysian', 'smokehouse', 'nicaraguan', 'vietnamese', 'caribbean', 'hkcafe', 'steak', 'raw_food', 'restaurants', 'peruvian', 'bubbletea', 'poke', 'pastashops', 'tea', 'yucatan', 'sushi', 'wine_bars', 'conveyorsushi', 'french', 'tacos', 'argentine', 'northernmexican', 'fondue', 'chickenshop', 'gluten_free', 'icecream', 'breakfast_brunch', 'tamales', 'cambodian', 'mideastern', 'indonesian', 'latin', 'coffeeroasteries', 'newamerican', 'desserts', 'creperies', 'egyptian', 'iberian'}
-ETHNICITIES_CATEGORIES = {'japanese', 'greek', 'mideastern', 'uzbek', 'southern', 'arabian', 'eritrean', 'irish', 'oaxacan', 'cantonese', 'colombian', 'szechuan', 'puertorican', 'halal', 'laotian', 'armenian', 'basque', 'austrian', 'korean', 'bangladeshi', 'poutineries', 'somali', 'italian', 'bulgarian', 'yucatan', 'russian', 'dominican', 'latin', 'sardinian', 'filipino', 'lebanese', 'asianfusion', 'newmexican', 'senegalese', 'ukrainian', 'sicilian', 'australian', 'vietnamese', 'polynesian', 'georgian', 'southafrican', 'hkcafe', 'pakistani', 'mexican', 'peruvian', 'tradamerican', 'mongolian', 'portuguese', 'burmese', 'moroccan', 'cajun', 'hainan', 'brazilian', 'caribbean', 'honduran', 'himalayan', 'venezuelan', 'kosher', 'scottish', 'northernmexican', 'calabrian', 'tuscan', 'singaporean', 'cuban', 'chinese', 'hungarian', 'srilankan', 'panasian', 'syrian', 'afghani', 'argentine', 'spanish', 'modern_european', 'tex-mex', 'slovakian', 'cambodian', 'thai', 'belgian', 'czech', 'jaliscan', 'taiwanese', 'newamerican', 'scandinavian', 'malaysian', 'african', 'french', 'guamanian', 'shanghainese', 'british', 'indonesian', 'trinidadian', 'iberian', 'salvadoran', 'indpak', 'ethiopian', 'persian', 'polish', 'nicaraguan', 'newcanadian', 'hawaiian', 'haitian', 'german', 'egyptian', 'turkish'}
-
 geolocator = Nominatim(user_agent='my-applications', timeout=10)
+# same cache as the GCS to BQ flow; set GEOCODE_CACHE_PATH to share one file between them
+geocode_cache = GeocodeCache(os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite"))
 
 def get_api_data(url, headers, term, lat, long, limit = 50):
     """
@@ -84,43 +87,20 @@ def get_api_data(url, headers, term, lat, long, limit = 50):
     :param long: A float64 containing df_location's Longitude
     :return: data
     """
-    # Initialize variables
-    offset = 0
-    data = []
-
-    # Retrieve data from the Yelp API using pagination
-    while True:
-
-        # Set the query parameters for this location
-        parameters = {
-            'limit': 50,
-            'term': term,
-            'is_closed': False,
-            'latitude': lat,
-            'longitude': long,
-            'radius': 25000,
-            'offset': offset
-        }
-        # Make API Request
-        response = requests.get(url, headers=headers, params=parameters)
-
-        # Check for errors and break out of the loop if there are no more results
-        response.raise_for_status()
-        business = response.json().get('businesses', [])
-        if not business:
-            break
-
-        # Append the retrieved data to the overall data list and increment the offset
-        data.extend(business)
-        offset += limit
-
-        # This endpoint returns up to 1000 businesses
-        if offset == 1000:
-            break
-
-    return data
-
-def insert_data_to_db(data, host, user, password, database, tablename):
+    # Retrieve data from the Yelp API using pagination; this endpoint returns up to 1000 businesses
+    return fetch_location_data(url, headers, term, lat, long, radius=25000, limit=limit)
+
+def get_db_writer(host, user, password, database):
+    """
+    Return the bulk writer (and its connection pool) for a database, creating it on first use
+    so every call of the insert functions reuses the same pooled connections.
+    """
+    key = (host, user, database)
+    if key not in db_writers:
+        db_writers[key] = MySQLBulkWriter(host, user, password, database, batch_size=DB_BATCH_SIZE)
+    return db_writers[key]
+
+def insert_data_to_db(data, host, user, password, database, tablename, batch_size=None):
     """
     With data pulled from pull_data_across_locations function, access the MySQL Workbench server to
     write into the database
@@ -130,74 +110,51 @@ def insert_data_to_db(data, host, user, password, database, tablename):
     :param password: password for my MySQL Workbench
     :param database: database name for MySQL Workbench
     :param tablename: tablename in the database for MySQL Workbench
+    :param batch_size: The number of rows per upsert statement; defaults to DB_BATCH_SIZE
+    :return: A dictionary with the number of rows inserted, updated and unchanged
     """
+    columns = ['id', 'alias', 'name', 'image_url', 'is_closed', 'url', 'review_count', 'categories', 'rating',
+               'coordinates', 'transactions', 'price', 'location', 'phone', 'display_phone'] # , 'distance'
+    # Convert the categories list to a JSON formatted string
+    rows = [(item['id'], item['alias'], item['name'], item['image_url'], item['is_closed'], item['url'],
+             item['review_count'], json.dumps(item['categories']), item['rating'], json.dumps(item['coordinates']),
+             json.dumps(item['transactions']),
+             item.get('price', None), json.dumps(item['location']), item['phone'], item['display_phone'])
+            for item in data]
     try:
-        # Connect to the MySQL database called yelpdb
-        mydb = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database
-        )
-
-        # Insert the data into the MySQL table
-        mycursor = mydb.cursor()
-
-        sql = "INSERT INTO {} (id, alias, name, image_url,\
-        is_closed, url, review_count, categories, rating, coordinates, transactions,\
-        price, location, phone, display_phone)\
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)".format(tablename) #, distance ,%s
-
-        for item in data:
-
-            #
-            select_sql = "SELECT id FROM {} WHERE id ='{}'".format(tablename, item['id'])
-            mycursor.execute(select_sql)
-            datapiece = mycursor.fetchone()
-
-            if not datapiece:
-                # Convert the categories list to a JSON formatted string
-                price = item.get('price', None)
-                val = (item['id'], item['alias'], item['name'], item['image_url'], item['is_closed'], item['url'],
-                       item['review_count'], json.dumps(item['categories']), item['rating'], json.dumps(item['coordinates']),
-                       json.dumps(item['transactions']),
-                       price, json.dumps(item['location']), item['phone'], item['display_phone'])
-                mycursor.execute(sql, val)
-        print(data[:10])
-        mydb.commit()
-        print(mycursor.rowcount, "record(s) inserted.")
+        counts = get_db_writer(host, user, password, database).upsert(tablename, columns, rows, batch_size)
+        print(counts['inserted'], "record(s) inserted,", counts['updated'], "record(s) updated.")
+        return counts
     except mysql.connector.Error as error:
         print("Failed to insert record into MySQL table: {}".format(error))
-    finally:
-        if mydb.is_connected():
-            mycursor.close()
-            mydb.close()
-            print("MySQL connection is closed.")
 
-def pull_data_across_locations(url, headers, terms, df_locations):
+def pull_data_across_locations(url, headers, terms, df_locations, concurrency=8):
     """
-    Tap into get_api_data function to retrieve data from Yelp Fusion API
-    using the provided URL, headers, and parameters, and return the JSON data.
+    Tap into the async search client to retrieve data from Yelp Fusion API
+    using the provided URL, headers, and parameters, and write it into the database.
+    Locations are streamed: each one is inserted as soon as it is fetched and dropped afterwards,
+    and fetching pauses while the inserts are behind, so memory does not grow with the number of
+    terms and locations.
     :param url: API Host and search path (ie 'https://api.yelp.com/v3/businesses/search')
     :param headers: a dictionary of headers to send with API requests
     :param terms: A list of terms to include in the API query (ie ['Food', 'Restaurants', 'Coffee & Tea'])
     :param df_locations: A dataframe containing location data like place name, Latitude, and Longitude
-    :return: data
+    :param concurrency: The maximum number of API requests in flight at the same time
+    :return: The number of businesses fetched
     """
-    results = []
+    rows_fetched = 0
+    coordinates = list(zip(df_locations['Latitude'], df_locations['Longitude']))
     for term in terms:
 
-        for i in range(df_locations.shape[0]):
-
-            # Get results from get_api_data
-            result = get_api_data(url, headers, term, df_locations.iloc[i]['Latitude'],
-                                  df_locations.iloc[i]['Longitude'])
+        # Get results location by location from the search client
+        for i, result, _ in stream_term_across_locations(url, headers, term, coordinates,
+                                                         concurrency=concurrency, radius=25000):
             print(term, df_locations.iloc[i]['Name'])
             # Write into MySQL Workbench Server; all db_variables are global except result
             insert_data_to_db(result, db_HOST, db_USER, db_PASSWORD, db_DATABASE, db_TABLE_NAME)
-            results.extend(result)
+            rows_fetched += len(result)
 
-    return results
+    return rows_fetched
 
 def fetch_data_from_mysql(host, user, password, database, tablename):
     """
@@ -240,31 +197,104 @@ def fetch_data_from_mysql(host, user, password, database, tablename):
 
     return df
 
-def geolocate_with_address(row):
-    time.sleep(1)
-    if pd.isna(row['latitude']) and pd.isna(row['longitude']):
-        location = geolocator.geocode(row['address'])
-        if location:
-            row['latitude'] = location.latitude
-            row['longitude'] = location.longitude
-    return row
+def fetch_data_from_mysql_chunks(host, user, password, database, tablename, chunksize=5000, key='id'):
+    """
+    Read a table out of MySQL as DataFrames of at most chunksize rows, in key order.
+    Every chunk is one keyset query (WHERE key > last key ORDER BY key LIMIT chunksize) read in full by a
+    cursor closed before the chunk is yielded, so no result stream stays open while the caller works on
+    a chunk (geocoding at 1 request per second can take longer than MySQL's net_write_timeout), and only
+    one chunk is held in memory at a time.
+    :param host: host for MySQL Workbench
+    :param user: user for MySQL Workbench
+    :param password: password for my MySQL Workbench
+    :param database: database name for MySQL Workbench
+    :param tablename: tablename in the database for MySQL Workbench
+    :param chunksize: The number of rows per chunk
+    :param key: The unique column the chunks are paged by
+    :return: A generator of DataFrames
+    """
+    mydb = mysql.connector.connect(
+        host=host,
+        user=user,
+        password=password,
+        database=database
+    )
+    query = "SELECT * FROM {0} WHERE {1} > %s ORDER BY {1} LIMIT %s".format(tablename, key)
+    first_query = "SELECT * FROM {0} ORDER BY {1} LIMIT %s".format(tablename, key)
+    last_key = None
+    try:
+        while True:
+            cursor = mydb.cursor()
+            try:
+                if last_key is None:
+                    cursor.execute(first_query, (chunksize,))
+                else:
+                    cursor.execute(query, (last_key, chunksize))
+                rows = cursor.fetchall()
+                col_names = [i[0] for i in cursor.description]
+            finally:
+                cursor.close()
+            if not rows:
+                break
+            # the raw value, as numpy scalars cannot be bound as query parameters
+            last_key = rows[-1][col_names.index(key)]
+            yield pd.DataFrame(rows, columns=col_names)
+            if len(rows) < chunksize:
+                break
+    finally:
+        mydb.close()
+
+def transform_mysql_table(host, user, password, database, tablename, cleaned_tablename, chunksize=5000):
+    """
+    Streaming version of fetch_data_from_mysql -> pandas_transformation -> insert_transformed_data_to_db:
+    every chunk read from tablename is cleaned and upserted into cleaned_tablename before the next one
+    is read, so memory stays flat however large the table gets.
+    :param tablename: The raw table to read (ex. 'yelp_restaurant')
+    :param cleaned_tablename: The table the cleaned rows are written to (ex. 'yelp_restaurant_cleaned')
+    :param chunksize: The number of rows read, cleaned and written at a time
+    :return: A dictionary with the number of rows read, inserted, updated and unchanged
+    """
+    totals = {'read': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for chunk in fetch_data_from_mysql_chunks(host, user, password, database, tablename, chunksize):
+        totals['read'] += len(chunk)
+        # the chunk is not used after the transformation, so it does not need to be copied
+        cleaned = pandas_transformation(chunk, copy=False)
+        if not cleaned:
+            continue
+        counts = insert_transformed_data_to_db(cleaned, host, user, password, database, cleaned_tablename)
+        for key, value in (counts or {}).items():
+            totals[key] += value
+    print(totals['read'], "record(s) read,", totals['inserted'], "inserted,", totals['updated'], "updated.")
+    print("city/address normalization:", normalization_stats())
+    return totals
+
+def geolocate_with_address(df):
+    """
+    Fill missing coordinates from the addresses; only addresses not in the geocode cache are requested.
+    """
+    return geocode_cache.fill_missing(df, geolocator.geocode)
 
-def pandas_transformation(df):
+def pandas_transformation(df, copy=True):
     """
 
     :param df:
+    :param copy: Work on a copy of df; pass False when df is not used afterwards (ex. a streamed chunk).
     :return:
     """
     startingtime = time.time()
-    transformed_dataframe = df.copy()
+    transformed_dataframe = df.copy() if copy else df
     # convert 'categories' that were imported as strings to list of dictionaries
     # then transform them into lists that only have alias
     transformed_dataframe['categories'] = transformed_dataframe['categories'].apply(lambda x: json.loads(x))
-    transformed_dataframe['categories'] = transformed_dataframe['categories'].apply(
-        lambda x: [category['alias'] for category in x])
+    aliases = transformed_dataframe['categories'].explode().dropna().str.get('alias')
 
-    transformed_dataframe = transformed_dataframe[transformed_dataframe['categories'].apply(lambda x: any(cat in FOOD_AND_BARS_CATEGORIES for cat in x))]
-    transformed_dataframe = transformed_dataframe[transformed_dataframe['categories'].apply(lambda x: not any(cat in DEFINITELY_NO_CATEGORIES for cat in x))]
+    # keep food and bars, drop definitely useless categories; bitmasks come from the shared category index
+    business_masks = CATEGORY_INDEX.business_masks(aliases).reindex(transformed_dataframe.index, fill_value=0)
+    keep = (business_masks & FOOD_AND_BARS).astype(bool) & ~(business_masks & DEFINITELY_NO).astype(bool)
+    transformed_dataframe = transformed_dataframe[keep]
+    if transformed_dataframe.empty:
+        return []
+    transformed_dataframe['categories'] = aliases.groupby(level=0).agg(list).reindex(transformed_dataframe.index)
 
     # convert 'categories' that were imported as strings to dictionaries
     transformed_dataframe['coordinates'] = transformed_dataframe['coordinates'].apply(lambda x: json.loads(x))
@@ -275,27 +305,25 @@ def pandas_transformation(df):
     transformed_dataframe['location'] = transformed_dataframe['location'].apply(lambda x: json.loads(x))
 
     # only have addresses that are in "CA" for state and start with 9 for 'zip_code'
-    transformed_dataframe = transformed_dataframe[transformed_dataframe['location'].apply(lambda x: x['state'] == 'CA' and x['zip_code'].startswith('9'))]
+    location = pd.json_normalize(transformed_dataframe['location'].tolist(), max_level=0)\
+        .set_index(transformed_dataframe.index)
+    in_california = (location['state'] == 'CA') & location['zip_code'].str.startswith('9', na=False)
+    transformed_dataframe = transformed_dataframe[in_california]
+    location = location[in_california]
 
-    # add 'city' column for easy parsing in the future
-    transformed_dataframe['city'] = transformed_dataframe['location'].apply(lambda x: (str(x['city']).replace('  ', ' ').replace(',', '').lower().rstrip()))
+    # add 'city' column for easy parsing in the future; cities and addresses are normalized once per
+    # distinct value, shared with the GCS to BQ transform (see prefect/location_normalizer.py)
+    transformed_dataframe['city'] = CITIES.normalize(location['city'])
 
     # clean up 'location' column from dictionary to usual address
-    transformed_dataframe['address'] = transformed_dataframe['location'].apply(
-        lambda x: (str(x['address1']) + ', ' + str(x['city'].rstrip()) + ' ' + str(x['state']) + ' ' + str(x['zip_code'])) if (
-                    x['address2'] is None or x['address2'] == '') else (
-                    str(x['address1']) + ' ' + str(x['address2']) + ', '
-                    + str(x['city'].replace('  ', ' ').replace(',', '').rstrip())
-                    + ' ' + str(x['state']) + ' ' + str(x['zip_code'])))
+    transformed_dataframe['address'] = build_addresses(location)
 
     # delete any 'address' that start with ', San Jose CA'
     transformed_dataframe['address'] = transformed_dataframe['address'].str.lstrip(', ')
     # a = transformed_dataframe[transformed_dataframe['price'].isna()]
     # print(a['price'])
 
-    c = transformed_dataframe.loc[transformed_dataframe['latitude'].isna()]\
-        .apply(lambda x: geolocate_with_address(x), axis = 1)
-    transformed_dataframe.loc[transformed_dataframe['latitude'].isna()] = c
+    transformed_dataframe = geolocate_with_address(transformed_dataframe)
 
     # imputation of price for none (about 33% are missing value for price) - https://krrai77.medium.com/using-fancyimpute-in-python-eadcffece782
     # print(transformed_dataframe['price'].value_counts().sort_values(ascending=False))
@@ -316,7 +344,7 @@ def pandas_transformation(df):
     return export_data
 
 
-def insert_transformed_data_to_db(data, host, user, password, database, tablename):
+def insert_transformed_data_to_db(data, host, user, password, database, tablename, batch_size=None):
     """
     With data pulled from pull_data_across_locations function, access the MySQL Workbench server to
     write into the database
@@ -326,65 +354,39 @@ def insert_transformed_data_to_db(data, host, user, password, database, tablenam
     :param password: password for my MySQL Workbench
     :param database: database name for MySQL Workbench
     :param tablename: tablename in the database for MySQL Workbench
+    :param batch_size: The number of rows per upsert statement; defaults to DB_BATCH_SIZE
+    :return: A dictionary with the number of rows inserted, updated and unchanged
     """
+    columns = ['id', 'alias', 'name', 'url', 'review_count', 'categories', 'rating', 'price',
+               'latitude', 'longitude', 'city', 'address']
+    # Convert the categories list to a JSON formatted string
+    rows = [(item['id'], item['alias'], item['name'], item['url'], item['review_count'],
+             json.dumps(item['categories']), item['rating'], item.get('price', None),
+             item.get('latitude', None), item.get('longitude', None), item['city'], item['address'])
+            for item in data]
     try:
-        # Connect to the MySQL database called yelpdb
-        mydb = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database
-        )
-
-        # Insert the data into the MySQL table
-        mycursor = mydb.cursor()
-
-        sql = "INSERT INTO {} (id, alias, name,\
-        url, review_count, categories, rating, price, latitude, longitude, city, address)\
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)".format(tablename)
-
-        for item in data:
-
-            select_sql = "SELECT id FROM {} WHERE id ='{}'".format(tablename, item['id'])
-            mycursor.execute(select_sql)
-            datapiece = mycursor.fetchone()
-
-            if not datapiece:
-                # Convert the categories list to a JSON formatted string
-                price = item.get('price', None)
-                latitude = item.get('latitude', None)
-                longitude = item.get('longitude', None)
-                val = (item['id'], item['alias'], item['name'], item['url'], item['review_count'],
-                       json.dumps(item['categories']), item['rating'], price, latitude, longitude,
-                       item['city'], item['address'])
-
-                # print(f"Executing SQL query: {sql} with values {val}")
-                mycursor.execute(sql, val)
-
-        print(data[:10])
-        mydb.commit()
-        print(mycursor.rowcount, "record(s) inserted.")
+        counts = get_db_writer(host, user, password, database).upsert(tablename, columns, rows, batch_size)
+        print(counts['inserted'], "record(s) inserted,", counts['updated'], "record(s) updated.")
+        return counts
     except mysql.connector.Error as error:
         print("Failed to insert record into MySQL table: {}".format(error))
-    finally:
-        if mydb.is_connected():
-            mycursor.close()
-            mydb.close()
-            print("MySQL connection is closed.")
 
 
-test_result = pull_data_across_locations(URL, HEADERS, TERMS, df_locations[::48]) # after finishing 48, start with [76::]
-# DTYPE_DICT = {'id':str, 'alias':str, 'name':str, 'image_url':str, 'is_closed':bool, 'url':str, 'review_count':int, 'categories':list, 'rating':float, 'coordinates':dict, 'transactions':list, 'price':str, 'location':dict, 'phone':str, 'display_phone':str}
+if __name__ == "__main__":
+    rows_fetched = pull_data_across_locations(URL, HEADERS, TERMS, df_locations[::48]) # after finishing 48, start with [76::]
+    # DTYPE_DICT = {'id':str, 'alias':str, 'name':str, 'image_url':str, 'is_closed':bool, 'url':str, 'review_count':int, 'categories':list, 'rating':float, 'coordinates':dict, 'transactions':list, 'price':str, 'location':dict, 'phone':str, 'display_phone':str}
 
-# dataframe = fetch_data_from_mysql(db_HOST, db_USER, db_PASSWORD, db_DATABASE, db_TABLE_NAME)
-# transformed_df = pandas_transformation(dataframe)
-# insert_transformed_data_to_db(transformed_df,db_HOST, db_USER, db_PASSWORD, db_DATABASE, 'yelp_restaurant_cleaned')
+    # dataframe = fetch_data_from_mysql(db_HOST, db_USER, db_PASSWORD, db_DATABASE, db_TABLE_NAME)
+    # transformed_df = pandas_transformation(dataframe)
+    # insert_transformed_data_to_db(transformed_df,db_HOST, db_USER, db_PASSWORD, db_DATABASE, 'yelp_restaurant_cleaned')
+    # or, with flat memory for large tables:
+    # transform_mysql_table(db_HOST, db_USER, db_PASSWORD, db_DATABASE, db_TABLE_NAME, 'yelp_restaurant_cleaned')
 
 
 
 
-print("Code running completed.")
-print ("My program took", time.time() - start_time, "to run")
+    print("Code running completed.")
+    print ("My program took", time.time() - start_time, "to run")
 
 """
 df["categories"] = df["categories"].apply(lambda x: ', '.join(str(element) for element in x))
@@ -2,7 +2,7 @@
 
 SELECT
     LOWER(City) as city,
-    LOWER(`County Name`) as county,
+    LOWER({{ adapter.quote("County Name") }}) as county,
     State as state,
     Zip as zipcode
 
@@ -18,66 +18,32 @@ restaurants_data as (
 desserts_data as (
     select *
     from {{ ref('stg_desserts') }}
-    where (categories != "coffee") 
-      AND (categories NOT LIKE "%coffeeroasteries%") 
-      AND (categories NOT LIKE "%wine%") 
-      AND (categories NOT LIKE "%burgers%") 
-      AND (categories NOT LIKE "%hotdogs%") 
-      AND (categories NOT LIKE "%breakfast_brunch%") 
-      AND (categories NOT LIKE "%breweries%") 
-      AND (categories NOT LIKE "%brewpubs%") 
-      AND (categories NOT LIKE "%pizza%") 
-      AND (categories NOT LIKE "%coffee, sandwiches%") 
-      AND (categories NOT LIKE "%foodtrucks%") 
-      AND (categories NOT LIKE "%sandwiches, coffee%") 
-      AND (categories NOT LIKE "%coffee, sandwiches%") 
-      AND (categories NOT LIKE "%market%") 
-      AND (categories NOT LIKE "%poke%") 
-      AND (categories NOT LIKE "%pretzel%") 
-      AND (categories NOT LIKE "%chicken%") 
-      AND (alias NOT LIKE "pho")
 ),
 
 cafe_data as (
     select *
     from {{ ref('stg_cafes') }}
-    where (categories LIKE '%desserts%' AND categories LIKE '%juicebars%' AND categories LIKE '%coffee%')
-        OR (categories LIKE '%cafes%')
-        OR (LOWER(name) LIKE '%cafe%' AND categories LIKE '%cafes%')
-        OR (LOWER(name) LIKE '%coffee%' AND categories LIKE '%cafes%')
-        OR (categories LIKE '%coffee%' AND categories LIKE '%desserts%')
-        OR (categories LIKE '%coffee%' AND ARRAY_LENGTH(SPLIT(categories, ',')) = 1)
-        OR (categories LIKE '%tea%')
-),
-
-exclusion_data as (
-    select * from desserts_data
-    union all
-    select * from cafe_data
-),
-
-filtered_restaurants_data as (
-    select r.*
-    from restaurants_data as r
-    left join exclusion_data as e
-    on r.id = e.id
-    where e.id is null
-
 ),
 
+-- type is labelled in the transform with the former LIKE rules (prefect/business_type.py, macros/yelp_type.sql);
+-- desserts and cafe shops the rules exclude have no type
 yelp_dup as (
-    select *, 'restaurants' as type from filtered_restaurants_data
+    select * from restaurants_data where type is not null
     union all
-    select *, 'desserts' as type from desserts_data
+    select * from desserts_data where type is not null
     union all
-    select *, 'cafe' as type from cafe_data
+    select * from cafe_data where type is not null
 ),
 
+-- one row per id: desserts, then cafe, then restaurants, as the former anti-join of restaurants did
 yelp_all as (
     SELECT *
     FROM (
         SELECT *,
-            ROW_NUMBER() OVER(PARTITION BY id) as rn
+            ROW_NUMBER() OVER(
+                PARTITION BY id
+                ORDER BY CASE type WHEN 'desserts' THEN 1 WHEN 'cafe' THEN 2 ELSE 3 END
+            ) as rn
         FROM yelp_dup
     )
     WHERE rn = 1
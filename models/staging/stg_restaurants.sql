@@ -2,13 +2,13 @@
 
 with restaurants_rawdata as (
     select *
-    from {{ source('staging', 'Restaurants_data_raw')  }}
+    from {{ yelp_business_source('Restaurants_data_raw') }}
     where id is not null
 ),
 
 food_rawdata as (
     select *
-    from {{ source('staging', 'Food_data_raw') }}
+    from {{ yelp_business_source('Food_data_raw') }}
     where id is not null
 ),
 
@@ -31,13 +31,15 @@ SELECT
     CAST(t.review_count AS INTEGER) AS review_count,
     ARRAY_TO_STRING(t.categories, ', ') as categories,
     ARRAY_TO_STRING(t. ethnic_category, ', ') as ethnic_category,
-    CAST(t.rating AS NUMERIC) AS rating,
+    CAST(t.rating AS {{ dbt.type_numeric() }}) AS rating,
     CAST(t.price AS STRING) AS price,
-    CAST(t.latitude AS NUMERIC) AS latitude,
-    CAST(t.longitude AS NUMERIC) AS longitude,
+    CAST(t.latitude AS {{ dbt.type_numeric() }}) AS latitude,
+    CAST(t.longitude AS {{ dbt.type_numeric() }}) AS longitude,
     {{ get_coordinates('latitude', 'longitude') }} as coordinate,
     CAST(t.city AS STRING) AS city,
-    CAST(t.address AS STRING) AS address
+    CAST(t.address AS STRING) AS address,
+    -- labelled in the transform (prefect/business_type.py); the SQL rules label rows loaded before that
+    COALESCE(CAST(t.type AS STRING), {{ yelp_type('restaurants', "ARRAY_TO_STRING(t.categories, ', ')", 't.alias', 't.name') }}) AS type
 FROM restaurants_unioned_deduped t
 
 -- # CROSS JOIN attempt generated way too many rows; decided on making them into string separated by comma. 
@@ -49,8 +51,9 @@ FROM restaurants_unioned_deduped t
 
 
 -- dbt build --m <model.sql> --vars 'is_test_run: false'
+-- the local DuckDB target (prefect/duckdb_warehouse.py) builds the full data unless is_test_run is set
 
-{% if var('is_test_run', default=true) %}
+{% if var('is_test_run', default=target.type != 'duckdb') %}
 
     LIMIT 100
 
@@ -0,0 +1,73 @@
+from mysql.connector import pooling
+
+"""
+Bulk upserts into the MySQL tables main.py writes to.
+
+Instead of a SELECT and a single row INSERT per business over a new connection every call, rows are
+written in batches with one executemany INSERT ... ON DUPLICATE KEY UPDATE statement per batch
+(mysql.connector sends it as a single multi-row INSERT), over connections taken from a reusable pool.
+A batch costs two round-trips: one to find which of its ids already exist, so the inserted and
+updated counts are exact, and one for the upsert itself.
+"""
+
+
+class MySQLBulkWriter:
+    """
+    Pooled, batched INSERT ... ON DUPLICATE KEY UPDATE writer.
+    """
+
+    def __init__(self, host, user, password, database, pool_size=4, batch_size=1000, pool_name='yelpdb'):
+        """
+        :param host: host for MySQL Workbench
+        :param user: user for MySQL Workbench
+        :param password: password for my MySQL Workbench
+        :param database: database name for MySQL Workbench
+        :param pool_size: The number of connections kept open in the pool.
+        :param batch_size: The number of rows sent in one upsert statement.
+        :param pool_name: The name of the connection pool.
+        """
+        self.pool = pooling.MySQLConnectionPool(pool_name=pool_name, pool_size=pool_size, host=host,
+                                                user=user, password=password, database=database)
+        self.batch_size = batch_size
+
+    def upsert(self, tablename, columns, rows, batch_size=None):
+        """
+        Insert rows, updating the rows whose key already exists.
+
+        :param tablename: tablename in the database for MySQL Workbench
+        :param columns: The column names; the first one is the primary key (ex. 'id').
+        :param rows: A list of tuples in the order of columns. When a key repeats, the last row wins.
+        :param batch_size: Overrides the batch size of the writer.
+        :return: A dictionary with the number of rows inserted, updated (changed) and unchanged.
+        """
+        batch_size = batch_size or self.batch_size
+        key = columns[0]
+        sql = "INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+            tablename, ', '.join(columns), ', '.join(['%s'] * len(columns)),
+            ', '.join(f"{column} = VALUES({column})" for column in columns[1:]))
+
+        # a key repeated within the rows would be counted as an update of itself
+        rows = list({row[0]: row for row in rows}.values())
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        connection = self.pool.get_connection()
+        try:
+            cursor = connection.cursor()
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                ids = [row[0] for row in batch]
+                cursor.execute("SELECT {0} FROM {1} WHERE {0} IN ({2})".format(
+                    key, tablename, ', '.join(['%s'] * len(ids))), ids)
+                existing = len(cursor.fetchall())
+                cursor.executemany(sql, batch)
+                # MySQL reports 1 affected row per insert, 2 per changed row and 0 per unchanged row
+                inserted = len(batch) - existing
+                updated = (cursor.rowcount - inserted) // 2
+                counts['inserted'] += inserted
+                counts['updated'] += updated
+                counts['unchanged'] += existing - updated
+                connection.commit()
+            cursor.close()
+        finally:
+            # returns the connection to the pool
+            connection.close()
+        return counts
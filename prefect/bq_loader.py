@@ -0,0 +1,141 @@
+import io
+import time
+from google.cloud import bigquery
+from parquet_io import parquet_bytes
+from pipeline_metrics import METRICS
+
+"""
+Batching loader for the cleaned NDJSON of many locations.
+
+Instead of one blocking load job per location file, the NDJSON of many locations is buffered per
+target table and submitted as one load job once a row or byte threshold is reached. Jobs are not
+waited on when they are submitted; close() waits for all of them at the end and collects their errors.
+With a Parquet job configuration, the buffered chunks are Arrow tables that are written into one
+Parquet file per load job instead.
+
+The client only needs load_table_from_file(file_obj, table_id, job_config=...) returning a job with
+result() and errors, so a local stand-in that records the submitted payloads can replace
+bigquery.Client in tests.
+"""
+
+
+def yelp_load_job_config(source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, allow_field_addition=True):
+    """
+    Load job configuration with the schema of the {term}_data_raw tables.
+    Parquet loads read the list columns (categories, ethnic_category) as REPEATED columns.
+
+    :param allow_field_addition: Add the columns missing from the table (tables created before the type
+                                 label get the column on their next load). Only for appends: BigQuery
+                                 rejects schema update options on a WRITE_TRUNCATE load of a
+                                 non-partitioned table.
+    """
+    job_config = bigquery.LoadJobConfig(
+        schema=[
+            bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("alias", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("url", "STRING"),
+            bigquery.SchemaField("review_count", "INTEGER"),
+            bigquery.SchemaField("categories", "STRING", mode="REPEATED"),
+            bigquery.SchemaField("ethnic_category", "STRING", mode="REPEATED"),
+            bigquery.SchemaField("rating", "FLOAT"),
+            bigquery.SchemaField("price", "STRING"),
+            bigquery.SchemaField("latitude", "FLOAT"),
+            bigquery.SchemaField("longitude", "FLOAT"),
+            bigquery.SchemaField("city", "STRING"),
+            bigquery.SchemaField("address", "STRING"),
+            bigquery.SchemaField("type", "STRING")
+            ],
+        source_format=source_format,
+    )
+    if allow_field_addition:
+        job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+    if source_format == bigquery.SourceFormat.PARQUET:
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config.parquet_options = parquet_options
+    return job_config
+
+
+class BatchedBigQueryLoader:
+    """
+    Buffers NDJSON per table and submits it in few large load jobs.
+    """
+
+    def __init__(self, client, job_config=None, flush_rows=50000, flush_bytes=64 * 1024 * 1024):
+        """
+        :param client: A bigquery.Client, or a stand-in with the same load_table_from_file method.
+        :param job_config: The load job configuration; defaults to yelp_load_job_config().
+        :param flush_rows: Submit a table's buffer once it holds this many rows.
+        :param flush_bytes: Submit a table's buffer once it holds this many bytes.
+        """
+        self.client = client
+        self.job_config = job_config or yelp_load_job_config()
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.parquet = self.job_config.source_format == bigquery.SourceFormat.PARQUET
+        self._buffers = {}
+        self._jobs = []
+
+    def add(self, table_id, ndjson, rows, tag=None):
+        """
+        Buffer the export of one file.
+
+        :param table_id: The target table (ex. 'yelp_data_raw_prod.Restaurants_data_raw').
+        :param ndjson: Newline delimited JSON as returned by read_json_transform_df, or an Arrow table
+                       when the job configuration is Parquet.
+        :param rows: The number of rows in ndjson.
+        :param tag: Anything identifying the file; close() reports back the tags of the loaded files.
+        """
+        buffer = self._buffers.setdefault(table_id, {'chunks': [], 'rows': 0, 'bytes': 0, 'tags': []})
+        if rows:
+            chunk = ndjson if self.parquet or ndjson.endswith('\n') else ndjson + '\n'
+            buffer['chunks'].append(chunk)
+            buffer['rows'] += rows
+            buffer['bytes'] += chunk.nbytes if self.parquet else len(chunk)
+        buffer['tags'].append(tag)
+        if buffer['rows'] >= self.flush_rows or buffer['bytes'] >= self.flush_bytes:
+            self.flush(table_id)
+
+    def flush(self, table_id=None):
+        """
+        Submit the buffer of a table, or of every table, as load jobs without waiting for them.
+        """
+        for table in ([table_id] if table_id else list(self._buffers)):
+            buffer = self._buffers.pop(table, None)
+            if buffer is None:
+                continue
+            job = None
+            if buffer['rows']:
+                payload = parquet_bytes(buffer['chunks']) if self.parquet else io.StringIO(''.join(buffer['chunks']))
+                job = self.client.load_table_from_file(payload, table, job_config=self.job_config)
+                METRICS.incr('bq_bytes_submitted_total', buffer['bytes'])
+            self._jobs.append((table, job, buffer['tags'], buffer['rows']))
+
+    def close(self):
+        """
+        Submit what is left, then wait for every job.
+
+        :return: The tags of the files whose rows were loaded, and a list of (table_id, errors) for failed jobs.
+        """
+        self.flush()
+        loaded = []
+        errors = []
+        for table, job, tags, rows in self._jobs:
+            if job is not None:
+                start = time.perf_counter()
+                try:
+                    job.result()
+                except Exception as e:
+                    METRICS.incr('bq_load_jobs_total', status='failed')
+                    errors.append((table, job.errors or str(e)))
+                    continue
+                # the job ran in BigQuery while the flow went on; prefer its own timestamps to the wait
+                started, ended = getattr(job, 'started', None), getattr(job, 'ended', None)
+                duration = (ended - started).total_seconds() if started and ended else time.perf_counter() - start
+                METRICS.observe('bq_load_seconds', duration)
+                METRICS.incr('bq_load_jobs_total', status='done')
+                METRICS.incr('bq_rows_loaded_total', rows)
+            loaded.extend(tags)
+        self._jobs = []
+        return loaded, errors
@@ -0,0 +1,214 @@
+import io
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from query_planner import haversine_m
+
+"""
+Geohash grid index over the cleaned businesses, for "businesses within X km of a point" questions.
+
+Every business is put in the geohash cell of its coordinates and the businesses are stored sorted by
+cell, so the businesses of a cell are one contiguous slice found with a binary search. A radius query
+only enumerates the cells of the bounding box of its circle and computes the haversine distance
+(query_planner.haversine_m, vectorized) of the businesses in those cells, instead of scanning every
+business. Nearest neighbours widen the radius until enough businesses are found, and cell_stats
+aggregates the count and mean rating of each cell by type.
+
+Cells are geohash cells: the longitude and latitude bits of the cell are interleaved, longitude first,
+and written in base 32. The default precision of 6 characters gives cells of about 0.6 km x 1 km in
+California. The GCS to BQ flow builds a grid per term from the cleaned rows it loads and stores it as
+business_grid-{term}.parquet next to the landed files; BusinessGrid.load reads it back.
+"""
+
+PRECISION = 6
+BASE32 = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+GRID_COLUMNS = ['id', 'name', 'type', 'rating', 'latitude', 'longitude']
+PRECISION_METADATA_KEY = b'geohash_precision'
+
+
+def cell_bits(precision):
+    """
+    :return: The number of longitude and latitude bits of a geohash of precision characters.
+    """
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def cell_coordinates(lat, long, precision=PRECISION):
+    """
+    The integer row (latitude) and column (longitude) of the cells of points.
+    """
+    lon_bits, lat_bits = cell_bits(precision)
+    rows = np.floor((np.asarray(lat, dtype=float) + 90) / 180 * (1 << lat_bits)).astype(np.int64)
+    columns = np.floor((np.asarray(long, dtype=float) + 180) / 360 * (1 << lon_bits)).astype(np.int64)
+    return np.clip(rows, 0, (1 << lat_bits) - 1), np.clip(columns, 0, (1 << lon_bits) - 1)
+
+
+def cell_codes(rows, columns, precision=PRECISION):
+    """
+    Interleave the bits of cell rows and columns into geohash integers; nearby cells get nearby codes.
+    """
+    lon_bits, lat_bits = cell_bits(precision)
+    rows, columns = np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)
+    codes = np.zeros(np.broadcast(rows, columns).shape, dtype=np.int64)
+    for bit in range(5 * precision):
+        # even bits (from the most significant) are longitude bits, odd bits latitude bits
+        if bit % 2 == 0:
+            value = (columns >> (lon_bits - 1 - bit // 2)) & 1
+        else:
+            value = (rows >> (lat_bits - 1 - bit // 2)) & 1
+        codes = (codes << 1) | value
+    return codes
+
+
+def geohash(codes, precision=PRECISION):
+    """
+    The base 32 geohash strings of geohash integers.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    chars = [BASE32[(codes >> (5 * (precision - 1 - i))) & 31] for i in range(precision)]
+    return np.array([''.join(cell) for cell in zip(*chars)] if len(codes) else [], dtype=object)
+
+
+def grid_frame(export_data):
+    """
+    The columns the grid needs from an export_businesses result (newline delimited JSON or an Arrow table).
+    """
+    if isinstance(export_data, str):
+        if not export_data:
+            return pd.DataFrame(columns=GRID_COLUMNS)
+        return pd.read_json(io.StringIO(export_data), lines=True, dtype={'id': str})[GRID_COLUMNS]
+    return export_data.select(GRID_COLUMNS).to_pandas()
+
+
+class BusinessGrid:
+    """
+    Businesses sorted by geohash cell, with radius, nearest neighbour and per-cell queries.
+    """
+
+    def __init__(self, df, precision=PRECISION):
+        """
+        :param df: A DataFrame with at least the GRID_COLUMNS of cleaned businesses; businesses without
+                   coordinates are left out, and an id found several times is kept once.
+        :param precision: The number of geohash characters of the cells.
+        """
+        df = df.dropna(subset=['latitude', 'longitude']).drop_duplicates('id')
+        rows, columns = cell_coordinates(df['latitude'], df['longitude'], precision)
+        codes = cell_codes(rows, columns, precision)
+        order = np.argsort(codes, kind='stable')
+        self.precision = precision
+        self.businesses = df.iloc[order].reset_index(drop=True)
+        self.latitudes = self.businesses['latitude'].to_numpy(dtype=float)
+        self.longitudes = self.businesses['longitude'].to_numpy(dtype=float)
+        # the occupied cells, and the slice of the sorted businesses each one holds
+        self.cells, self.starts, self.sizes = np.unique(codes[order], return_index=True, return_counts=True)
+        self.cell_rows, self.cell_columns = rows[order][self.starts], columns[order][self.starts]
+
+    def __len__(self):
+        return len(self.businesses)
+
+    def cell_of_businesses(self):
+        """
+        :return: The index in self.cells of the cell of every business.
+        """
+        return np.repeat(np.arange(len(self.cells)), self.sizes)
+
+    def candidates(self, lat, long, radius_m):
+        """
+        The positions of the businesses in the cells overlapping the bounding box of a circle.
+        """
+        lon_bits, _ = cell_bits(self.precision)
+        dlat = np.degrees(radius_m / 6371008.8)
+        (row_min, row_max), (column_min, column_max) = cell_coordinates([lat - dlat, lat + dlat], [long, long],
+                                                                        self.precision)
+        # the box spans every longitude when it reaches a pole or the antimeridian
+        if abs(lat) + dlat >= 90 or dlat / np.cos(np.radians(abs(lat) + dlat)) >= 180:
+            column_min, column_max = 0, (1 << lon_bits) - 1
+        else:
+            dlong = dlat / np.cos(np.radians(abs(lat) + dlat))
+            if long - dlong < -180 or long + dlong > 180:
+                column_min, column_max = 0, (1 << lon_bits) - 1
+            else:
+                (_, _), (column_min, column_max) = cell_coordinates([lat, lat], [long - dlong, long + dlong],
+                                                                    self.precision)
+        box_cells = (row_max - row_min + 1) * (column_max - column_min + 1)
+        if box_cells <= len(self.cells):
+            # look up every cell of the box among the occupied cells
+            rows = np.arange(row_min, row_max + 1)
+            columns = np.arange(column_min, column_max + 1)
+            codes = cell_codes(rows[:, None], columns[None, :], self.precision).ravel()
+            found = np.searchsorted(self.cells, codes)
+            inside = found < len(self.cells)
+            found, codes = found[inside], codes[inside]
+            cells = found[self.cells[found] == codes]
+        else:
+            # a box larger than the occupied cells: keep the occupied cells inside it
+            cells = np.flatnonzero((self.cell_rows >= row_min) & (self.cell_rows <= row_max)
+                                   & (self.cell_columns >= column_min) & (self.cell_columns <= column_max))
+        sizes = self.sizes[cells]
+        # concatenate the slices of the cells without a Python loop
+        offsets = np.repeat(self.starts[cells] - np.cumsum(sizes) + sizes, sizes)
+        return offsets + np.arange(sizes.sum())
+
+    def radius(self, lat, long, radius_m):
+        """
+        The businesses within a distance of a point.
+
+        :param lat: The latitude of the point.
+        :param long: The longitude of the point.
+        :param radius_m: The distance in meters.
+        :return: A DataFrame of the businesses with their distance_m, nearest first.
+        """
+        positions = self.candidates(lat, long, radius_m)
+        distances = haversine_m(lat, long, self.latitudes[positions], self.longitudes[positions])
+        within = distances <= radius_m
+        result = self.businesses.iloc[positions[within]].assign(distance_m=distances[within])
+        return result.sort_values('distance_m', kind='stable').reset_index(drop=True)
+
+    def nearest(self, lat, long, k=10, radius_m=1000):
+        """
+        The k businesses nearest to a point. The search radius starts at radius_m and doubles until k
+        businesses are within it; every business within the radius is found, so they are the k nearest.
+
+        :return: A DataFrame of at most k businesses with their distance_m, nearest first.
+        """
+        while True:
+            result = self.radius(lat, long, radius_m)
+            # half the circumference of the earth holds every business
+            if len(result) >= k or radius_m >= 20037509:
+                return result.head(k)
+            radius_m *= 2
+
+    def cell_stats(self, by='type'):
+        """
+        The number of businesses and their mean rating per cell and per value of a column.
+
+        :param by: The column to break the cells down by; None aggregates whole cells.
+        :return: A DataFrame of geohash, the by column, count and mean_rating.
+        """
+        cells = geohash(self.cells, self.precision)[self.cell_of_businesses()]
+        keys = [cells] + ([self.businesses[by].fillna('unknown')] if by else [])
+        names = ['geohash'] + ([by] if by else [])
+        stats = self.businesses.groupby(keys, sort=True)['rating'].agg(['size', 'mean'])
+        stats.index.names = names
+        return stats.rename(columns={'size': 'count', 'mean': 'mean_rating'}).reset_index()
+
+    def save(self, path):
+        """
+        Store the businesses, their geohash and the precision of the grid in a Parquet file.
+        """
+        cells = geohash(self.cells, self.precision)[self.cell_of_businesses()]
+        table = pa.Table.from_pandas(self.businesses.assign(geohash=cells), preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), PRECISION_METADATA_KEY: str(self.precision).encode()}
+        pq.write_table(table.replace_schema_metadata(metadata), path, compression='zstd')
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a grid stored with save.
+        """
+        table = pq.read_table(path)
+        precision = int(table.schema.metadata.get(PRECISION_METADATA_KEY, str(PRECISION).encode()))
+        return cls(table.drop(['geohash']).to_pandas(), precision)
@@ -0,0 +1,94 @@
+import re
+import pandas as pd
+
+"""
+The restaurants/desserts/cafe label of fact_yelp_all, computed once per business in the transform.
+
+models/core/fact_yelp_all.sql used to classify businesses at every rebuild with chains of LIKE
+'%...%' over the ', '-joined categories of the staging models, then anti-join the restaurants against
+the desserts and cafes and deduplicate. business_types applies the same rules to the categories list
+of the cleaned businesses, so the label is loaded with the rows and the fact model only selects.
+
+The rules are a literal translation of the SQL, quirks included: LIKE '%x%' is a substring test on the
+joined string in which '_' matches any character (so '%tea%' also matches 'steakhouses'), LIKE without
+a wildcard (alias NOT LIKE "pho") is an equality, and ARRAY_LENGTH(SPLIT(categories, ',')) = 1 means a
+single category.
+The rules depend on the table a business was loaded into, ie. the first word of its search term:
+    Restaurants, Food - 'restaurants'
+    Desserts          - 'desserts' unless excluded by the desserts filter, else None
+    Coffee            - 'cafe' when matched by the cafe filter, else None
+The fact model keeps one row per id, preferring desserts, then cafe, then restaurants, which is what
+the anti-join did (the SQL picked between desserts and cafe arbitrarily; the label prefers desserts).
+
+seeds/business_type_golden.csv holds representative cases with the expected label. The dbt test
+tests/assert_business_type_golden.sql checks the SQL rules (macros/yelp_type.sql) against it, and the
+pytest prefect/tests/test_business_type.py checks these Python rules against it.
+"""
+
+TERM_GROUPS = {'Restaurants': 'restaurants', 'Food': 'restaurants', 'Desserts': 'desserts', 'Coffee': 'cafe'}
+
+# categories NOT LIKE '%...%' of the desserts filter
+DESSERTS_EXCLUDED = ['coffeeroasteries', 'wine', 'burgers', 'hotdogs', 'breakfast_brunch', 'breweries', 'brewpubs',
+                     'pizza', 'coffee, sandwiches', 'foodtrucks', 'sandwiches, coffee', 'market', 'poke', 'pretzel',
+                     'chicken']
+
+
+def term_group(term):
+    """
+    The label group of a search term, from the table its businesses are loaded into ({first word}_data_raw).
+
+    :return: 'restaurants', 'desserts', 'cafe', or None for terms the fact model does not read.
+    """
+    return TERM_GROUPS.get(re.split(r'\s+', term)[0])
+
+
+def business_types(df, group):
+    """
+    The type label of every cleaned business of one term.
+
+    :param df: A DataFrame with the cleaned 'categories' lists and the 'alias' and 'name' of the businesses.
+    :param group: The term_group of the term the businesses were searched with.
+    :return: A Series of 'restaurants', 'desserts', 'cafe' or None, aligned with df.
+    """
+    if group == 'restaurants':
+        return pd.Series('restaurants', index=df.index, dtype=object)
+    if group not in ('desserts', 'cafe') or df.empty:
+        return pd.Series(None, index=df.index, dtype=object)
+
+    categories = df['categories'].map(lambda aliases: ', '.join(aliases) if isinstance(aliases, list) else '')
+
+    def like(pattern):
+        # LIKE '%pattern%': '_' matches any single character
+        return categories.str.contains(re.escape(pattern).replace('_', '.'), regex=True)
+
+    if group == 'desserts':
+        keep = (categories != 'coffee') & (df['alias'] != 'pho')
+        for pattern in DESSERTS_EXCLUDED:
+            keep &= ~like(pattern)
+        label = 'desserts'
+    else:
+        name = df['name'].fillna('').str.lower()
+        single = df['categories'].map(lambda aliases: isinstance(aliases, list) and len(aliases) <= 1)
+        keep = ((like('desserts') & like('juicebars') & like('coffee'))
+                | like('cafes')
+                | (name.str.contains('cafe', regex=False) & like('cafes'))
+                | (name.str.contains('coffee', regex=False) & like('cafes'))
+                | (like('coffee') & like('desserts'))
+                | (like('coffee') & single)
+                | like('tea'))
+        label = 'cafe'
+    return pd.Series(None, index=df.index, dtype=object).mask(keep, label)
+
+
+def check_golden(path):
+    """
+    Compare business_types with the expected labels of the golden file.
+
+    :return: The rows whose label differs; empty when the rules match.
+    """
+    golden = pd.read_csv(path, keep_default_na=False)
+    golden['categories'] = golden['categories'].map(lambda joined: joined.split(', ') if joined else [])
+    actual = pd.concat([business_types(rows, group) for group, rows in golden.groupby('source_group', sort=False)])
+    golden['type'] = actual.reindex(golden.index)
+    return golden[golden['type'].fillna('') != golden['expected_type']]
+
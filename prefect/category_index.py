@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+"""
+Compiled category classification index shared by the Prefect transform and main.py.
+
+The category sets below were obtained after EDA into the categories returned by the Yelp Fusion API.
+Every alias is given an integer ID and a bitmask of the classes (sets) it belongs to, built once at
+import. Filtering businesses and deriving ethnic_category then become bitmask operations over a whole
+exploded column of aliases instead of per-business set lookups in Python.
+"""
+
+# Below sets were obtained after EDA into categories.
+# NONFOOD_CATEGORIES and DEFINITELY_NO_CATEGORIES need to be cleaned out since they are nonrelated categories
+NONFOOD_CATEGORIES = {'copyshops', 'bikes', 'seafoodmarkets', 'cheese','importedfood','buildingsupplies', 'pumpkinpatches', 'hardware', 'vitaminssupplements', 'cannabisdispensaries', 'artclasses', 'horse_boarding', 'pilates', 'sewingalterations', 'reiki', 'musicians', 'educationservices', 'servicestations', 'skishops',  'marketing', 'fleamarkets', 'spiritual_shop', 'tiling', 'carwash', 'selfstorage',  'hiking', 'accessories', 'alternativemedicine', 'localservices', 'convenience', 'indoor_playcenter', 'saunas', 'grocery', 'shipping_centers', 'playgrounds', 'markets', 'weddingchappels', 'bouncehouserentals', 'tabletopgames', 'doulas', 'photographystores', 'tcm', 'icedelivery', 'pettingzoos', 'wholesalers', 'pianobars', 'surfshop', 'couriers', 'homecleaning', 'foodbanks', 'acupuncture', 'personal_shopping', 'computers', 'oilchange', 'boattours', 'escapegames', 'shavedice', 'brasseries', 'custommerchandise', 'sportswear', 'drivethrubars', 'buddhist_temples', 'weightlosscenters', 'balloonservices', 'registrationservices', 'catering', 'usedbooks', 'karaoke', 'thrift_stores', 'vintage', 'autocustomization', 'souvenirs', 'brewingsupplies', 'parking', 'vocation', 'beautysvc', 'tastingclasses', 'hottubandpool', 'flowers', 'distilleries', 'csa', 'ranches', 'eventservices', 'paintball', 'interiordesign', 'wigs', 'magicians', 'appliances', 'limos', 'plumbing', 'irrigation', 'spraytanning', 'organic_stores', 'candlestores', 'airport_shuttles', 'fishing', 'dog_parks', 'horseracing', 'bingo', 'cookingclasses', 'bike_repair_maintenance', 'animalshelters', 'homedecor', 'gardens', 'tours', 'womenscloth', 'laboratorytesting', 'firewood', 'paydayloans', 'eventplanning', 'headshops', 'hobbyshops', 'publicmarkets', 'bocceball', 'gyms', 'grillservices', 'cardioclasses', 'countryclubs', 'reststops', 'nonprofit', 'shoppingcenters', 'gamemeat', 'religiousitems', 'electronics', 'eatertainment', 'aerialfitness', 'pest_control', 'florists', 'stadiumsarenas', 'kitchenincubators', 'costumes', 'waterpurification', 'hookah_bars', 'djs', 'football', 'shopping', 'physicaltherapy', 'cafeteria', 'barcrawl', 'amateursportsteams', 'suppliesrestaurant', 'bikerentals', 'campgrounds', 'tobaccoshops', 'boating', 'beaches', 'farms', 'vapeshops', 'countrydancehalls', 'gardening', 'cyclingclasses', 'partyequipmentrentals', 'pet_sitting', 'gemstonesandminerals', 'religiousorgs', 'cigarbars', 'elementaryschools', 'supperclubs', 'watersuppliers', 'culturalcenter', 'hotels', 'travelservices', 'mini_golf', 'evchargingstations', 'childcloth', 'artschools', 'outdoorgear', 'vinyl_records', 'reflexology', 'waterdelivery', 'international', 'butcher', 'fitness', 'laundryservices', 'videoandgames', 'paintandsip', 'visitorcenters', 'attractionfarms', 'bootcamps', 'farmersmarket', 'beachequipmentrental', 'trains', 'landmarks', 'golf', 'resorts', 'petadoption', 'winetasteclasses', 'partycharacters', 'mobilephones', 'outlet_stores', 'boatcharters', 'groomer', 'itservices', 'petboarding', 'homehealthcare', 'customcakes', 'chiropractors', 'sommelierservices', 'healthcoach', 'nutritionists', 'artmuseums', 'popupshops', 'museums', 'service_stations', 'fireworks', 'wholesale_stores', 'battingcages', 'fueldocks', 'antiques', 'homeandgarden', 'artsandcrafts', 'galleries', 'livestocksupply', 'surfing', 'personalchefs', 'vacation_rentals', 'amusementparks', 'hats', 'bodyshops', 'cosmetics', 'casinos', 'hospitals', 'eyebrowservices', 'postoffices', 'musicvenues', 'giftshops', 'tennis', 'guesthouses', 'opticians', 'swimmingpools', 'yoga', 'stationery', 'christmastrees', 'beer_and_wine', 'cookingschools', 'bedbreakfast', 'rvparks', 'rugs', 'autorepair', 'autopartssupplies', 'discountstore', 'tradclothing', 'discgolf', 'fashion', 'foodtours', 'recreation', 'pharmacy', 'petstore', 'meats', 'paddleboarding', 'hotelstravel', 'kiteboarding', 'psychic_astrology', 'parks', 'internetcafe', 'specialtyschools', 'kitchensupplies', 'lingerie', 'bookstores', 'arcades', 'lancenters', 'toys', 'threadingservices', 'lifecoach', 'herbsandspices', 'publicservicesgovt', 'auto', 'marinas', 'taxis', 'huntingfishingsupplies', 'health', 'medcenters', 'kitchenandbath', 'kids_activities', 'dancestudio', 'massage_therapy', 'pet_training', 'oliveoil', 'axethrowing', 'bowling', 'barbers', 'kiosk', 'intlgrocery', 'localflavor', 'bartenders', 'petbreeders', 'laundromat', 'musicvideo', 'arts', 'yelpevents', 'candy', 'watches', 'churches', 'waterstores', 'winetours', 'herbalshops', 'popcorn', 'deptstores', 'medicalspa', 'pickyourown', 'jewelry', 'fabricstores', 'truckrepair', 'movietheaters', 'guns_and_ammo', 'education', 'advertising', 'sportgoods', 'partysupplies', 'floraldesigners', 'skincare', 'popuprestaurants', 'horsebackriding', 'healthtrainers', 'poolhalls', 'mags', 'homeappliancerepair', 'golflessons', 'beverage_stores', 'smog_check_stations', 'businessconsulting', 'beertours', 'propane', 'nikkei', 'walkingtours', 'cosmeticdentists', 'artspacerentals', 'sharedofficespaces', 'fooddeliveryservices', 'menscloth', 'clothingrental', 'venues', 'shoes', 'nightlife', 'massage', 'drugstores', 'cabaret', 'lounges', 'active', 'healthmarkets', 'specialed', 'photoboothrentals', 'spas', 'wedding_planning', 'teambuilding', 'festivals', 'naturopathic', 'comedyclubs', 'social_clubs', 'danceclubs', 'jazzandblues', 'wildlifecontrol', 'outdoormovies', 'furniture', 'mobilephonerepair', 'internalmed', 'meditationcenters', 'theater', 'virtualrealitycenters'}
+DEFINITELY_NO_CATEGORIES = {'grocery', 'convenience', 'drugstores'}
+# All categories in the dataset
+ALL_CATEGORIES = {'delis', 'copyshops', 'japanese', 'bikes', 'buildingsupplies', 'pumpkinpatches', 'hardware', 'greek', 'honey', 'winetastingroom', 'vitaminssupplements', 'cannabisdispensaries', 'acaibowls', 'artclasses', 'horse_boarding', 'diners', 'foodtrucks', 'pilates', 'sewingalterations', 'reiki', 'musicians', 'educationservices', 'servicestations', 'skishops', 'bistros', 'mideastern', 'raw_food', 'marketing', 'fleamarkets', 'cheesesteaks', 'hotpot', 'uzbek', 'spiritual_shop', 'tiling', 'breweries', 'diyfood', 'carwash', 'selfstorage', 'southern', 'arabian', 'coffee', 'eritrean', 'hiking', 'fishnchips', 'accessories', 'alternativemedicine', 'kombucha', 'localservices', 'convenience', 'indoor_playcenter', 'sushi', 'pubs', 'irish', 'oaxacan', 'cantonese', 'japacurry', 'saunas', 'grocery', 'colombian', 'szechuan', 'shipping_centers', 'izakaya', 'playgrounds', 'markets', 'weddingchappels', 'bouncehouserentals', 'tabletopgames', 'cocktailbars', 'doulas', 'photographystores', 'chocolate', 'tcm', 'dinnertheater', 'icedelivery', 'food', 'pettingzoos', 'puertorican', 'halal', 'wholesalers', 'pianobars', 'surfshop', 'laotian', 'couriers', 'homecleaning', 'foodbanks', 'armenian', 'divebars', 'acupuncture', 'basque', 'austrian', 'personal_shopping', 'computers', 'korean', 'oilchange', 'boattours', 'escapegames', 'shavedice', 'brasseries', 'custommerchandise', 'falafel', 'sportswear', 'drivethrubars', 'buddhist_temples', 'bangladeshi', 'poutineries', 'weightlosscenters', 'balloonservices', 'somali', 'gourmet', 'registrationservices', 'catering', 'streetvendors', 'usedbooks', 'karaoke', 'thrift_stores', 'themedcafes', 'vintage', 'autocustomization', 'souvenirs', 'brewingsupplies', 'italian', 'bulgarian', 'parking', 'yucatan', 'russian', 'cakeshop', 'vocation', 'beautysvc', 'tastingclasses', 'hottubandpool', 'flowers', 'distilleries', 'csa', 'ranches', 'teppanyaki', 'cupcakes', 'eventservices', 'paintball', 'interiordesign', 'dominican', 'latin', 'wigs', 'magicians', 'sardinian', 'appliances', 'limos', 'plumbing', 'irrigation', 'churros', 'spraytanning', 'filipino', 'lebanese', 'organic_stores', 'candlestores', 'airport_shuttles', 'coffeeroasteries', 'fishing', 'asianfusion', 'newmexican', 'dog_parks', 'horseracing', 'bingo', 'cookingclasses', 'bike_repair_maintenance', 'animalshelters', 'champagne_bars', 'homedecor', 'senegalese', 'ukrainian', 'gardens', 'tours', 'womenscloth', 'laboratorytesting', 'firewood', 'paydayloans', 'eventplanning', 'headshops', 'noodles', 'hobbyshops', 'publicmarkets', 'wine_bars', 'sicilian', 'tea', 'bocceball', 'gyms', 'juicebars', 'grillservices', 'cardioclasses', 'comfortfood', 'soup', 'wraps', 'countryclubs', 'reststops', 'nonprofit', 'australian', 'restaurants', 'vermouthbars', 'shoppingcenters', 'gastropubs', 'gamemeat', 'bakeries', 'bagels', 'religiousitems', 'desserts', 'electronics', 'eatertainment', 'aerialfitness', 'pest_control', 'florists', 'chicken_wings', 'stadiumsarenas', 'seafood', 'kitchenincubators', 'costumes', 'waterpurification', 'hookah_bars', 'djs', 'football', 'shopping', 'physicaltherapy', 'cafeteria', 'rotisserie_chicken', 'cideries', 'barcrawl', 'amateursportsteams', 'suppliesrestaurant', 'bikerentals', 'campgrounds', 'vietnamese', 'tobaccoshops', 'boating', 'gaybars', 'polynesian', 'beaches', 'pancakes', 'farms', 'vapeshops', 'countrydancehalls', 'gardening', 'cyclingclasses', 'partyequipmentrentals', 'pet_sitting', 'gemstonesandminerals', 'religiousorgs', 'cigarbars', 'elementaryschools', 'supperclubs', 'watersuppliers', 'georgian', 'macarons', 'culturalcenter', 'southafrican', 'hotels', 'travelservices', 'mini_golf', 'evchargingstations', 'hkcafe', 'childcloth', 'artschools', 'outdoorgear', 'vinyl_records', 'reflexology', 'waterdelivery', 'international', 'butcher', 'pakistani', 'fitness', 'piadina', 'mexican', 'tamales', 'brewpubs', 'laundryservices', 'poke', 'videoandgames', 'empanadas', 'paintandsip', 'visitorcenters', 'attractionfarms', 'buffets', 'chickenshop', 'peruvian', 'tradamerican', 'bootcamps', 'mongolian', 'farmersmarket', 'beachequipmentrental', 'trains', 'landmarks', 'golf', 'resorts', 'portuguese', 'tikibars', 'petadoption', 'winetasteclasses', 'partycharacters', 'shavedsnow', 'pastashops', 'gelato', 'burmese', 'mobilephones', 'outlet_stores', 'boatcharters', 'gluten_free', 'chimneycakes', 'moroccan', 'cajun', 'breakfast_brunch', 'speakeasies', 'hainan', 'groomer', 'itservices', 'petboarding', 'homehealthcare', 'customcakes', 'brazilian', 'caribbean', 'chiropractors', 'sommelierservices', 'healthcoach', 'nutritionists', 'artmuseums', 'popupshops', 'museums', 'honduran', 'service_stations', 'fireworks', 'himalayan', 'wholesale_stores', 'venezuelan', 'battingcages', 'fueldocks', 'kosher', 'antiques', 'foodstands', 'bubbletea', 'scottish', 'homeandgarden', 'artsandcrafts', 'galleries', 'livestocksupply', 'surfing', 'pretzels', 'personalchefs', 'hotdogs', 'donuts', 'vacation_rentals', 'amusementparks', 'hats', 'bodyshops', 'cosmetics', 'casinos', 'northernmexican', 'hospitals', 'eyebrowservices', 'vegetarian', 'postoffices', 'musicvenues', 'giftshops', 'cheese', 'calabrian', 'tennis', 'guesthouses', 'opticians', 'swimmingpools', 'yoga', 'stationery', 'tuscan', 'singaporean', 'cuban', 'christmastrees', 'beer_and_wine', 'cookingschools', 'bedbreakfast', 'chinese', 'rvparks', 'rugs', 'autorepair', 'autopartssupplies', 'discountstore', 'tradclothing', 'discgolf', 'fashion', 'foodtours', 'recreation', 'pharmacy', 'petstore', 'hungarian', 'srilankan', 'panasian', 'food_court', 'meats', 'paddleboarding', 'syrian', 'hotelstravel', 'kiteboarding', 'sandwiches', 'seafoodmarkets', 'soulfood', 'psychic_astrology', 'conveyorsushi', 'parks', 'internetcafe', 'specialtyschools', 'kitchensupplies', 'lingerie', 'bookstores', 'arcades', 'lancenters', 'toys', 'kebab', 'threadingservices', 'lifecoach', 'herbsandspices', 'publicservicesgovt', 'auto', 'cafes', 'afghani', 'marinas', 'taxis', 'huntingfishingsupplies', 'fondue', 'argentine', 'health', 'sportsbars', 'spanish', 'modern_european', 'medcenters', 'kitchenandbath', 'kids_activities', 'dancestudio', 'massage_therapy', 'tex-mex', 'pet_training', 'slovakian', 'importedfood', 'oliveoil', 'burgers', 'axethrowing', 'bowling', 'barbers', 'kiosk', 'intlgrocery', 'cambodian', 'localflavor', 'bartenders', 'petbreeders', 'laundromat', 'musicvideo', 'arts', 'yelpevents', 'candy', 'thai', 'watches', 'churches', 'belgian', 'waterstores', 'winetours', 'herbalshops', 'czech', 'popcorn', 'deptstores', 'jaliscan', 'medicalspa', 'taiwanese', 'meaderies', 'pickyourown', 'jewelry', 'icecream', 'fabricstores', 'creperies', 'truckrepair', 'newamerican', 'scandinavian', 'salad', 'movietheaters', 'malaysian', 'guns_and_ammo', 'education', 'advertising', 'sportgoods', 'partysupplies', 'floraldesigners', 'skincare', 'african', 'popuprestaurants', 'horsebackriding', 'mediterranean', 'vegan', 'healthtrainers', 'poolhalls', 'french', 'guamanian', 'beerbar', 'mags', 'beergardens', 'homeappliancerepair', 'golflessons', 'beverage_stores', 'smog_check_stations', 'shanghainese', 'businessconsulting', 'beertours', 'propane', 'smokehouse', 'tapas', 'nikkei', 'british', 'walkingtours', 'indonesian', 'cosmeticdentists', 'artspacerentals', 'wineries', 'sharedofficespaces', 'irish_pubs', 'fooddeliveryservices', 'menscloth', 'clothingrental', 'venues', 'shoes', 'nightlife', 'massage', 'bars', 'drugstores', 'trinidadian', 'cabaret', 'lounges', 'iberian', 'ramen', 'salvadoran', 'steak', 'dimsum', 'indpak', 'pizza', 'waffles', 'active', 'healthmarkets', 'ethiopian', 'persian', 'specialed', 'photoboothrentals', 'spas', 'wedding_planning', 'teambuilding', 'tapasmallplates', 'polish', 'hotdog', 'nicaraguan', 'festivals', 'newcanadian', 'hawaiian', 'naturopathic', 'comedyclubs', 'haitian', 'social_clubs', 'danceclubs', 'whiskeybars', 'german', 'jazzandblues', 'wildlifecontrol', 'outdoormovies', 'furniture', 'mobilephonerepair', 'internalmed', 'bbq', 'meditationcenters', 'tacos', 'theater', 'egyptian', 'virtualrealitycenters', 'turkish'}
+
+# Food and Bars categories - this includes bars that serve food or restaurants that serve drinks
+FOOD_AND_BARS_CATEGORIES = {'poutineries', 'sardinian', 'bars', 'divebars', 'tamales', 'winetastingroom', 'comfortfood', 'somali', 'rotisserie_chicken', 'cuban', 'puertorican', 'pastashops', 'meaderies', 'whiskeybars', 'indpak', 'vermouthbars', 'moroccan', 'cupcakes', 'newmexican', 'polynesian', 'falafel', 'pancakes', 'yucatan', 'bbq', 'oaxacan', 'ukrainian', 'arabian', 'foodstands', 'brazilian', 'wineries', 'japacurry', 'pubs', 'himalayan', 'newcanadian', 'tacos', 'australian', 'hainan', 'dinnertheater', 'foodtrucks', 'acaibowls', 'georgian', 'sicilian', 'calabrian', 'irish_pubs', 'dimsum', 'kebab', 'teppanyaki', 'colombian', 'newamerican', 'chinese', 'vietnamese', 'delis', 'irish', 'eritrean', 'southern', 'wraps', 'senegalese', 'tapasmallplates', 'hawaiian', 'guamanian', 'mediterranean', 'hotdog', 'vegan', 'laotian', 'panasian', 'polish', 'beerbar', 'argentine', 'steak', 'sandwiches', 'tex-mex', 'bagels', 'german', 'salad', 'creperies', 'gluten_free', 'pretzels', 'poke', 'jaliscan', 'noodles', 'buffets', 'basque', 'iberian', 'chickenshop', 'singaporean', 'modern_european', 'desserts', 'donuts', 'food_court', 'breweries', 'mexican', 'sushi', 'dominican', 'salvadoran', 'restaurants', 'hotdogs', 'gelato', 'kosher', 'bulgarian', 'burgers', 'raw_food', 'icecream', 'brewpubs', 'mideastern', 'syrian', 'cheesesteaks', 'belgian', 'food', 'peruvian', 'filipino', 'korean', 'soulfood', 'pizza', 'russian', 'bangladeshi', 'caribbean', 'cocktailbars', 'churros', 'tradamerican', 'indonesian', 'wine_bars', 'coffeeroasteries', 'greek', 'french', 'cambodian', 'conveyorsushi', 'themedcafes', 'thai', 'piadina', 'honey', 'fondue', 'sportsbars', 'asianfusion', 'cakeshop', 'slovakian', 'ramen', 'british', 'southafrican', 'empanadas', 'chimneycakes', 'latin', 'tapas', 'diners', 'chicken_wings', 'northernmexican', 'macarons', 'italian', 'beergardens', 'hungarian', 'hotpot', 'cideries', 'shavedsnow', 'vegetarian', 'egyptian', 'ethiopian', 'trinidadian', 'taiwanese', 'portuguese', 'chocolate', 'cafes', 'lebanese', 'soup', 'hkcafe', 'burmese', 'bubbletea', 'bistros', 'malaysian', 'seafood', 'austrian', 'japanese', 'cantonese', 'halal', 'nicaraguan', 'srilankan', 'juicebars', 'diyfood', 'scottish', 'honduran', 'scandinavian', 'gastropubs', 'venezuelan', 'armenian', 'speakeasies', 'coffee', 'spanish', 'tikibars', 'bakeries', 'tea', 'smokehouse', 'turkish', 'izakaya', 'champagne_bars', 'waffles', 'gaybars', 'cajun', 'haitian', 'szechuan', 'fishnchips', 'afghani', 'african', 'czech', 'kombucha', 'shanghainese', 'breakfast_brunch', 'mongolian', 'pakistani', 'gourmet', 'tuscan', 'uzbek', 'persian', 'streetvendors'}
+# Just bars
+BARS_CATEGORIES = {'bars', 'divebars', 'winetastingroom', 'meaderies', 'whiskeybars', 'vermouthbars', 'wineries', 'pubs', 'irish_pubs', 'beerbar', 'tapas', 'breweries', 'brewpubs', 'cocktailbars', 'winebars', 'sportsbars', 'beergardens', 'gastropubs', 'tikibars', 'champagne_bars', 'gaybars'}
+# Just food no alcohol
+FOOD_CATEGORIES = {'waffles', 'haitian', 'filipino', 'diners', 'afghani', 'belgian', 'teppanyaki', 'lebanese', 'piadina', 'hotpot', 'cuban', 'bistros', 'singaporean', 'comfortfood', 'buffets', 'soup', 'vegetarian', 'newcanadian', 'tradamerican', 'himalayan', 'dominican', 'themedcafes', 'austrian', 'japanese', 'modern_european', 'ramen', 'hotdog', 'cakeshop', 'portuguese', 'newmexican', 'taiwanese', 'vegan', 'uzbek', 'fishnchips', 'british', 'kosher', 'guamanian', 'szechuan', 'mexican', 'macarons', 'acaibowls', 'georgian', 'bagels', 'cheesesteaks', 'food', 'bakeries', 'persian', 'arabian', 'mediterranean', 'colombian', 'burgers', 'food_court', 'sandwiches', 'shavedsnow', 'coffee', 'trinidadian', 'russian', 'italian', 'diyfood', 'sicilian', 'ukrainian', 'churros', 'tuscan', 'cantonese', 'spanish', 'foodtrucks', 'moroccan', 'sardinian', 'cideries', 'hawaiian', 'soulfood', 'thai', 'falafel', 'gourmet', 'chimneycakes', 'scandinavian', 'izakaya', 'honey', 'cupcakes', 'japacurry', 'bulgarian', 'streetvendors', 'pretzels', 'pancakes', 'salvadoran', 'srilankan', 'delis', 'tex-mex', 'cajun', 'polish', 'dimsum', 'bangladeshi', 'eritrean', 'halal', 'african', 'turkish', 'somali', 'hotdogs', 'slovakian', 'chicken_wings', 'southern', 'brazilian', 'hainan', 'venezuelan', 'winebars', 'dinnertheater', 'empanadas', 'hungarian', 'pakistani', 'poutineries', 'irish', 'cafes', 'asianfusion', 'speakeasies', 'chocolate', 'basque', 'chinese', 'syrian', 'calabrian', 'armenian', 'puertorican', 'southafrican', 'polynesian', 'senegalese', 'donuts', 'german', 'scottish', 'kombucha', 'jaliscan', 'seafood', 'indpak', 'czech', 'juicebars', 'mongolian', 'tapasmallplates', 'australian', 'noodles', 'oaxacan', 'shanghainese', 'wraps', 'bbq', 'burmese', 'foodstands', 'kebab', 'honduran', 'salad', 'gelato', 'korean', 'panasian', 'rotisserie_chicken', 'pizza', 'greek', 'ethiopian', 'laotian', 'malaysian', 'smokehouse', 'nicaraguan', 'vietnamese', 'caribbean', 'hkcafe', 'steak', 'raw_food', 'restaurants', 'peruvian', 'bubbletea', 'poke', 'pastashops', 'tea', 'yucatan', 'sushi', 'wine_bars', 'conveyorsushi', 'french', 'tacos', 'argentine', 'northernmexican', 'fondue', 'chickenshop', 'gluten_free', 'icecream', 'breakfast_brunch', 'tamales', 'cambodian', 'mideastern', 'indonesian', 'latin', 'coffeeroasteries', 'newamerican', 'desserts', 'creperies', 'egyptian', 'iberian'}
+# Ethnicities for subset analysis
+ETHNICITIES_CATEGORIES = {'japanese', 'greek', 'mideastern', 'uzbek', 'southern', 'arabian', 'eritrean', 'irish', 'oaxacan', 'cantonese', 'colombian', 'szechuan', 'puertorican', 'halal', 'laotian', 'armenian', 'basque', 'austrian', 'korean', 'bangladeshi', 'poutineries', 'somali', 'italian', 'bulgarian', 'yucatan', 'russian', 'dominican', 'latin', 'sardinian', 'filipino', 'lebanese', 'asianfusion', 'newmexican', 'senegalese', 'ukrainian', 'sicilian', 'australian', 'vietnamese', 'polynesian', 'georgian', 'southafrican', 'hkcafe', 'pakistani', 'mexican', 'peruvian', 'tradamerican', 'mongolian', 'portuguese', 'burmese', 'moroccan', 'cajun', 'hainan', 'brazilian', 'caribbean', 'honduran', 'himalayan', 'venezuelan', 'kosher', 'scottish', 'northernmexican', 'calabrian', 'tuscan', 'singaporean', 'cuban', 'chinese', 'hungarian', 'srilankan', 'panasian', 'syrian', 'afghani', 'argentine', 'spanish', 'modern_european', 'tex-mex', 'slovakian', 'cambodian', 'thai', 'belgian', 'czech', 'jaliscan', 'taiwanese', 'newamerican', 'scandinavian', 'malaysian', 'african', 'french', 'guamanian', 'shanghainese', 'british', 'indonesian', 'trinidadian', 'iberian', 'salvadoran', 'indpak', 'ethiopian', 'persian', 'polish', 'nicaraguan', 'newcanadian', 'hawaiian', 'haitian', 'german', 'egyptian', 'turkish'}
+
+# one bit per class
+NONFOOD = 1 << 0
+DEFINITELY_NO = 1 << 1
+FOOD_AND_BARS = 1 << 2
+BARS = 1 << 3
+FOOD = 1 << 4
+ETHNICITY = 1 << 5
+
+CATEGORY_CLASSES = {
+    NONFOOD: NONFOOD_CATEGORIES,
+    DEFINITELY_NO: DEFINITELY_NO_CATEGORIES,
+    FOOD_AND_BARS: FOOD_AND_BARS_CATEGORIES,
+    BARS: BARS_CATEGORIES,
+    FOOD: FOOD_CATEGORIES,
+    ETHNICITY: ETHNICITIES_CATEGORIES,
+}
+
+
+class CategoryIndex:
+    """
+    Maps each known alias to an integer ID and each ID to the bitmask of its classes.
+    Aliases outside every class get no ID and a mask of 0.
+    """
+
+    def __init__(self, classes):
+        """
+        :param classes: A dictionary of class bit -> set of aliases in that class.
+        """
+        self.aliases = pd.Index(sorted(set().union(*classes.values())))
+        # the extra trailing 0 is the mask of unknown aliases, which get the code -1
+        self.masks = np.zeros(len(self.aliases) + 1, dtype=np.uint8)
+        for bit, aliases in classes.items():
+            self.masks[self.aliases.get_indexer(sorted(aliases))] |= bit
+
+    def ids(self, aliases):
+        """
+        :param aliases: A Series or array of category aliases.
+        :return: An array with the ID of every alias, -1 for unknown aliases.
+        """
+        return self.aliases.get_indexer(aliases)
+
+    def alias_masks(self, aliases):
+        """
+        :param aliases: A Series or array of category aliases.
+        :return: An array with the class bitmask of every alias.
+        """
+        return self.masks[self.ids(aliases)]
+
+    def business_masks(self, aliases):
+        """
+        OR the masks of every alias of a business together.
+
+        :param aliases: A Series of aliases from Series.explode(), indexed by business; the aliases of a
+                        business are consecutive.
+        :return: A Series of class bitmasks indexed by business.
+        """
+        masks = self.alias_masks(aliases)
+        index = aliases.index
+        if len(index) == 0:
+            return pd.Series([], index=index, dtype=np.uint8)
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        return pd.Series(np.bitwise_or.reduceat(masks, starts), index=index[starts])
+
+
+CATEGORY_INDEX = CategoryIndex(CATEGORY_CLASSES)
@@ -0,0 +1,262 @@
+import json
+import math
+import sqlite3
+import hashlib
+from datetime import datetime, timezone
+from parquet_io import CLEANED_SCHEMA
+
+"""
+Change data capture for the cleaned businesses, instead of appending every business on every run.
+
+Each business of a run is keyed by its id and fingerprinted with a hash of its mutable fields (rating,
+review_count, price, address). Comparing the run with the last snapshot of the current-state table gives
+the only rows that need to be written:
+    insert  - an id the table has never seen,
+    update  - a known id whose hash changed, or a closed business that is back,
+    move    - a known, unchanged id returned by another location than the one it was last seen in,
+    close   - an open business last seen in a location of this run that this run did not return.
+The change rows are applied with a MERGE into the current-state table, so the load volume tracks the
+churn of the catalogue instead of its size, and dbt no longer deduplicates ever growing raw tables.
+
+Closures are only decided within the locations a run processed, so a partial run (slices, resumed runs)
+does not close the businesses of the locations it skipped, and never close an id the run returned from
+any location. Moves keep the location of every business current, so a business that moved to a location
+a later partial run skips is not taken for closed by the location it left. The landed files must hold every business of
+their location for that, ie. the ingest flow ran with dedup_mode=None; the GCS to BQ flow checks the
+settings the ingest flow uploaded with the data, and the duplicate_of references, before it merges.
+
+Two executors hold the current-state tables: BigQueryMergeExecutor for the warehouse, and
+SQLiteMergeExecutor, a local stand-in with the same semantics for tests and local runs.
+"""
+
+MUTABLE_FIELDS = ('rating', 'review_count', 'price', 'address')
+COLUMNS = CLEANED_SCHEMA.names
+LIST_COLUMNS = ('categories', 'ethnic_category')
+STATE_COLUMNS = ('row_hash', 'location', 'is_closed', 'updated_at')
+OPS = ('insert', 'update', 'move', 'close')
+
+
+def _clean(value):
+    # NaN and None are the same missing value, whichever export the record came from
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def row_hash(record):
+    """
+    Fingerprint of the mutable fields of a cleaned business.
+    """
+    rating = _clean(record.get('rating'))
+    review_count = _clean(record.get('review_count'))
+    values = [None if rating is None else float(rating),
+              None if review_count is None else int(review_count),
+              _clean(record.get('price')),
+              _clean(record.get('address'))]
+    return hashlib.sha256(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+def export_records(export_data):
+    """
+    The cleaned business dictionaries of an export_businesses result (newline delimited JSON or an Arrow table).
+    """
+    if isinstance(export_data, str):
+        return [json.loads(line) for line in export_data.splitlines() if line]
+    return export_data.to_pylist()
+
+
+class ChangeSet:
+    """
+    The inserts, updates and closures of one run against one current-state table.
+    """
+
+    def __init__(self, snapshot):
+        """
+        :param snapshot: {id: (row_hash, location, is_closed)} of the current-state table before the run.
+        """
+        self.snapshot = snapshot
+        self.seen = set()
+        self.locations = set()
+        self.changes = {}
+        self.unchanged = 0
+
+    def add(self, location, records):
+        """
+        Compare the cleaned businesses of one location with the snapshot.
+
+        :param location: A key of the location the records come from (ex. 'Restaurants-Torrance-415').
+        :param records: The cleaned business dictionaries of the location.
+        """
+        self.locations.add(location)
+        for record in records:
+            business_id = record['id']
+            # overlapping circles return the same business many times; the first one wins
+            if business_id in self.seen:
+                continue
+            self.seen.add(business_id)
+            digest = row_hash(record)
+            previous = self.snapshot.get(business_id)
+            if previous is None:
+                op = 'insert'
+            elif previous[0] != digest or previous[2]:
+                op = 'update'
+            elif previous[1] != location:
+                op = 'move'
+            else:
+                self.unchanged += 1
+                continue
+            self.changes[business_id] = dict({column: _clean(record.get(column)) for column in COLUMNS},
+                                             op=op, row_hash=digest, location=location)
+
+    def close_missing(self):
+        """
+        Add a closure for every open business of the snapshot last seen in a location of the run but not
+        returned by any location of the run. Call once every location of the run was added.
+        """
+        for business_id, (digest, location, is_closed) in self.snapshot.items():
+            if not is_closed and location in self.locations and business_id not in self.seen:
+                closure = {column: [] if column in LIST_COLUMNS else None for column in COLUMNS}
+                self.changes[business_id] = dict(closure, id=business_id, op='close', row_hash=digest,
+                                                 location=location)
+
+    def rows(self):
+        return list(self.changes.values())
+
+    def counts(self):
+        counts = {op: 0 for op in OPS}
+        for change in self.changes.values():
+            counts[change['op']] += 1
+        counts['unchanged'] = self.unchanged
+        return counts
+
+    def __len__(self):
+        return len(self.changes)
+
+
+def merge_statement(target, changes):
+    """
+    BigQuery script creating the current-state table if needed and merging the change rows into it.
+
+    :param target: The current-state table (ex. 'yelp_data_current.Restaurants_current').
+    :param changes: The table holding the change rows, with an op column.
+    """
+    update_columns = [column for column in COLUMNS if column != 'id'] + ['row_hash', 'location']
+    insert_columns = COLUMNS + ['row_hash', 'location']
+    return f"""
+CREATE TABLE IF NOT EXISTS `{target}` (
+    id STRING NOT NULL, alias STRING, name STRING, url STRING, review_count INT64,
+    categories ARRAY<STRING>, ethnic_category ARRAY<STRING>, rating FLOAT64, price STRING,
+    latitude FLOAT64, longitude FLOAT64, city STRING, address STRING, type STRING,
+    row_hash STRING, location STRING, is_closed BOOL, updated_at TIMESTAMP
+);
+MERGE `{target}` T
+USING `{changes}` S
+ON T.id = S.id
+WHEN MATCHED AND S.op = 'close' THEN
+    UPDATE SET is_closed = TRUE, updated_at = CURRENT_TIMESTAMP()
+WHEN MATCHED THEN
+    UPDATE SET {', '.join(f'{column} = S.{column}' for column in update_columns)},
+        is_closed = FALSE, updated_at = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED AND S.op != 'close' THEN
+    INSERT ({', '.join(insert_columns)}, is_closed, updated_at)
+    VALUES ({', '.join(f'S.{column}' for column in insert_columns)}, FALSE, CURRENT_TIMESTAMP());
+"""
+
+
+class BigQueryMergeExecutor:
+    """
+    Current-state tables in BigQuery: the change rows are loaded into a {table}_changes table and merged.
+    """
+
+    def __init__(self, client, dataset='yelp_data_current'):
+        """
+        :param client: A bigquery.Client.
+        :param dataset: The dataset of the current-state tables and of their change tables.
+        """
+        self.client = client
+        self.dataset = dataset
+
+    def snapshot(self, table):
+        """
+        :return: {id: (row_hash, location, is_closed)} of a current-state table; empty when it does not exist yet.
+        """
+        # imported here so the SQLite stand-in runs without the Google Cloud libraries
+        from google.api_core.exceptions import NotFound
+        try:
+            rows = self.client.query(
+                f"SELECT id, row_hash, location, is_closed FROM `{self.dataset}.{table}`").result()
+        except NotFound:
+            return {}
+        return {row['id']: (row['row_hash'], row['location'], row['is_closed']) for row in rows}
+
+    def merge(self, table, change_set):
+        if not len(change_set):
+            return
+        from google.cloud import bigquery
+        from bq_loader import yelp_load_job_config
+        # the change table is truncated by every merge, which does not go with schema update options
+        job_config = yelp_load_job_config(allow_field_addition=False)
+        # closures only carry their id
+        job_config.schema = [bigquery.SchemaField(field.name, field.field_type,
+                                                  mode=field.mode if field.name == 'id' or field.mode == 'REPEATED'
+                                                  else 'NULLABLE')
+                             for field in job_config.schema] + [bigquery.SchemaField("op", "STRING", mode="REQUIRED"),
+                                                                bigquery.SchemaField("row_hash", "STRING"),
+                                                                bigquery.SchemaField("location", "STRING")]
+        job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+        changes = f"{self.dataset}.{table}_changes"
+        self.client.load_table_from_json(change_set.rows(), changes, job_config=job_config).result()
+        self.client.query(merge_statement(f"{self.dataset}.{table}", changes)).result()
+
+
+class SQLiteMergeExecutor:
+    """
+    Local stand-in of the warehouse: current-state tables in SQLite with the same MERGE semantics.
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        :param path: The path of the SQLite database file; in memory by default.
+        """
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+
+    def _create(self, table):
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS \"{table}\" ("
+                          + ', '.join(f"{column} {'TEXT PRIMARY KEY' if column == 'id' else ''}" for column in COLUMNS)
+                          + ', row_hash TEXT, location TEXT, is_closed INTEGER, updated_at TEXT)')
+
+    def snapshot(self, table):
+        self._create(table)
+        return {business_id: (digest, location, bool(is_closed)) for business_id, digest, location, is_closed
+                in self.conn.execute(f'SELECT id, row_hash, location, is_closed FROM "{table}"')}
+
+    def merge(self, table, change_set):
+        self._create(table)
+        now = datetime.now(timezone.utc).isoformat()
+        upserts = []
+        closures = []
+        for change in change_set.rows():
+            if change['op'] == 'close':
+                closures.append((now, change['id']))
+                continue
+            values = [json.dumps(change[column]) if column in LIST_COLUMNS else change[column] for column in COLUMNS]
+            upserts.append(values + [change['row_hash'], change['location'], 0, now])
+        columns = COLUMNS + list(STATE_COLUMNS)
+        with self.conn:
+            self.conn.executemany(
+                f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                f'ON CONFLICT(id) DO UPDATE SET '
+                + ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'id'),
+                upserts)
+            self.conn.executemany(f'UPDATE "{table}" SET is_closed = 1, updated_at = ? WHERE id = ?', closures)
+
+    def rows(self, table):
+        """
+        :return: The rows of a current-state table as dictionaries, for inspection.
+        """
+        cursor = self.conn.execute(f'SELECT * FROM "{table}" ORDER BY id')
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def close(self):
+        self.conn.close()
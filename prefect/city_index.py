@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+"""
+Offline nearest-city lookup over california_lat_long_cities.csv.
+
+The API reports the city a business gives in its address, which is often a neighbourhood (ex. 'North
+Hollywood') or misspelled, so an exact match against the city list drops those businesses. CityIndex
+puts the city coordinates into a KD-tree and assigns a whole batch of businesses to their nearest city
+by coordinates in one query, without any network calls.
+
+Points are placed on the unit sphere, so the chord distance of the tree converts exactly to a great
+circle distance and no projection is needed.
+"""
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def unit_vectors(lat, long):
+    """
+    Cartesian coordinates on the unit sphere of latitudes/longitudes in degrees.
+    """
+    lat, long = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(long, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(long), np.cos(lat) * np.sin(long), np.sin(lat)])
+
+
+class CityIndex:
+    """
+    KD-tree over the coordinates of the city list.
+    """
+
+    def __init__(self, df_locations, max_distance_m=20000):
+        """
+        :param df_locations: A dataframe containing location data like place name, Latitude, and Longitude
+        :param max_distance_m: Businesses further than this from every city are not assigned to any city.
+        """
+        self.names = df_locations['Name'].to_numpy(dtype=object)
+        self.max_distance_m = max_distance_m
+        self.tree = cKDTree(unit_vectors(df_locations['Latitude'], df_locations['Longitude']))
+
+    def nearest(self, lat, long):
+        """
+        Assign every point to its nearest city.
+
+        :param lat: An array of latitudes; NaN coordinates are not assigned.
+        :param long: An array of longitudes.
+        :return: An array of city names (None when no city is within max_distance_m)
+                 and an array of distances in meters.
+        """
+        points = unit_vectors(lat, long)
+        known = ~np.isnan(points).any(axis=1)
+        names = np.full(len(points), None, dtype=object)
+        distances = np.full(len(points), np.nan)
+        if known.any():
+            # chord length on the unit sphere for the maximum great circle distance
+            max_chord = 2 * np.sin(self.max_distance_m / EARTH_RADIUS_M / 2)
+            chord, position = self.tree.query(points[known], distance_upper_bound=max_chord)
+            found = np.isfinite(chord)
+            known_names = np.full(len(chord), None, dtype=object)
+            known_names[found] = self.names[position[found]]
+            names[known] = known_names
+            distances[known] = np.where(found, 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chord, 2) / 2), np.nan)
+        return names, distances
+
+    def assign(self, cities, lat, long):
+        """
+        Keep the reported city when it is in the city list, otherwise use the nearest city.
+
+        :param cities: A Series of the cities reported by the API.
+        :param lat: A Series of latitudes with the same index.
+        :param long: A Series of longitudes with the same index.
+        :return: A Series of city names from the city list, NaN for businesses that could not be assigned.
+        """
+        listed = cities.isin(set(self.names))
+        assigned = cities.where(listed)
+        if not listed.all():
+            names, _ = self.nearest(lat[~listed], long[~listed])
+            assigned[~listed] = pd.Series(names, index=assigned.index[~listed], dtype=object)
+        return assigned
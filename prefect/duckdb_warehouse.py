@@ -0,0 +1,185 @@
+import re
+import glob
+import shlex
+import argparse
+import subprocess
+from pathlib import Path
+import duckdb
+import pandas as pd
+import pyarrow as pa
+from city_index import CityIndex
+from parquet_io import CLEANED_SCHEMA, file_suffix
+from yelp_transform import clean_businesses, export_businesses
+
+"""
+Local warehouse mode: the dbt models on an embedded DuckDB database file instead of BigQuery.
+
+The landed files of every term (JSON or Parquet, as downloaded by the GCS to BQ flow or written by the
+ingest flow) go through the same transform as the GCS to BQ flow (see yelp_transform.py) and are loaded
+into yelp_data_raw.{term}_data_raw tables of the database file, with the schema of the BigQuery tables.
+dbt then builds the seeds, the staging, dimension and fact models and their tests on that file through
+the dbt-duckdb adapter, with a profile written next to it. The models are the BigQuery ones: the few
+dialect differences are handled in the models and macros with target.type, and the staging models read
+the full data by default on this target instead of 100 rows.
+
+Nothing needs a cloud connection, so a full model run takes seconds on a laptop, and a change to the
+transform can be checked end to end against the dbt tests before it is deployed. Businesses whose
+coordinates are missing are loaded without them, since geocoding is rate limited and needs the network.
+
+    python duckdb_warehouse.py --data-dir ../data/data --terms Restaurants Food Desserts "Coffee & Tea"
+"""
+
+RAW_SCHEMA = 'yelp_data_raw'
+# every source table of models/staging/schema.yml must exist, even when its term was not loaded
+SOURCE_TABLES = ('Food_data_raw', 'Restaurants_data_raw', 'Coffee_data_raw', 'Desserts_data_raw')
+DBT_TARGET = 'duckdb'
+DBT_SCHEMA = 'yelp_data_dbt'
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def raw_table(term):
+    """
+    The {term}_data_raw table a term is loaded into, named after its first word as in the GCS to BQ flow.
+    """
+    return "{}_data_raw".format(re.split(r'\s+', term)[0])
+
+
+def landed_files(data_dir, term, file_format='json'):
+    """
+    The landed {term}-{location}-{index} files of a term, in name order.
+    """
+    return sorted(Path(data_dir).glob(f"{glob.escape(term)}-*{file_suffix(file_format)}"))
+
+
+class DuckDBWarehouse:
+    """
+    A DuckDB database file holding the raw tables of the dbt sources.
+    """
+
+    def __init__(self, path='../data/yelp_warehouse.duckdb'):
+        """
+        :param path: The path of the DuckDB database file; it is created if it does not exist.
+        """
+        self.path = Path(path)
+        self.conn = duckdb.connect(str(self.path))
+        self.conn.execute(f"CREATE SCHEMA IF NOT EXISTS {RAW_SCHEMA}")
+
+    def load_table(self, table, paths, set_cities, city_index=None, geolocate=None):
+        """
+        Transform landed files and replace a raw table with their cleaned businesses.
+
+        :param table: The name of the raw table (ex. 'Restaurants_data_raw').
+        :param paths: The paths of the landed JSON or Parquet files.
+        :param set_cities: The set of city names a business must be located in.
+        :param city_index: Assigns businesses whose city is not in set_cities to their nearest city.
+        :param geolocate: Fills missing coordinates, see export_businesses; None loads them as missing.
+        :return: The number of rows loaded.
+        """
+        tables = [CLEANED_SCHEMA.empty_table()]
+        for path in paths:
+            cleaned, _ = export_businesses(clean_businesses(path, set_cities, city_index), geolocate,
+                                           file_format='parquet')
+            tables.append(cleaned)
+        cleaned = pa.concat_tables(tables)
+        self.conn.register('cleaned', cleaned)
+        try:
+            self.conn.execute(f'CREATE OR REPLACE TABLE {RAW_SCHEMA}."{table}" AS SELECT * FROM cleaned')
+        finally:
+            self.conn.unregister('cleaned')
+        return cleaned.num_rows
+
+    def load_terms(self, data_dir, terms, set_cities, city_index=None, file_format='json', geolocate=None):
+        """
+        Load the landed files of many terms; terms sharing a raw table (ex. 'Coffee', 'Coffee & Tea') are
+        loaded into it together. The source tables of no term are created empty.
+
+        :param data_dir: The directory of the landed files.
+        :param terms: The terms to load.
+        :param file_format: The format of the landed files, 'json' or 'parquet'.
+        :return: {table: number of rows loaded}.
+        """
+        paths = {}
+        for term in terms:
+            paths.setdefault(raw_table(term), []).extend(landed_files(data_dir, term, file_format))
+        loaded = {}
+        for table, table_paths in paths.items():
+            loaded[table] = self.load_table(table, table_paths, set_cities, city_index, geolocate)
+            print(f"{table}: {loaded[table]} rows from {len(table_paths)} files")
+        for table in SOURCE_TABLES:
+            if table not in loaded:
+                self.load_table(table, [], set_cities)
+        return loaded
+
+    def row_counts(self, schema=DBT_SCHEMA):
+        """
+        :return: {table or view: number of rows} of a schema, ex. the models built by dbt.
+        """
+        names = self.conn.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = ? "
+                                  "ORDER BY table_name", [schema]).fetchall()
+        return {name: self.conn.execute(f'SELECT COUNT(*) FROM {schema}."{name}"').fetchone()[0]
+                for (name,) in names}
+
+    def close(self):
+        self.conn.close()
+
+
+def write_profile(database_path, profiles_dir, threads=4):
+    """
+    Write the dbt profile of the project with a DuckDB target on a database file.
+
+    :return: The directory of the profiles.yml, for --profiles-dir.
+    """
+    profiles_dir = Path(profiles_dir)
+    profiles_dir.mkdir(parents=True, exist_ok=True)
+    (profiles_dir / 'profiles.yml').write_text(f"""default:
+  target: {DBT_TARGET}
+  outputs:
+    {DBT_TARGET}:
+      type: duckdb
+      path: '{Path(database_path).resolve()}'
+      schema: {DBT_SCHEMA}
+      threads: {threads}
+""")
+    return profiles_dir
+
+
+def run_dbt(database_path, args=('build',), project_dir=PROJECT_DIR):
+    """
+    Run dbt on the DuckDB database file. The file must not be open in this process (DuckDB has a single writer).
+
+    :param database_path: The path of the DuckDB database file.
+    :param args: The dbt command and its arguments (ex. ('build', '--select', 'stg_restaurants+')).
+    :param project_dir: The directory of dbt_project.yml.
+    :return: The exit code of dbt.
+    """
+    profiles_dir = write_profile(database_path, Path(database_path).resolve().parent / 'dbt_duckdb_profile')
+    options = ['--project-dir', str(project_dir), '--profiles-dir', str(profiles_dir)]
+    if not (Path(project_dir) / 'dbt_packages').exists():
+        subprocess.run(['dbt', 'deps', *options], check=True)
+    return subprocess.run(['dbt', *args, *options, '--target', DBT_TARGET]).returncode
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dbt models on a local DuckDB warehouse.")
+    parser.add_argument('--data-dir', default='../data/data', help="directory of the landed files")
+    parser.add_argument('--terms', nargs='+', default=['Restaurants', 'Food', 'Desserts', 'Coffee & Tea'])
+    parser.add_argument('--file-format', default='json', choices=['json', 'parquet'])
+    parser.add_argument('--database', default='../data/yelp_warehouse.duckdb', help="DuckDB database file")
+    parser.add_argument('--cities', default=str(PROJECT_DIR / 'california_lat_long_cities.csv'))
+    parser.add_argument('--skip-load', action='store_true', help="rebuild the models on the loaded tables")
+    parser.add_argument('--dbt', default='build', help="dbt command and arguments (ex. 'build --select stg_cafes+')")
+    args = parser.parse_args()
+
+    warehouse = DuckDBWarehouse(args.database)
+    if not args.skip_load:
+        df_locations = pd.read_csv(args.cities)
+        warehouse.load_terms(args.data_dir, args.terms, set(df_locations['Name']), CityIndex(df_locations),
+                             args.file_format)
+    warehouse.close()
+
+    exit_code = run_dbt(args.database, shlex.split(args.dbt))
+    warehouse = DuckDBWarehouse(args.database)
+    for name, count in warehouse.row_counts().items():
+        print(f"{DBT_SCHEMA}.{name}: {count} rows")
+    warehouse.close()
+    raise SystemExit(exit_code)
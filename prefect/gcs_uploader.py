@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import threading
+from pathlib import Path
+from pipeline_metrics import METRICS
+
+"""
+Content-addressed uploads of landed files to the data lake bucket.
+
+Every object is stored with the SHA-256 of its uncompressed content in its metadata. Before uploading,
+the uploader compares the hash of the local file with the stored one and skips the upload when they
+match, so re-running an ingest whose API results did not change costs no upload at all. Text payloads
+(JSON, CSV) are stored gzip-compressed with Content-Encoding: gzip; the storage client decompresses
+them again on download, so readers of the bucket do not change. Parquet files are already compressed
+and are uploaded as they are.
+
+The uploader wraps one google.cloud.storage Bucket, so the bucket block and its client are loaded once
+per flow run instead of once per file, and one uploader can be shared by concurrent upload tasks.
+"""
+
+HASH_METADATA_KEY = 'sha256'
+COMPRESSED_SUFFIXES = ('.json', '.csv')
+CONTENT_TYPES = {'.json': 'application/json', '.csv': 'text/csv', '.parquet': 'application/octet-stream'}
+
+
+class GcsUploader:
+    """
+    Uploads local files to a bucket, skipping files whose content is already stored.
+    """
+
+    def __init__(self, bucket, bucket_folder='', compress=True):
+        """
+        :param bucket: A google.cloud.storage Bucket (ex. from GcpCredentials.get_cloud_storage_client()).
+        :param bucket_folder: A folder of the bucket the objects are stored under.
+        :param compress: Store JSON and CSV payloads gzip-compressed.
+        """
+        self.bucket = bucket
+        self.bucket_folder = bucket_folder.strip('/')
+        self.compress = compress
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.skipped = 0
+
+    def object_name(self, name):
+        return f"{self.bucket_folder}/{name}" if self.bucket_folder else name
+
+    def prefetch(self, prefix):
+        """
+        Read the stored hashes of every object under a prefix with one listing request,
+        so the uploads that follow do not each have to fetch the metadata of their object.
+        """
+        for blob in self.bucket.list_blobs(prefix=self.object_name(prefix)):
+            self._hashes[blob.name] = (blob.metadata or {}).get(HASH_METADATA_KEY)
+
+    def stored_hash(self, object_name):
+        if object_name not in self._hashes:
+            blob = self.bucket.get_blob(object_name)
+            self._hashes[object_name] = (blob.metadata or {}).get(HASH_METADATA_KEY) if blob else None
+        return self._hashes[object_name]
+
+    def upload(self, path, name=None, timeout=120):
+        """
+        Upload a local file unless the bucket already holds the same content.
+
+        :param path: The path of the local file to upload.
+        :param name: The object name inside the bucket folder; defaults to 'data/<file name>'.
+        :param timeout: The upload timeout in seconds.
+        :return: True when the file was uploaded, False when the upload was skipped.
+        """
+        path = Path(path)
+        object_name = self.object_name(name or f"data/{path.name}")
+        payload = path.read_bytes()
+        digest = hashlib.sha256(payload).hexdigest()
+        if self.stored_hash(object_name) == digest:
+            with self._lock:
+                self.skipped += 1
+            METRICS.incr('gcs_uploads_total', result='skipped')
+            return False
+
+        blob = self.bucket.blob(object_name)
+        blob.metadata = {HASH_METADATA_KEY: digest}
+        if self.compress and path.suffix in COMPRESSED_SUFFIXES:
+            # mtime=0 keeps the compressed bytes identical for identical content
+            payload = gzip.compress(payload, mtime=0)
+            blob.content_encoding = 'gzip'
+        blob.upload_from_string(payload, content_type=CONTENT_TYPES.get(path.suffix, 'application/octet-stream'),
+                                timeout=timeout)
+        self._hashes[object_name] = digest
+        with self._lock:
+            self.uploaded += 1
+        METRICS.incr('gcs_uploads_total', result='uploaded')
+        METRICS.incr('gcs_bytes_uploaded_total', len(payload))
+        return True
@@ -0,0 +1,117 @@
+import re
+import time
+import sqlite3
+import pandas as pd
+from datetime import datetime, timezone
+
+"""
+Persistent geocoding cache for businesses the API returns without coordinates.
+
+Nominatim allows 1 request per second, so every address lookup is expensive. Results are stored in a
+SQLite table keyed by the normalized address, so an address resolved once is never requested again,
+whichever term, location or run it comes back from. Addresses Nominatim could not resolve are stored
+too (with NULL coordinates), so they do not spend the budget again either.
+
+main.py and the GCS to BQ flow use the same cache; point both at the same file with GEOCODE_CACHE_PATH.
+"""
+
+
+def normalize_address(address):
+    """
+    Normalize an address into its cache key: lower case, single spaces and no space before commas.
+    (ex. ' 123  Main St ,San Jose CA 95112' -> '123 main st, san jose ca 95112')
+    """
+    address = re.sub(r'\s+', ' ', str(address)).strip().lower()
+    address = re.sub(r'\s*,\s*', ', ', address)
+    return address.strip(', ')
+
+
+class GeocodeCache:
+    """
+    SQLite table of normalized address -> (latitude, longitude) in front of a rate limited geocoder.
+    """
+
+    def __init__(self, path, min_interval=1.0):
+        """
+        :param path: The path of the SQLite database file; it is created if it does not exist.
+        :param min_interval: The minimum number of seconds between two geocoder requests.
+        """
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, latitude REAL, "
+                          "longitude REAL, resolved_at TEXT) WITHOUT ROWID")
+        self.min_interval = min_interval
+        self._last_request = 0.0
+        self.hits = 0
+        self.requests = 0
+
+    def lookup(self, keys):
+        """
+        :return: A dictionary of normalized address -> (latitude, longitude) for the keys already resolved;
+                 coordinates are None for addresses the geocoder could not find.
+        """
+        found = {}
+        # stay below SQLite's limit on the number of bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT address, latitude, longitude FROM geocodes WHERE address IN ({','.join('?' * len(chunk))})",
+                chunk)
+            found.update((address, (lat, long)) for address, lat, long in rows)
+        return found
+
+    def _request(self, geocode, address):
+        # keep to the geocoder's rate limit across calls
+        wait = self.min_interval - (time.monotonic() - self._last_request)
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            location = geocode(address)
+        finally:
+            self._last_request = time.monotonic()
+        self.requests += 1
+        return (location.latitude, location.longitude) if location else (None, None)
+
+    def resolve(self, addresses, geocode):
+        """
+        Resolve many addresses, requesting each address never seen before exactly once.
+
+        :param addresses: An iterable of addresses; duplicates are only resolved once.
+        :param geocode: A callable taking an address and returning an object with latitude/longitude
+                        or None (ex. Nominatim(...).geocode).
+        :return: A dictionary of normalized address -> (latitude, longitude).
+        """
+        queries = {}
+        for address in addresses:
+            queries.setdefault(normalize_address(address), address)
+        resolved = self.lookup(list(queries))
+        self.hits += len(resolved)
+        for key, address in queries.items():
+            if key in resolved:
+                continue
+            resolved[key] = self._request(geocode, address)
+            # commit every answer, so a failure later in the batch does not lose the budget spent
+            self.conn.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)",
+                              (key, *resolved[key], datetime.now(timezone.utc).isoformat()))
+            self.conn.commit()
+        return resolved
+
+    def fill_missing(self, df, geocode):
+        """
+        Fill 'latitude' and 'longitude' of the rows missing both from their 'address'.
+
+        :param df: A DataFrame with 'latitude', 'longitude' and 'address' columns.
+        :param geocode: See resolve.
+        :return: The DataFrame with the coordinates that could be resolved filled in.
+        """
+        missing = df['latitude'].isna() & df['longitude'].isna()
+        if not missing.any():
+            return df
+        keys = df.loc[missing, 'address'].map(normalize_address)
+        resolved = self.resolve(df.loc[missing, 'address'].unique(), geocode)
+        coordinates = pd.DataFrame(keys.map(resolved).tolist(), index=keys.index, columns=['latitude', 'longitude'])
+        df.loc[missing, 'latitude'] = coordinates['latitude'].astype(float)
+        df.loc[missing, 'longitude'] = coordinates['longitude'].astype(float)
+        return df
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from pipeline_metrics import METRICS
+
+"""
+Canonical city and address values of the businesses, normalized once per distinct raw value.
+
+The transforms used to rebuild 'city' and 'address' row by row with chains of
+.replace('  ', ' ').replace(',', '').lower().rstrip(), although a pull holds a few hundred distinct
+cities and zip codes for hundreds of thousands of businesses. A MemoizedNormalizer factorizes a column
+into its distinct values, normalizes only the values it has not seen before and maps the results back
+to the rows by their codes. The lookup tables live as long as the process, so the cities of every file
+transformed by a process (or a worker process of the GCS to BQ flow) are normalized once.
+
+build_addresses assembles the addresses from the normalized parts with vectorized string operations.
+The normalizations are the ones the transforms always applied, so their output does not change:
+    city                      - single spaces, no commas, lower case, no trailing spaces
+    address with no address2  - '{address1}, {city without trailing spaces} {state} {zip}'
+    address with an address2  - '{address1} {address2}, {city with single spaces, no commas,
+                                  no trailing spaces} {state} {zip}'
+
+Every normalizer counts the rows it served, the distinct values it looked up and how many of them were
+already in its table; stats() returns them with the hit rates, and the lookups are also recorded in
+pipeline_metrics as normalize_lookups_total.
+"""
+
+
+def canonical_city(raw):
+    return str(raw).replace('  ', ' ').replace(',', '').lower().rstrip()
+
+
+def address_city(raw):
+    return str(raw).rstrip()
+
+
+def clean_address_city(raw):
+    return str(raw).replace('  ', ' ').replace(',', '').rstrip()
+
+
+def state_zip(key):
+    state, zip_code = key
+    return f" {state} {zip_code}"
+
+
+class MemoizedNormalizer:
+    """
+    A lookup table from raw values (or tuples of raw values) to their normalized value.
+    """
+
+    def __init__(self, name, function, max_size=100000):
+        """
+        :param name: The name of the table in the stats and metrics (ex. 'city').
+        :param function: Normalizes one raw value; called once per distinct value.
+        :param max_size: The table is emptied when it holds this many values, to bound its memory.
+        """
+        self.name = name
+        self.function = function
+        self.max_size = max_size
+        self.table = {}
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, raw):
+        try:
+            value = self.table[raw]
+        except KeyError:
+            if len(self.table) >= self.max_size:
+                self.table.clear()
+            value = self.table[raw] = self.function(raw)
+            self.misses += 1
+            return value
+        self.hits += 1
+        return value
+
+    def normalize(self, *columns):
+        """
+        Normalize a column, or the tuples of several aligned columns.
+
+        :param columns: Series with the same index; missing values are normalized as their str(), as
+                        .astype(str) does.
+        :return: A Series of the normalized values with the index of the columns.
+        """
+        if columns[0].empty:
+            return pd.Series([], index=columns[0].index, dtype=object)
+        columns = [column.where(column.notna(), column[column.isna()].astype(str)) if column.isna().any()
+                   else column for column in columns]
+        # the codes of the columns combined into one integer, then the distinct combinations of them
+        codes = np.zeros(len(columns[0]), dtype=np.int64)
+        levels = []
+        for column in columns:
+            column_codes, column_uniques = pd.factorize(column)
+            codes = codes * len(column_uniques) + column_codes
+            levels.append(np.asarray(column_uniques, dtype=object))
+        codes, combined = pd.factorize(codes)
+        parts = []
+        for level in reversed(levels):
+            parts.append(level[combined % len(level)])
+            combined = combined // len(level)
+        uniques = parts[0] if len(parts) == 1 else list(zip(*reversed(parts)))
+        hits_before = self.hits
+        values = pd.Series([self.lookup(raw) for raw in uniques], dtype=object)
+        self.rows += len(codes)
+        METRICS.incr('normalize_lookups_total', self.hits - hits_before, table=self.name, result='hit')
+        METRICS.incr('normalize_lookups_total', len(uniques) - (self.hits - hits_before), table=self.name,
+                     result='miss')
+        return pd.Series(values.to_numpy()[codes], index=columns[0].index, dtype=object)
+
+    def stats(self):
+        """
+        :return: The rows served, the distinct values looked up, the hits among them, the size of the
+                 table, the hit rate of the lookups and the share of rows that needed no normalization.
+        """
+        lookups = self.hits + self.misses
+        return {'rows': self.rows, 'lookups': lookups, 'hits': self.hits, 'size': len(self.table),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'row_hit_rate': 1 - self.misses / self.rows if self.rows else 0.0}
+
+
+CITIES = MemoizedNormalizer('city', canonical_city)
+ADDRESS_CITIES = MemoizedNormalizer('address_city', address_city)
+CLEAN_ADDRESS_CITIES = MemoizedNormalizer('clean_address_city', clean_address_city)
+STATE_ZIPS = MemoizedNormalizer('state_zip', state_zip)
+NORMALIZERS = (CITIES, ADDRESS_CITIES, CLEAN_ADDRESS_CITIES, STATE_ZIPS)
+
+
+def build_addresses(location):
+    """
+    The addresses of businesses from their location fields.
+
+    :param location: A DataFrame of the 'location' dictionaries of the API (address1, address2, city, state
+                     and zip_code columns), ex. from pd.json_normalize.
+    :return: A Series of addresses with the index of location.
+    """
+    street = location['address1'].astype(str)
+    zip_part = STATE_ZIPS.normalize(location['state'], location['zip_code'])
+    address = street + ', ' + ADDRESS_CITIES.normalize(location['city']) + zip_part
+    with_address2 = location['address2'].notna() & (location['address2'] != '')
+    if with_address2.any():
+        address[with_address2] = (street[with_address2] + ' ' + location['address2'][with_address2].astype(str)
+                                  + ', ' + CLEAN_ADDRESS_CITIES.normalize(location['city'][with_address2])
+                                  + zip_part[with_address2])
+    return address
+
+
+def normalization_stats():
+    """
+    :return: {table name: stats()} of the lookup tables of this process.
+    """
+    return {normalizer.name: normalizer.stats() for normalizer in NORMALIZERS}
@@ -0,0 +1,90 @@
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+
+"""
+Parquet reading and writing for the raw and cleaned data layers.
+
+Both flows can land and load the data as compressed Parquet instead of JSON (file_format='parquet').
+The cleaned layer is written with an explicit Arrow schema matching the {term}_data_raw tables in
+bq_loader.py, so categories/ethnic_category are Parquet lists that BigQuery loads as REPEATED columns.
+The raw layer keeps whatever the API returned; its schema is inferred from every business, not only the
+first one, because businesses do not all have the same keys (ex. 'price').
+"""
+
+FILE_FORMATS = ('json', 'parquet')
+COMPRESSION = 'zstd'
+
+CLEANED_SCHEMA = pa.schema([
+    pa.field('id', pa.string(), nullable=False),
+    pa.field('alias', pa.string(), nullable=False),
+    pa.field('name', pa.string(), nullable=False),
+    pa.field('url', pa.string()),
+    pa.field('review_count', pa.int64()),
+    pa.field('categories', pa.list_(pa.string())),
+    pa.field('ethnic_category', pa.list_(pa.string())),
+    pa.field('rating', pa.float64()),
+    pa.field('price', pa.string()),
+    pa.field('latitude', pa.float64()),
+    pa.field('longitude', pa.float64()),
+    pa.field('city', pa.string()),
+    pa.field('address', pa.string()),
+    pa.field('type', pa.string()),
+])
+
+
+def file_suffix(file_format):
+    """
+    File extension of the landed files of a format.
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"file_format must be one of {FILE_FORMATS}, got {file_format!r}")
+    return '.json' if file_format == 'json' else '.parquet'
+
+
+def write_raw(records, path):
+    """
+    Write a list of business dictionaries as JSON or Parquet, depending on the extension of path.
+    """
+    path = Path(path)
+    if path.suffix != '.parquet':
+        with open(path, 'w') as f:
+            json.dump(records, f)
+        return path
+    # one column per key of any business; Table.from_pylist would only use the keys of the first one
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    table = pa.table({column: [record.get(column) for record in records] for column in columns})
+    pq.write_table(table, path, compression=COMPRESSION)
+    return path
+
+
+def read_raw(path):
+    """
+    Read a landed file written by write_raw into a DataFrame of businesses.
+    """
+    if Path(path).suffix != '.parquet':
+        return pd.read_json(path)
+    # go through Python objects so nested columns are lists and dictionaries, as with pd.read_json
+    return pd.DataFrame(pq.read_table(path).to_pylist())
+
+
+def cleaned_table(df):
+    """
+    Arrow table of cleaned businesses with the schema of the {term}_data_raw tables.
+    """
+    if df.empty:
+        return CLEANED_SCHEMA.empty_table()
+    return pa.Table.from_pandas(df[CLEANED_SCHEMA.names], schema=CLEANED_SCHEMA, preserve_index=False)
+
+
+def parquet_bytes(tables):
+    """
+    Serialize Arrow tables with the same schema into one compressed Parquet file in memory.
+    """
+    buffer = io.BytesIO()
+    pq.write_table(pa.concat_tables(tables), buffer, compression=COMPRESSION)
+    buffer.seek(0)
+    return buffer
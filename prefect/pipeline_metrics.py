@@ -0,0 +1,175 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+"""
+Lightweight per-stage metrics for the flows: counters, timers and histograms.
+
+The modules of each stage record into the process wide METRICS registry (API pages and their latency
+in yelp_search_client.py, rows dropped by each filter in yelp_transform.py, geocoding requests, uploads,
+BigQuery load jobs...), and each flow publishes a summary of its run at the end: a markdown table as a
+Prefect artifact, plus a JSON file and a Prometheus textfile (for the node exporter textfile collector).
+That is enough to tell whether a slow run was the API, the transform or the load.
+
+Transform workers of a process pool record into their own registry; they hand it back with
+snapshot(reset=True) and the flow merges it into its own.
+"""
+
+PREFIX = 'yelp_'
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}' if pairs else ''
+
+
+class Metrics:
+    """
+    Thread safe registry of counters and histograms, keyed by name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def incr(self, name, value=1, **labels):
+        """
+        Add value to a counter (ex. incr('api_requests_total', status=200)).
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        """
+        Record one value into a histogram; the buckets are fixed by the first observation.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': tuple(buckets), 'counts': [0] * len(buckets),
+                                                    'count': 0, 'sum': 0.0, 'min': math.inf, 'max': -math.inf}
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = min(histogram['min'], value)
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time a block into the histogram name (ex. with METRICS.timer('stage_seconds', stage='transform'):).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self, reset=False):
+        """
+        :return: A picklable copy of the registry, to merge into another one.
+        """
+        with self._lock:
+            snapshot = {'counters': dict(self.counters),
+                        'histograms': {key: dict(value, counts=list(value['counts']))
+                                       for key, value in self.histograms.items()}}
+        if reset:
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add the counters and histograms of a snapshot to the registry.
+        """
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, value in snapshot['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None or histogram['buckets'] != value['buckets']:
+                    self.histograms[key] = dict(value, counts=list(value['counts']))
+                    continue
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], value['counts'])]
+                histogram['count'] += value['count']
+                histogram['sum'] += value['sum']
+                histogram['min'] = min(histogram['min'], value['min'])
+                histogram['max'] = max(histogram['max'], value['max'])
+
+    def summary(self):
+        """
+        :return: A JSON serializable dictionary of every counter and histogram.
+        """
+        snapshot = self.snapshot()
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(snapshot['counters'].items())],
+            'histograms': [{'name': name, 'labels': dict(labels), 'count': h['count'], 'sum': h['sum'],
+                            'min': h['min'], 'max': h['max'], 'mean': h['sum'] / h['count'],
+                            'buckets': dict(zip(map(str, h['buckets']), h['counts']))}
+                           for (name, labels), h in sorted(snapshot['histograms'].items())],
+        }
+
+    def to_markdown(self, title='Pipeline metrics'):
+        """
+        The summary as markdown tables, for a Prefect artifact.
+        """
+        summary = self.summary()
+        lines = [f"# {title}", '', '| counter | labels | value |', '|---|---|---|']
+        lines += [f"| {c['name']} | {_label_text(c['labels'].items())} | {c['value']} |" for c in summary['counters']]
+        lines += ['', '| histogram | labels | count | mean | max | sum |', '|---|---|---|---|---|---|']
+        lines += [f"| {h['name']} | {_label_text(h['labels'].items())} | {h['count']} | {h['mean']:.4g} | "
+                  f"{h['max']:.4g} | {h['sum']:.4g} |" for h in summary['histograms']]
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        """
+        The registry in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_label_text(labels)} {value}")
+        for (name, labels), h in sorted(snapshot['histograms'].items()):
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            for bound, count in zip(h['buckets'], h['counts']):
+                lines.append(f"{PREFIX}{name}_bucket{_label_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{PREFIX}{name}_bucket{_label_text(labels, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{PREFIX}{name}_sum{_label_text(labels)} {h['sum']}")
+            lines.append(f"{PREFIX}{name}_count{_label_text(labels)} {h['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_path=None, prometheus_path=None):
+        """
+        Write the summary as JSON and/or a Prometheus textfile.
+        """
+        if json_path is not None:
+            with open(json_path, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
+        if prometheus_path is not None:
+            with open(prometheus_path, 'w') as f:
+                f.write(self.to_prometheus())
+
+
+METRICS = Metrics()
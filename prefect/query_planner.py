@@ -0,0 +1,183 @@
+import math
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from yelp_search_client import SEARCH_LIMIT, MAX_RESULTS
+
+"""
+Coverage-aware planner for the search circles sent to the Yelp Fusion API.
+
+Starting from one circle per row of california_lat_long_cities.csv, the planner
+(1) merges circles that mostly overlap each other into one enclosing circle, so neighbouring cities
+    (ex. the LA basin) are not paid for several times, and
+(2) recursively splits any circle whose reported 'total' is above the 1000 result cap into four
+    smaller circles (quadtree style), so dense areas no longer silently lose businesses.
+
+The result is a DataFrame with the same Name/Latitude/Longitude columns as the city list plus a Radius,
+which the ingest flow iterates over instead of the raw city list.
+"""
+
+# Yelp does not accept a search radius above 40000 meters
+MAX_RADIUS = 40000
+EARTH_RADIUS_M = 6371008.8
+
+Circle = namedtuple('Circle', ['name', 'lat', 'long', 'radius'])
+
+
+def haversine_m(lat1, long1, lat2, long2):
+    """
+    Great circle distance in meters; works on floats or numpy arrays.
+    """
+    lat1, long1, lat2, long2 = map(np.radians, (lat1, long1, lat2, long2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def destination_point(lat, long, bearing, distance):
+    """
+    Point reached from (lat, long) by travelling distance meters along the given bearing, in degrees.
+    """
+    angular = distance / EARTH_RADIUS_M
+    lat1, long1, bearing = map(math.radians, (lat, long, bearing))
+    lat2 = math.asin(math.sin(lat1) * math.cos(angular) + math.cos(lat1) * math.sin(angular) * math.cos(bearing))
+    long2 = long1 + math.atan2(math.sin(bearing) * math.sin(angular) * math.cos(lat1),
+                               math.cos(angular) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), math.degrees(long2)
+
+
+def overlap_fraction(distance, r1, r2):
+    """
+    Area shared by two circles as a fraction of the smaller circle's area.
+
+    :param distance: Distance between the two centres in meters.
+    :param r1: Radius of the first circle in meters.
+    :param r2: Radius of the second circle in meters.
+    """
+    if distance >= r1 + r2:
+        return 0.0
+    if distance <= abs(r1 - r2):
+        return 1.0
+    lens = (r1 ** 2 * math.acos((distance ** 2 + r1 ** 2 - r2 ** 2) / (2 * distance * r1))
+            + r2 ** 2 * math.acos((distance ** 2 + r2 ** 2 - r1 ** 2) / (2 * distance * r2))
+            - 0.5 * math.sqrt((-distance + r1 + r2) * (distance + r1 - r2)
+                              * (distance - r1 + r2) * (distance + r1 + r2)))
+    return lens / (math.pi * min(r1, r2) ** 2)
+
+
+def enclosing_circle(a, b, distance):
+    """
+    Smallest circle containing both circles; keeps the name of the first one.
+    """
+    if distance + b.radius <= a.radius:
+        return a
+    if distance + a.radius <= b.radius:
+        return b._replace(name=a.name)
+    radius = (distance + a.radius + b.radius) / 2
+    # move the centre from a towards b; the distances involved are small enough to interpolate degrees
+    t = (radius - a.radius) / distance
+    return Circle(a.name, a.lat + t * (b.lat - a.lat), a.long + t * (b.long - a.long), radius)
+
+
+def merge_overlapping_circles(circles, threshold=0.6, max_radius=MAX_RADIUS):
+    """
+    Greedily merge circles whose overlap is at least threshold of the smaller circle.
+
+    :param circles: A list of Circle.
+    :param threshold: Minimum overlap fraction for two circles to be merged.
+    :param max_radius: Merges that would produce a larger radius than this are skipped.
+    :return: A list of Circle.
+    """
+    merged = []
+    for circle in circles:
+        for i, kept in enumerate(merged):
+            distance = float(haversine_m(kept.lat, kept.long, circle.lat, circle.long))
+            if overlap_fraction(distance, kept.radius, circle.radius) < threshold:
+                continue
+            candidate = enclosing_circle(kept, circle, distance)
+            if candidate.radius <= max_radius:
+                merged[i] = candidate
+                break
+        else:
+            merged.append(circle)
+    return merged
+
+
+def split_circle(circle):
+    """
+    Split a circle into four children that together cover its bounding square.
+
+    Each child is the circumscribed circle of one quadrant of the square, so its radius is radius/sqrt(2).
+    The points of the parent's edge due north, east, south and west lie exactly on the edge of two children,
+    so the centres are placed along the diagonals on the sphere rather than by offsetting degrees.
+    """
+    radius = circle.radius / math.sqrt(2)
+    return [Circle(f"{circle.name}_q{i}", *destination_point(circle.lat, circle.long, bearing, radius), radius)
+            for i, bearing in enumerate([315, 45, 225, 135])]
+
+
+def search_radius(circle):
+    """
+    Radius sent to the API, in whole meters: rounded up so a circle never shrinks below what it has to cover.
+    """
+    return math.ceil(circle.radius - 1e-6)
+
+
+def expected_page_calls(total):
+    """
+    Number of search requests fetch_location_pages makes for a circle with the given 'total'.
+    The first page reports the total, so only the pages holding businesses are requested, up to the
+    1000 result cap.
+    """
+    return max(math.ceil(min(total, MAX_RESULTS) / SEARCH_LIMIT), 1)
+
+
+def build_query_plan(df_locations, probe_totals, radius=10000, merge_threshold=0.6, max_merged_radius=15000,
+                     max_depth=5):
+    """
+    Build the set of search circles covering the locations.
+
+    :param df_locations: A dataframe containing location data like place name, Latitude, and Longitude
+    :param probe_totals: A callable taking a list of (lat, long, radius) tuples and returning the 'total'
+                         the API reports for each of them.
+    :param radius: The starting radius of every city circle, in meters.
+    :param merge_threshold: Minimum overlap fraction for two city circles to be merged.
+    :param max_merged_radius: Merged circles never grow beyond this radius, in meters.
+    :param max_depth: How many times a capped circle may be split.
+    :return: A DataFrame with Name, Latitude, Longitude, Radius, Total and Capped columns, and the
+             number of probe requests spent on planning.
+    """
+    circles = [Circle(name, float(lat), float(long), radius)
+               for name, lat, long in zip(df_locations['Name'], df_locations['Latitude'], df_locations['Longitude'])]
+    pending = merge_overlapping_circles(circles, threshold=merge_threshold, max_radius=min(max_merged_radius, MAX_RADIUS))
+
+    plan = []
+    probe_calls = 0
+    for depth in range(max_depth + 1):
+        if not pending:
+            break
+        # probe a whole level of the quadtree at once
+        totals = probe_totals([(c.lat, c.long, search_radius(c)) for c in pending])
+        probe_calls += len(pending)
+        next_level = []
+        for circle, total in zip(pending, totals):
+            if total > MAX_RESULTS and depth < max_depth:
+                next_level.extend(split_circle(circle))
+            else:
+                plan.append((circle.name, circle.lat, circle.long, search_radius(circle), total, total > MAX_RESULTS))
+        pending = next_level
+
+    df_plan = pd.DataFrame(plan, columns=['Name', 'Latitude', 'Longitude', 'Radius', 'Total', 'Capped'])
+    return df_plan, probe_calls
+
+
+def expected_call_count(df_plan, probe_calls=0):
+    """
+    Report how many API calls running a plan is expected to cost.
+
+    :param df_plan: A plan returned by build_query_plan.
+    :param probe_calls: The number of requests already spent on planning.
+    :return: A dictionary with the planning, fetching and total call counts.
+    """
+    fetch_calls = int(sum(expected_page_calls(total) for total in df_plan['Total']))
+    return {'circles': len(df_plan), 'capped_circles': int(df_plan['Capped'].sum()),
+            'probe_calls': probe_calls, 'fetch_calls': fetch_calls, 'total_calls': probe_calls + fetch_calls}
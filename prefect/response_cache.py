@@ -0,0 +1,118 @@
+import json
+import time
+import sqlite3
+import hashlib
+
+"""
+On-disk cache of Yelp Fusion search responses, one entry per requested page.
+
+Entries are keyed by the normalized query parameters of the request (url, term, coordinates, radius,
+offset, limit), so a rerun within the TTL gets every page it already fetched without spending API quota,
+whichever flow, task or location list requested it. The term is part of the key: two terms that return
+overlapping businesses still send different requests and do not share entries.
+
+The cache is a SQLite table bounded in size; when it grows above max_bytes the least recently used
+entries are evicted. The total size is kept as a running count rather than summed on every put, and
+recomputed from the table whenever it calls for an eviction, so entries written by other processes
+sharing the file are accounted for before anything is evicted.
+"""
+
+
+def cache_key(url, parameters):
+    """
+    Hash of the normalized query parameters of a request.
+    """
+    normalized = {
+        'url': url.split('://', 1)[-1].rstrip('/'),
+        'term': str(parameters['term']).strip().lower(),
+        'latitude': round(float(parameters['latitude']), 6),
+        'longitude': round(float(parameters['longitude']), 6),
+        'radius': int(parameters['radius']),
+        'offset': int(parameters['offset']),
+        'limit': int(parameters['limit']),
+        'is_closed': str(parameters.get('is_closed', '')).lower(),
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite backed response cache with a TTL and least recently used eviction.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, max_bytes=512 * 1024 * 1024):
+        """
+        :param path: The path of the SQLite database file; it is created if it does not exist.
+        :param ttl: How long a response is served from the cache, in seconds.
+        :param max_bytes: The maximum total size of the cached responses.
+        """
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body TEXT, size INTEGER, "
+                          "created_at REAL, accessed_at REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.total_bytes = self._table_bytes()
+
+    def _table_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url, parameters):
+        """
+        :return: The cached response of a request, or None when it is not cached or has expired.
+        """
+        key = cache_key(url, parameters)
+        row = self.conn.execute("SELECT body, created_at, size FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                self.expired += 1
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                self.total_bytes -= row[2]
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, url, parameters, data):
+        """
+        Store the response of a request, evicting the least recently used entries above max_bytes.
+        """
+        key = cache_key(url, parameters)
+        body = json.dumps(data)
+        now = time.time()
+        replaced = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, body, len(body), now, now))
+        self.total_bytes += len(body) - (replaced[0] if replaced else 0)
+        if self.total_bytes > self.max_bytes:
+            self.total_bytes = self._table_bytes()
+            evicted = []
+            # walk the accessed_at index only as far as needed
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+            for old_key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                evicted.append((old_key,))
+                self.total_bytes -= size
+            rows.close()
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+        self.conn.commit()
+
+    def stats(self):
+        """
+        :return: A dictionary with the hit, miss, expiry and eviction counts and the hit rate.
+        """
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'expired': self.expired, 'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,91 @@
+import hashlib
+import sqlite3
+from datetime import datetime, timezone
+
+"""
+Durable manifest of the units of work completed by the ingest and GCS to BQ flows.
+
+A unit is one (term, location) search of a run: its result pages are written into a single
+{term}-{location}-{index}.json object, so the unit records how many pages it took, the object it
+produced and the checksum of that object. The flows skip every unit already completed for their run,
+so a crash late in a 459-location run resumes where it stopped instead of starting over.
+Units are keyed by a run name; start a fresh backfill by using a new run name.
+A unit that fails is recorded with its error in the failures table instead, and stays pending, so the
+next attempt of the run retries it.
+"""
+
+
+def file_checksum(path):
+    """
+    SHA-256 hex digest of a file.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class RunManifest:
+    """
+    SQLite table of completed (run, stage, term, index) units.
+    """
+
+    def __init__(self, path, run_name='default'):
+        """
+        :param path: The path of the SQLite database file; it is created if it does not exist.
+        :param run_name: The name of the run the units belong to.
+        """
+        self.run_name = run_name
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS units (run TEXT, stage TEXT, term TEXT, idx INTEGER, "
+                          "location TEXT, pages INTEGER, rows INTEGER, object TEXT, checksum TEXT, "
+                          "completed_at TEXT, PRIMARY KEY (run, stage, term, idx))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS failures (run TEXT, stage TEXT, term TEXT, idx INTEGER, "
+                          "location TEXT, error TEXT, failed_at TEXT, PRIMARY KEY (run, stage, term, idx))")
+
+    def completed(self, stage, term):
+        """
+        :return: The set of location indexes already completed for a stage and term.
+        """
+        rows = self.conn.execute("SELECT idx FROM units WHERE run = ? AND stage = ? AND term = ?",
+                                 (self.run_name, stage, term))
+        return {idx for (idx,) in rows}
+
+    def pending(self, stage, term, indexes):
+        """
+        :return: The indexes, in order, that still have to run for a stage and term.
+        """
+        done = self.completed(stage, term)
+        return [i for i in indexes if i not in done]
+
+    def complete(self, stage, term, index, location, object_name, checksum, pages=None, rows=None):
+        """
+        Record a unit as completed; recording it again overwrites the previous entry.
+        """
+        self.conn.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (self.run_name, stage, term, index, location, pages, rows, object_name, checksum,
+                           datetime.now(timezone.utc).isoformat()))
+        self.conn.execute("DELETE FROM failures WHERE run = ? AND stage = ? AND term = ? AND idx = ?",
+                          (self.run_name, stage, term, index))
+        self.conn.commit()
+
+    def fail(self, stage, term, index, location, error):
+        """
+        Record the error of a unit that failed; the unit stays pending until it is completed.
+        """
+        self.conn.execute("INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (self.run_name, stage, term, index, location, repr(error),
+                           datetime.now(timezone.utc).isoformat()))
+        self.conn.commit()
+
+    def failures(self, stage, term):
+        """
+        :return: {location index: error} of the units of a stage and term that failed and were not completed since.
+        """
+        rows = self.conn.execute("SELECT idx, error FROM failures WHERE run = ? AND stage = ? AND term = ?",
+                                 (self.run_name, stage, term))
+        return dict(rows)
+
+    def close(self):
+        self.conn.close()
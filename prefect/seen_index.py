@@ -0,0 +1,135 @@
+import math
+import sqlite3
+import hashlib
+
+"""
+Persistent index of the business ids already landed in the data lake, per run and term.
+
+Search circles overlap, so the same business comes back for many locations of a term. The ingest flow
+checks every page against this index before writing it, and either drops the businesses it has already
+landed for the term or replaces them with a compact reference to the object that holds them.
+
+The ids are keyed by the run name of the ingest flow, like the run manifest: a resumed run keeps
+deduplicating against what it landed before, and a new run (ex. after the query plan was rebuilt or
+use_query_plan toggled, which renames the objects) starts from an empty index and lands every business
+again instead of dropping the ones that live in the objects of an older run.
+
+The index is a SQLite table; an in-memory Bloom filter in front of it answers "never seen" for most
+new ids without touching the database.
+"""
+
+DEDUP_MODES = ('skip', 'reference')
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings using double hashing of a blake2b digest.
+    """
+
+    def __init__(self, capacity=2_000_000, error_rate=0.01):
+        """
+        :param capacity: The number of keys the filter is sized for.
+        :param error_rate: The false positive rate expected at capacity.
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class SeenIndex:
+    """
+    SQLite backed set of (run, term, business id) triples with the object each id was first landed in.
+    """
+
+    def __init__(self, path, run_name='default', use_bloom=True, bloom_capacity=2_000_000):
+        """
+        :param path: The path of the SQLite database file; it is created if it does not exist.
+        :param run_name: The name of the run the ids belong to; ids landed by other runs are not seen.
+        :param use_bloom: Put a Bloom filter in front of the database lookups.
+        :param bloom_capacity: The number of ids the Bloom filter is sized for.
+        """
+        # the flows call into the index from Prefect worker threads
+        self.run_name = run_name
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        # the table of the unscoped index was named 'seen'; its ids are left to their old runs
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen_ids (run TEXT, term TEXT, id TEXT, object TEXT, "
+                          "PRIMARY KEY (run, term, id)) WITHOUT ROWID")
+        self.bloom = None
+        if use_bloom:
+            self.bloom = BloomFilter(capacity=bloom_capacity)
+            for term, business_id in self.conn.execute("SELECT term, id FROM seen_ids WHERE run = ?", (run_name,)):
+                self.bloom.add(f"{term}\x00{business_id}")
+
+    def lookup(self, term, ids):
+        """
+        :return: A dictionary of id -> object for the ids already landed for the term by the run.
+        """
+        candidates = [i for i in ids if self.bloom is None or f"{term}\x00{i}" in self.bloom]
+        found = {}
+        # stay below SQLite's limit on the number of bound parameters
+        for start in range(0, len(candidates), 500):
+            chunk = candidates[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT id, object FROM seen_ids WHERE run = ? AND term = ? AND id IN ({','.join('?' * len(chunk))})",
+                [self.run_name, term, *chunk])
+            found.update(rows)
+        return found
+
+    def filter_new(self, term, businesses, mode='skip', object_name=None):
+        """
+        Split a page of businesses into the records to write and the ids that are new for the term.
+
+        :param term: The term the businesses were searched with.
+        :param businesses: A list of business dictionaries returned by the API.
+        :param mode: 'skip' drops businesses already landed; 'reference' replaces them with
+                     {'id': ..., 'duplicate_of': <object>} so the lineage is kept.
+        :param object_name: The object the page is about to be written to. Ids already landed in that same
+                            object are kept, so rewriting an object after a retry is idempotent.
+        :return: The list of records to write and the list of new ids to pass to mark_landed.
+        """
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"mode must be one of {DEDUP_MODES}, got {mode!r}")
+        seen = self.lookup(term, [business['id'] for business in businesses])
+        records = []
+        new_ids = []
+        written = set()
+        for business in businesses:
+            business_id = business['id']
+            if business_id in seen and seen[business_id] != object_name:
+                if mode == 'reference':
+                    records.append({'id': business_id, 'duplicate_of': seen[business_id]})
+                continue
+            # a business repeated within the same payload is only written once
+            if business_id in written:
+                continue
+            records.append(business)
+            new_ids.append(business_id)
+            written.add(business_id)
+        return records, new_ids
+
+    def mark_landed(self, term, ids, object_name):
+        """
+        Record ids as landed once the object holding them has been uploaded.
+        """
+        self.conn.executemany("INSERT OR IGNORE INTO seen_ids (run, term, id, object) VALUES (?, ?, ?, ?)",
+                              [(self.run_name, term, business_id, object_name) for business_id in ids])
+        self.conn.commit()
+        if self.bloom is not None:
+            for business_id in ids:
+                self.bloom.add(f"{term}\x00{business_id}")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,99 @@
+import json
+import pandas as pd
+
+"""
+The GCS to BQ transform as it was before it moved to yelp_transform.py: read_json_transform_df of
+prefect/yelp_gcs_to_bq.py at the baseline commit, kept as the reference of test_transform_regression.py.
+The body is unchanged; the Prefect decorator is gone, and the geocoding of a row (a Nominatim task) is
+a parameter, so it runs without Prefect or the network. Do not update it along with the transform.
+"""
+
+DEFINITELY_NO_CATEGORIES = {'grocery', 'convenience', 'drugstores'}
+FOOD_AND_BARS_CATEGORIES = {'poutineries', 'sardinian', 'bars', 'divebars', 'tamales', 'winetastingroom', 'comfortfood', 'somali', 'rotisserie_chicken', 'cuban', 'puertorican', 'pastashops', 'meaderies', 'whiskeybars', 'indpak', 'vermouthbars', 'moroccan', 'cupcakes', 'newmexican', 'polynesian', 'falafel', 'pancakes', 'yucatan', 'bbq', 'oaxacan', 'ukrainian', 'arabian', 'foodstands', 'brazilian', 'wineries', 'japacurry', 'pubs', 'himalayan', 'newcanadian', 'tacos', 'australian', 'hainan', 'dinnertheater', 'foodtrucks', 'acaibowls', 'georgian', 'sicilian', 'calabrian', 'irish_pubs', 'dimsum', 'kebab', 'teppanyaki', 'colombian', 'newamerican', 'chinese', 'vietnamese', 'delis', 'irish', 'eritrean', 'southern', 'wraps', 'senegalese', 'tapasmallplates', 'hawaiian', 'guamanian', 'mediterranean', 'hotdog', 'vegan', 'laotian', 'panasian', 'polish', 'beerbar', 'argentine', 'steak', 'sandwiches', 'tex-mex', 'bagels', 'german', 'salad', 'creperies', 'gluten_free', 'pretzels', 'poke', 'jaliscan', 'noodles', 'buffets', 'basque', 'iberian', 'chickenshop', 'singaporean', 'modern_european', 'desserts', 'donuts', 'food_court', 'breweries', 'mexican', 'sushi', 'dominican', 'salvadoran', 'restaurants', 'hotdogs', 'gelato', 'kosher', 'bulgarian', 'burgers', 'raw_food', 'icecream', 'brewpubs', 'mideastern', 'syrian', 'cheesesteaks', 'belgian', 'food', 'peruvian', 'filipino', 'korean', 'soulfood', 'pizza', 'russian', 'bangladeshi', 'caribbean', 'cocktailbars', 'churros', 'tradamerican', 'indonesian', 'wine_bars', 'coffeeroasteries', 'greek', 'french', 'cambodian', 'conveyorsushi', 'themedcafes', 'thai', 'piadina', 'honey', 'fondue', 'sportsbars', 'asianfusion', 'cakeshop', 'slovakian', 'ramen', 'british', 'southafrican', 'empanadas', 'chimneycakes', 'latin', 'tapas', 'diners', 'chicken_wings', 'northernmexican', 'macarons', 'italian', 'beergardens', 'hungarian', 'hotpot', 'cideries', 'shavedsnow', 'vegetarian', 'egyptian', 'ethiopian', 'trinidadian', 'taiwanese', 'portuguese', 'chocolate', 'cafes', 'lebanese', 'soup', 'hkcafe', 'burmese', 'bubbletea', 'bistros', 'malaysian', 'seafood', 'austrian', 'japanese', 'cantonese', 'halal', 'nicaraguan', 'srilankan', 'juicebars', 'diyfood', 'scottish', 'honduran', 'scandinavian', 'gastropubs', 'venezuelan', 'armenian', 'speakeasies', 'coffee', 'spanish', 'tikibars', 'bakeries', 'tea', 'smokehouse', 'turkish', 'izakaya', 'champagne_bars', 'waffles', 'gaybars', 'cajun', 'haitian', 'szechuan', 'fishnchips', 'afghani', 'african', 'czech', 'kombucha', 'shanghainese', 'breakfast_brunch', 'mongolian', 'pakistani', 'gourmet', 'tuscan', 'uzbek', 'persian', 'streetvendors'}
+ETHNICITIES_CATEGORIES = {'japanese', 'greek', 'mideastern', 'uzbek', 'southern', 'arabian', 'eritrean', 'irish', 'oaxacan', 'cantonese', 'colombian', 'szechuan', 'puertorican', 'halal', 'laotian', 'armenian', 'basque', 'austrian', 'korean', 'bangladeshi', 'poutineries', 'somali', 'italian', 'bulgarian', 'yucatan', 'russian', 'dominican', 'latin', 'sardinian', 'filipino', 'lebanese', 'asianfusion', 'newmexican', 'senegalese', 'ukrainian', 'sicilian', 'australian', 'vietnamese', 'polynesian', 'georgian', 'southafrican', 'hkcafe', 'pakistani', 'mexican', 'peruvian', 'tradamerican', 'mongolian', 'portuguese', 'burmese', 'moroccan', 'cajun', 'hainan', 'brazilian', 'caribbean', 'honduran', 'himalayan', 'venezuelan', 'kosher', 'scottish', 'northernmexican', 'calabrian', 'tuscan', 'singaporean', 'cuban', 'chinese', 'hungarian', 'srilankan', 'panasian', 'syrian', 'afghani', 'argentine', 'spanish', 'modern_european', 'tex-mex', 'slovakian', 'cambodian', 'thai', 'belgian', 'czech', 'jaliscan', 'taiwanese', 'newamerican', 'scandinavian', 'malaysian', 'african', 'french', 'guamanian', 'shanghainese', 'british', 'indonesian', 'trinidadian', 'iberian', 'salvadoran', 'indpak', 'ethiopian', 'persian', 'polish', 'nicaraguan', 'newcanadian', 'hawaiian', 'haitian', 'german', 'egyptian', 'turkish'}
+
+
+def read_json_transform_df(path, set_cities, geolocate_with_address):
+    """
+    :param path: The path of a landed JSON file.
+    :param set_cities: The set of city names a business must be located in.
+    :param geolocate_with_address: Fills the coordinates of a row missing them from its 'address'.
+    :return: The newline delimited JSON export and its row count.
+    """
+    df = pd.read_json(path)
+    transformed_dataframe = df.copy()
+
+    # if data frame is completely empty to begin with:
+    if transformed_dataframe.empty:
+        print("Dataframe is empty")
+        export_data = transformed_dataframe.to_json(orient='records', lines=True)
+        return export_data, 0
+
+    # create column named "price" if data frame does not have it and fill it with None for the whole dataset. 
+    if 'price' not in transformed_dataframe.columns:
+        transformed_dataframe['price'] = None
+
+
+    # Section 2. Clean categories
+    # convert 'categories' that were imported as strings to list of dictionaries
+    transformed_dataframe['categories'] = transformed_dataframe['categories'].apply(lambda x: json.loads(json.dumps(x)))
+    # then transform them into lists that only have alias
+    transformed_dataframe['categories'] = transformed_dataframe['categories'].apply(
+        lambda x: [category['alias'] for category in x])
+    # filter for restaurant categories that are included in food and bars categories
+    transformed_dataframe = transformed_dataframe[transformed_dataframe['categories'].apply(
+        lambda x: any(cat in FOOD_AND_BARS_CATEGORIES for cat in x))]
+    # filter out categories that are definitely useless
+    transformed_dataframe = transformed_dataframe[transformed_dataframe['categories'].apply(
+        lambda x: not any(cat in DEFINITELY_NO_CATEGORIES for cat in x))]
+    transformed_dataframe['ethnic_category'] = transformed_dataframe['categories'].apply(
+        lambda x: [category for category in x if category in ETHNICITIES_CATEGORIES]
+                    if any(category in ETHNICITIES_CATEGORIES for category in x)
+                    else ['Not Specified'])
+
+    if transformed_dataframe.empty:
+
+        print("Dataframe is empty")
+        export_data = transformed_dataframe.to_json(orient='records', lines=True)
+        return export_data, 0
+    
+    else:
+        # Section 3. Clean coordinates and locations
+        # convert 'coordinates' that were imported as strings to python dictionaries
+        transformed_dataframe['coordinates'] = transformed_dataframe['coordinates'].apply(lambda x: json.loads(json.dumps(x)))
+        transformed_dataframe['latitude'] = transformed_dataframe['coordinates'].apply(lambda x: x['latitude'])
+        transformed_dataframe['longitude'] = transformed_dataframe['coordinates'].apply(lambda x: x['longitude'])
+        
+        # convert 'location' that were imported as strings to dictionaries
+        transformed_dataframe['location'] = transformed_dataframe['location'].apply(lambda x: json.loads(json.dumps(x)))
+        # only have addresses that are in "CA" for state and start with 9 for 'zip_code'
+        transformed_dataframe = transformed_dataframe[transformed_dataframe['location'].apply(
+            lambda x: x['state'] == 'CA' and x['city'] in set_cities)]
+        # add 'city' column for easy parsing in the future
+        transformed_dataframe['city'] = transformed_dataframe['location'].apply(
+            lambda x: (str(x['city']).replace('  ', ' ').replace(',', '').lower().rstrip()))
+        # clean up 'location' column from dictionary to usual address
+        transformed_dataframe['address'] = transformed_dataframe['location'].apply(
+            lambda x: (str(x['address1']) + ', ' + str(x['city'].rstrip()) + ' ' + str(x['state']) + ' ' + str(x['zip_code'])) if (
+                        x['address2'] is None or x['address2'] == '') else (
+                        str(x['address1']) + ' ' + str(x['address2']) + ', '
+                        + str(x['city'].replace('  ', ' ').replace(',', '').rstrip())
+                        + ' ' + str(x['state']) + ' ' + str(x['zip_code'])))
+        # find missing coordinates
+        c = transformed_dataframe.loc[transformed_dataframe['latitude'].isna()]\
+            .apply(lambda x: geolocate_with_address(x), axis = 1)
+        transformed_dataframe.loc[transformed_dataframe['latitude'].isna()] = c
+
+
+        # delete any 'address' that start with ',' (ex. ', San Jose CA')
+        transformed_dataframe['address'] = transformed_dataframe['address'].str.lstrip(', ')
+
+        
+        transformed_dataframe = transformed_dataframe[['id', 'alias', 'name', 'url', 'review_count',
+            'categories', 'ethnic_category', 'rating', 'price', 'latitude', 'longitude', 'city', 'address']] # .reset_index(drop=True)
+        
+        # transformed_dataframe = transformed_dataframe.astype(str)
+        row_count = len(transformed_dataframe)
+        export_data = transformed_dataframe.to_json(orient='records', lines=True)
+        
+        return export_data, row_count
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# the flows import their modules as siblings, as they run from /opt/prefect in the image
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# main.py and its writer live at the root of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
@@ -0,0 +1,110 @@
+import json
+import pytest
+
+bigquery = pytest.importorskip("google.cloud.bigquery")
+from bq_loader import BatchedBigQueryLoader
+
+
+class RecordingJob:
+    def __init__(self, error=None):
+        self.error = error
+        self.errors = [{'message': str(error)}] if error else None
+
+    def result(self):
+        if self.error:
+            raise self.error
+
+
+class RecordingClient:
+    """
+    Stand-in of bigquery.Client recording the payload of every load job submitted.
+    """
+
+    def __init__(self, failing_tables=()):
+        self.loads = []
+        self.failing_tables = set(failing_tables)
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None):
+        self.loads.append((table_id, file_obj.read(), job_config))
+        return RecordingJob(RuntimeError('load failed') if table_id in self.failing_tables else None)
+
+
+def ndjson(term, location, rows):
+    # the export of one location, as read_json_transform_df returns it: no newline after the last line
+    return '\n'.join(json.dumps({'id': f'{term}-{location}-{i}', 'name': f'Business {i}'}) for i in range(rows))
+
+
+def loaded_ids(payload):
+    return [json.loads(line)['id'] for line in payload.splitlines()]
+
+
+def test_one_load_job_per_term():
+    client = RecordingClient()
+    loader = BatchedBigQueryLoader(client)
+    for location in range(3):
+        for term in ('Restaurants', 'Desserts'):
+            loader.add(f'yelp_data_raw_prod.{term}_data_raw', ndjson(term, location, 4), 4, tag=(term, location))
+
+    assert client.loads == []
+    loaded, errors = loader.close()
+
+    assert sorted(table for table, _, _ in client.loads) == ['yelp_data_raw_prod.Desserts_data_raw',
+                                                             'yelp_data_raw_prod.Restaurants_data_raw']
+    assert errors == []
+    assert sorted(loaded) == sorted((term, location) for term in ('Restaurants', 'Desserts') for location in range(3))
+
+
+def test_ndjson_of_the_locations_is_concatenated_line_by_line():
+    client = RecordingClient()
+    loader = BatchedBigQueryLoader(client)
+    table = 'yelp_data_raw_prod.Restaurants_data_raw'
+    loader.add(table, ndjson('Restaurants', 0, 2), 2, tag=0)
+    # a location whose export already ends with a newline, and an empty one
+    loader.add(table, ndjson('Restaurants', 1, 3) + '\n', 3, tag=1)
+    loader.add(table, '', 0, tag=2)
+    loader.add(table, ndjson('Restaurants', 3, 1), 1, tag=3)
+    loaded, _ = loader.close()
+
+    (_, payload, job_config), = client.loads
+    expected = ndjson('Restaurants', 0, 2) + '\n' + ndjson('Restaurants', 1, 3) + '\n' + ndjson('Restaurants', 3, 1) + '\n'
+    assert payload == expected
+    assert len(loaded_ids(payload)) == 6
+    assert job_config.source_format == bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+    assert loaded == [0, 1, 2, 3]
+
+
+def test_batches_split_at_the_row_limit():
+    client = RecordingClient()
+    loader = BatchedBigQueryLoader(client, flush_rows=10)
+    table = 'yelp_data_raw_prod.Food_data_raw'
+    for location in range(7):
+        loader.add(table, ndjson('Food', location, 4), 4, tag=location)
+    loader.close()
+
+    # a batch is submitted as soon as it holds 10 rows or more: 12, 12, 4
+    assert [len(loaded_ids(payload)) for _, payload, _ in client.loads] == [12, 12, 4]
+    assert [i for _, payload, _ in client.loads for i in loaded_ids(payload)] == \
+        [f'Food-{location}-{i}' for location in range(7) for i in range(4)]
+
+
+def test_batches_split_at_the_byte_limit():
+    client = RecordingClient()
+    chunk = ndjson('Food', 0, 5) + '\n'
+    loader = BatchedBigQueryLoader(client, flush_bytes=2 * len(chunk))
+    table = 'yelp_data_raw_prod.Food_data_raw'
+    for location in range(5):
+        loader.add(table, ndjson('Food', location, 5), 5, tag=location)
+    loader.close()
+
+    assert [len(payload) for _, payload, _ in client.loads] == [2 * len(chunk), 2 * len(chunk), len(chunk)]
+
+
+def test_failed_jobs_are_reported_without_their_tags():
+    client = RecordingClient(failing_tables={'yelp_data_raw_prod.Desserts_data_raw'})
+    loader = BatchedBigQueryLoader(client)
+    loader.add('yelp_data_raw_prod.Restaurants_data_raw', ndjson('Restaurants', 0, 2), 2, tag='restaurants')
+    loader.add('yelp_data_raw_prod.Desserts_data_raw', ndjson('Desserts', 0, 2), 2, tag='desserts')
+    loaded, errors = loader.close()
+
+    assert loaded == ['restaurants']
+    assert errors == [('yelp_data_raw_prod.Desserts_data_raw', [{'message': 'load failed'}])]
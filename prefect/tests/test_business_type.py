@@ -0,0 +1,9 @@
+from pathlib import Path
+from business_type import check_golden
+
+GOLDEN = Path(__file__).resolve().parents[2] / 'seeds' / 'business_type_golden.csv'
+
+
+def test_business_types_match_golden_file():
+    mismatches = check_golden(GOLDEN)
+    assert mismatches.empty, f"business_types differs from {GOLDEN.name}:\n{mismatches.to_string()}"
@@ -0,0 +1,168 @@
+import json
+import pytest
+from cdc import ChangeSet, BigQueryMergeExecutor, SQLiteMergeExecutor, row_hash
+
+
+class RecordingJob:
+    def result(self):
+        return []
+
+
+class RecordingClient:
+    """
+    Stand-in of bigquery.Client recording the load jobs and queries it is given.
+    """
+
+    def __init__(self):
+        self.loads = []
+        self.queries = []
+
+    def load_table_from_json(self, rows, table_id, job_config=None):
+        self.loads.append((list(rows), table_id, job_config))
+        return RecordingJob()
+
+    def query(self, sql):
+        self.queries.append(sql)
+        return RecordingJob()
+
+
+def business(business_id, rating=4.0, review_count=10, price='$$', address='1 Main St, torrance CA 90501'):
+    return {'id': business_id, 'alias': business_id, 'name': business_id.title(), 'url': None,
+            'review_count': review_count, 'categories': ['pizza'], 'ethnic_category': [], 'rating': rating,
+            'price': price, 'latitude': 33.8, 'longitude': -118.3, 'city': 'torrance', 'address': address,
+            'type': 'restaurants'}
+
+
+def run(executor, table, locations):
+    """
+    One CDC run: compare the businesses of each location with the current-state table and merge the changes.
+    """
+    change_set = ChangeSet(executor.snapshot(table))
+    for location, records in locations.items():
+        change_set.add(location, records)
+    change_set.close_missing()
+    executor.merge(table, change_set)
+    return change_set
+
+
+@pytest.fixture
+def executor():
+    executor = SQLiteMergeExecutor()
+    yield executor
+    executor.close()
+
+
+def test_first_run_inserts_every_business(executor):
+    change_set = run(executor, 'Restaurants_current', {
+        'Restaurants-Torrance-415': [business('a'), business('b'), business('a')],
+        'Restaurants-Irvine-200': [business('c')]})
+
+    assert change_set.counts() == {'insert': 3, 'update': 0, 'move': 0, 'close': 0, 'unchanged': 0}
+    rows = executor.rows('Restaurants_current')
+    assert [row['id'] for row in rows] == ['a', 'b', 'c']
+    assert [row['location'] for row in rows] == ['Restaurants-Torrance-415'] * 2 + ['Restaurants-Irvine-200']
+    assert not any(row['is_closed'] for row in rows)
+    assert json.loads(rows[0]['categories']) == ['pizza']
+    assert rows[0]['row_hash'] == row_hash(business('a'))
+
+
+def test_second_run_updates_closes_and_skips_unchanged(executor):
+    run(executor, 'Restaurants_current', {
+        'Restaurants-Torrance-415': [business('unchanged'), business('rerated'), business('gone')],
+        'Restaurants-Irvine-200': [business('skipped')]})
+
+    # a partial run: Irvine is not processed, so its businesses are not closed
+    change_set = run(executor, 'Restaurants_current', {
+        'Restaurants-Torrance-415': [business('unchanged'), business('rerated', rating=3.5, review_count=11),
+                                     business('new')]})
+
+    assert change_set.counts() == {'insert': 1, 'update': 1, 'move': 0, 'close': 1, 'unchanged': 1}
+    assert {row['id']: row['op'] for row in change_set.rows()} == {'rerated': 'update', 'new': 'insert',
+                                                                   'gone': 'close'}
+    rows = {row['id']: row for row in executor.rows('Restaurants_current')}
+    assert sorted(rows) == ['gone', 'new', 'rerated', 'skipped', 'unchanged']
+    assert (rows['rerated']['rating'], rows['rerated']['review_count']) == (3.5, 11)
+    assert rows['rerated']['row_hash'] == row_hash(business('rerated', rating=3.5, review_count=11))
+    assert rows['gone']['is_closed'] == 1
+    # a closure keeps the last known values of the business
+    assert rows['gone']['name'] == 'Gone'
+    assert rows['skipped']['is_closed'] == 0
+    assert rows['unchanged']['is_closed'] == 0
+
+
+def test_closed_business_that_is_back_is_reopened(executor):
+    run(executor, 'Restaurants_current', {'Restaurants-Torrance-415': [business('a'), business('b')]})
+    run(executor, 'Restaurants_current', {'Restaurants-Torrance-415': [business('a')]})
+
+    change_set = run(executor, 'Restaurants_current', {'Restaurants-Torrance-415': [business('a'), business('b')]})
+
+    assert change_set.counts() == {'insert': 0, 'update': 1, 'move': 0, 'close': 0, 'unchanged': 1}
+    assert not any(row['is_closed'] for row in executor.rows('Restaurants_current'))
+
+
+def test_business_that_moved_is_not_closed_by_the_location_it_left(executor):
+    run(executor, 'Restaurants_current', {'Restaurants-Torrance-415': [business('moved'), business('a')],
+                                          'Restaurants-Irvine-200': [business('b')]})
+
+    # the business is now returned by Irvine only: its snapshot location was processed, but it is not closed
+    change_set = run(executor, 'Restaurants_current', {'Restaurants-Torrance-415': [business('a')],
+                                                       'Restaurants-Irvine-200': [business('b'), business('moved')]})
+    assert change_set.counts() == {'insert': 0, 'update': 0, 'move': 1, 'close': 0, 'unchanged': 2}
+    rows = {row['id']: row for row in executor.rows('Restaurants_current')}
+    assert rows['moved']['location'] == 'Restaurants-Irvine-200'
+    assert rows['moved']['row_hash'] == row_hash(business('moved'))
+
+    # a partial run of the location it left does not close it, as Irvine is not processed
+    change_set = run(executor, 'Restaurants_current', {'Restaurants-Torrance-415': [business('a')]})
+    assert change_set.counts() == {'insert': 0, 'update': 0, 'move': 0, 'close': 0, 'unchanged': 1}
+    assert not any(row['is_closed'] for row in executor.rows('Restaurants_current'))
+
+
+def test_business_returned_by_any_location_of_the_run_is_not_closed():
+    change_set = ChangeSet({'moved': (row_hash(business('moved')), 'Restaurants-Torrance-415', False),
+                            'gone': (row_hash(business('gone')), 'Restaurants-Torrance-415', False)})
+    change_set.add('Restaurants-Torrance-415', [])
+    change_set.add('Restaurants-Irvine-200', [business('moved')])
+    change_set.close_missing()
+
+    assert {row['id']: row['op'] for row in change_set.rows()} == {'moved': 'move', 'gone': 'close'}
+
+
+def test_unchanged_run_writes_nothing(executor):
+    locations = {'Restaurants-Torrance-415': [business('a'), business('b', price=None)]}
+    run(executor, 'Restaurants_current', locations)
+    updated_at = {row['id']: row['updated_at'] for row in executor.rows('Restaurants_current')}
+
+    change_set = run(executor, 'Restaurants_current', locations)
+
+    assert len(change_set) == 0
+    assert change_set.counts() == {'insert': 0, 'update': 0, 'move': 0, 'close': 0, 'unchanged': 2}
+    assert {row['id']: row['updated_at'] for row in executor.rows('Restaurants_current')} == updated_at
+
+
+def test_bigquery_merge_truncates_change_table_without_schema_update_options():
+    bigquery = pytest.importorskip("google.cloud.bigquery")
+    change_set = ChangeSet({'closed': ('hash', 'Restaurants-Torrance-415', False)})
+    change_set.add('Restaurants-Torrance-415', [business('new')])
+    change_set.close_missing()
+    client = RecordingClient()
+
+    BigQueryMergeExecutor(client).merge('Restaurants_current', change_set)
+
+    (rows, table_id, job_config), = client.loads
+    assert table_id == 'yelp_data_current.Restaurants_current_changes'
+    assert job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+    # BigQuery rejects schema update options on a WRITE_TRUNCATE load of a non-partitioned table
+    assert not job_config.schema_update_options
+    assert {field.name for field in job_config.schema} >= {'id', 'type', 'op', 'row_hash', 'location'}
+    assert sorted((row['id'], row['op']) for row in rows) == [('closed', 'close'), ('new', 'insert')]
+    assert len(client.queries) == 1
+    assert 'MERGE `yelp_data_current.Restaurants_current` T' in client.queries[0]
+
+
+def test_append_loads_allow_field_addition():
+    bigquery = pytest.importorskip("google.cloud.bigquery")
+    from bq_loader import yelp_load_job_config
+
+    assert yelp_load_job_config().schema_update_options == [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+    assert not yelp_load_job_config(allow_field_addition=False).schema_update_options
@@ -0,0 +1,32 @@
+import time
+from types import SimpleNamespace
+import pandas as pd
+from geocode_cache import GeocodeCache
+
+
+def missing(addresses):
+    return pd.DataFrame({'address': addresses, 'latitude': [None] * len(addresses),
+                         'longitude': [None] * len(addresses)}, dtype=object)
+
+
+def test_one_cache_keeps_the_rate_limit_across_files():
+    requested = []
+
+    def geocode(address):
+        requested.append(time.monotonic())
+        return SimpleNamespace(latitude=33.8, longitude=-118.3)
+
+    cache = GeocodeCache(':memory:', min_interval=0.2)
+    try:
+        # the files of a run, geocoded one after the other through the cache of the run
+        for addresses in (['1 Main St, Torrance CA'], ['2 Main St, Torrance CA'], ['3 Main St, Torrance CA']):
+            df = cache.fill_missing(missing(addresses), geocode)
+            assert df['latitude'].tolist() == [33.8]
+        # an address already resolved by an earlier file is not requested again
+        cache.fill_missing(missing(['1  main st , torrance ca']), geocode)
+    finally:
+        cache.close()
+
+    assert len(requested) == 3
+    assert all(later - earlier >= 0.2 for earlier, later in zip(requested, requested[1:]))
+    assert (cache.requests, cache.hits) == (3, 1)
@@ -0,0 +1,77 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from location_normalizer import MemoizedNormalizer, canonical_city, clean_address_city, state_zip
+
+CITIES = ['Torrance', 'torrance ', 'Los  Angeles', 'Los Angeles,', 'LA Canada Flintridge  ', 'San Diego', '']
+STATES = ['CA', 'NV', None]
+ZIPS = ['90501', '90503', '92101', None]
+
+
+def missing_as_str(raw):
+    # what .astype(str) makes of a missing value
+    return 'nan' if isinstance(raw, float) and np.isnan(raw) else raw
+
+
+def unmemoized(function, *columns):
+    """
+    The normalization row by row, as the transforms did it before the lookup tables.
+    """
+    if len(columns) == 1:
+        return pd.Series([function(str(missing_as_str(raw))) for raw in columns[0]], index=columns[0].index,
+                         dtype=object)
+    return pd.Series([function(tuple(missing_as_str(raw) for raw in row)) for row in zip(*columns)],
+                     index=columns[0].index, dtype=object)
+
+
+def random_column(rng, values, size):
+    return pd.Series([rng.choice(values) for _ in range(size)], index=rng.sample(range(10 * size), size),
+                     dtype=object)
+
+
+@pytest.mark.parametrize('max_size', [1, 3, 5, 100000])
+@pytest.mark.parametrize('function', [canonical_city, clean_address_city])
+def test_memoized_column_matches_row_by_row_normalization(function, max_size):
+    rng = random.Random(max_size)
+    normalizer = MemoizedNormalizer('city', function, max_size=max_size)
+    for size in (0, 1, 7, 200, 50):
+        column = random_column(rng, CITIES + [np.nan, None], size)
+        result = normalizer.normalize(column)
+        pd.testing.assert_series_equal(result, unmemoized(function, column))
+        assert len(normalizer.table) <= max_size
+
+
+@pytest.mark.parametrize('max_size', [2, 4, 100000])
+def test_memoized_column_tuples_match_row_by_row_normalization(max_size):
+    rng = random.Random(max_size)
+    normalizer = MemoizedNormalizer('state_zip', state_zip, max_size=max_size)
+    for size in (1, 30, 300):
+        states, zips = random_column(rng, STATES, size), random_column(rng, ZIPS, size)
+        zips.index = states.index
+        result = normalizer.normalize(states, zips)
+        pd.testing.assert_series_equal(result, unmemoized(state_zip, states, zips))
+        assert len(normalizer.table) <= max_size
+
+
+def test_table_is_emptied_when_it_reaches_max_size():
+    calls = []
+
+    def function(raw):
+        calls.append(raw)
+        return canonical_city(raw)
+
+    normalizer = MemoizedNormalizer('city', function, max_size=3)
+    assert normalizer.normalize(pd.Series(['A', 'B', 'C', 'A'])).tolist() == ['a', 'b', 'c', 'a']
+    assert len(normalizer.table) == 3
+
+    # a fourth distinct value empties the full table before it is stored
+    assert normalizer.normalize(pd.Series(['D', 'A'])).tolist() == ['d', 'a']
+    assert calls == ['A', 'B', 'C', 'D', 'A']
+    assert normalizer.table == {'D': 'd', 'A': 'a'}
+    assert normalizer.stats()['size'] == 2
+    assert (normalizer.hits, normalizer.misses, normalizer.rows) == (0, 5, 6)
+
+    # values still in the table are hits
+    assert normalizer.normalize(pd.Series(['A', 'D'], index=[10, 20])).to_dict() == {10: 'a', 20: 'd'}
+    assert (normalizer.hits, normalizer.misses) == (2, 5)
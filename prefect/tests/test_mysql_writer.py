@@ -0,0 +1,116 @@
+import pytest
+
+pytest.importorskip("mysql.connector")
+import mysql_writer
+from mysql_writer import MySQLBulkWriter
+
+
+class FakeCursor:
+    """
+    Stand-in of a mysql.connector cursor over a dict table, with the affected rows MySQL reports for
+    INSERT ... ON DUPLICATE KEY UPDATE: 1 per inserted row, 2 per changed row and 0 per unchanged row.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.rowcount = -1
+        self.fetched = []
+        self.statements = []
+
+    def execute(self, sql, params):
+        self.statements.append(sql)
+        self.fetched = [(key,) for key in params if key in self.table]
+
+    def fetchall(self):
+        return self.fetched
+
+    def executemany(self, sql, rows):
+        self.statements.append(sql)
+        self.rowcount = 0
+        for row in rows:
+            if row[0] not in self.table:
+                self.rowcount += 1
+            elif self.table[row[0]] != row:
+                self.rowcount += 2
+            self.table[row[0]] = row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, table):
+        self.cursors = []
+        self.table = table
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        self.cursors.append(FakeCursor(self.table))
+        return self.cursors[-1]
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self, **kwargs):
+        self.table = {}
+        self.connections = []
+
+    def get_connection(self):
+        self.connections.append(FakeConnection(self.table))
+        return self.connections[-1]
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(mysql_writer.pooling, 'MySQLConnectionPool', FakePool)
+    return MySQLBulkWriter('localhost', 'root', 'password', 'yelpdb', batch_size=3)
+
+
+COLUMNS = ['id', 'name', 'rating']
+
+
+def test_counts_follow_the_affected_rows_of_the_upsert(writer):
+    assert writer.upsert('restaurants', COLUMNS, [('a', 'A', 4.0), ('b', 'B', 3.5), ('c', 'C', 5.0)]) == \
+        {'inserted': 3, 'updated': 0, 'unchanged': 0}
+
+    # one batch mixing an insert, a changed row and an unchanged row, then a batch of a single change
+    counts = writer.upsert('restaurants', COLUMNS, [('d', 'D', 4.5), ('a', 'A', 4.5), ('b', 'B', 3.5),
+                                                    ('c', 'C', 4.0)])
+    assert counts == {'inserted': 1, 'updated': 2, 'unchanged': 1}
+    assert writer.pool.table == {'a': ('a', 'A', 4.5), 'b': ('b', 'B', 3.5), 'c': ('c', 'C', 4.0),
+                                 'd': ('d', 'D', 4.5)}
+
+    connection = writer.pool.connections[-1]
+    assert connection.commits == 2
+    assert connection.closed
+    assert connection.cursors[0].statements[1] == ('INSERT INTO restaurants (id, name, rating) VALUES (%s, %s, %s) '
+                                                   'ON DUPLICATE KEY UPDATE name = VALUES(name), '
+                                                   'rating = VALUES(rating)')
+
+
+def test_repeated_key_is_written_once_with_its_last_row(writer):
+    writer.upsert('restaurants', COLUMNS, [('a', 'A', 4.0)])
+
+    counts = writer.upsert('restaurants', COLUMNS, [('a', 'A', 3.0), ('b', 'B', 3.5), ('a', 'A', 4.0)])
+
+    assert counts == {'inserted': 1, 'updated': 0, 'unchanged': 1}
+    assert writer.pool.table['a'] == ('a', 'A', 4.0)
+
+
+def test_connection_goes_back_to_the_pool_when_a_batch_fails(writer, monkeypatch):
+    def executemany(self, sql, rows):
+        raise RuntimeError('lost connection')
+
+    monkeypatch.setattr(FakeCursor, 'executemany', executemany)
+    with pytest.raises(RuntimeError):
+        writer.upsert('restaurants', COLUMNS, [('a', 'A', 4.0)])
+
+    connection, = writer.pool.connections
+    assert connection.closed
+    assert connection.commits == 0
@@ -0,0 +1,144 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from query_planner import (Circle, MAX_RESULTS, build_query_plan, expected_call_count, haversine_m,
+                           merge_overlapping_circles, overlap_fraction, search_radius, split_circle)
+
+# meters per degree of latitude on the sphere of haversine_m
+METERS_PER_LAT_DEGREE = 6371008.8 * math.pi / 180
+
+
+def north_of(circle, distance, radius, name='b'):
+    """
+    A circle whose centre is distance meters north of the centre of another one.
+    """
+    return Circle(name, circle.lat + distance / METERS_PER_LAT_DEGREE, circle.long, radius)
+
+
+def points_in_circle(circle, count=4000, seed=0):
+    """
+    Points spread over a circle, its edge included, by bearing and distance from its centre.
+    """
+    rng = np.random.default_rng(seed)
+    distances = circle.radius * np.sqrt(rng.uniform(0, 1, count))
+    distances[:360] = circle.radius
+    bearings = rng.uniform(0, 2 * math.pi, count)
+    bearings[:360] = np.radians(np.arange(360))
+    # destination point on the sphere
+    angular = distances / 6371008.8
+    lat1, long1 = math.radians(circle.lat), math.radians(circle.long)
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(angular) + np.cos(lat1) * np.sin(angular) * np.cos(bearings))
+    long2 = long1 + np.arctan2(np.sin(bearings) * np.sin(angular) * np.cos(lat1),
+                               np.cos(angular) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), np.degrees(long2)
+
+
+@pytest.mark.parametrize('lat, long, radius', [(33.83585, -118.340628, 10000), (41.7, -124.1, 40000),
+                                               (32.7, -117.1, 7071), (37.3, -121.9, 1250)])
+def test_children_of_a_split_cover_the_parent(lat, long, radius):
+    parent = Circle('Torrance', lat, long, radius)
+    children = split_circle(parent)
+    lats, longs = points_in_circle(parent)
+
+    assert [child.name for child in children] == [f'Torrance_q{i}' for i in range(4)]
+    # with the radiuses the API is sent, in whole meters
+    covered = np.zeros(len(lats), dtype=bool)
+    for child in children:
+        covered |= haversine_m(child.lat, child.long, lats, longs) <= search_radius(child)
+    assert covered.all()
+
+
+def test_merge_needs_an_overlap_of_at_least_the_threshold():
+    a = Circle('a', 34.0, -118.3, 10000)
+    close, far = north_of(a, 6000, 10000, 'close'), north_of(a, 7000, 10000, 'far')
+    assert overlap_fraction(6000, 10000, 10000) >= 0.6 > overlap_fraction(7000, 10000, 10000)
+
+    merged, = merge_overlapping_circles([a, close], threshold=0.6, max_radius=15000)
+    assert merged.name == 'a'
+    assert merged.radius == pytest.approx(13000)
+    # the merged circle encloses both circles
+    for circle in (a, close):
+        distance = float(haversine_m(merged.lat, merged.long, circle.lat, circle.long))
+        assert distance + circle.radius <= merged.radius + 1
+
+    assert merge_overlapping_circles([a, far], threshold=0.6, max_radius=15000) == [a, far]
+
+
+def test_merge_never_grows_a_circle_beyond_the_radius_cap():
+    a = Circle('a', 34.0, -118.3, 14000)
+    b = north_of(a, 8000, 10000)
+    assert overlap_fraction(8000, 14000, 10000) >= 0.6
+
+    # the enclosing circle would have a 16000 m radius
+    assert merge_overlapping_circles([a, b], threshold=0.6, max_radius=15000) == [a, b]
+    merged, = merge_overlapping_circles([a, b], threshold=0.6, max_radius=40000)
+    assert merged.radius == pytest.approx(16000)
+
+
+def test_plan_of_a_dense_area_keeps_merged_circles_under_the_cap():
+    df_locations = pd.DataFrame({'Name': [f'city{i}' for i in range(12)],
+                                 'Latitude': [34.0 + i * 0.03 for i in range(12)],
+                                 'Longitude': [-118.3] * 12})
+    df_plan, _ = build_query_plan(df_locations, lambda circles: [10] * len(circles))
+
+    assert len(df_plan) < len(df_locations)
+    assert (df_plan['Radius'] <= 15000).all()
+
+
+def density_totals(probed):
+    """
+    A stub of fetch_totals: 2500 businesses in a 10 km circle, in proportion to the area of smaller ones.
+    """
+    def probe_totals(circles):
+        probed.append(list(circles))
+        return [int(2500 * (radius / 10000) ** 2) for _, _, radius in circles]
+    return probe_totals
+
+
+def test_plan_splits_until_every_circle_is_under_the_cap():
+    probed = []
+    df_locations = pd.DataFrame({'Name': ['Torrance'], 'Latitude': [33.83585], 'Longitude': [-118.340628]})
+    df_plan, probe_calls = build_query_plan(df_locations, density_totals(probed))
+
+    # 2500 -> 1250 -> 625 businesses: two levels of splits
+    assert [len(level) for level in probed] == [1, 4, 16]
+    assert probe_calls == 21
+    assert len(df_plan) == 16
+    assert (df_plan['Total'] <= MAX_RESULTS).all()
+    assert not df_plan['Capped'].any()
+    assert df_plan['Name'].str.fullmatch(r'Torrance_q\d_q\d').all()
+
+
+def test_circles_under_the_cap_are_not_split():
+    probed = []
+    df_locations = pd.DataFrame({'Name': ['dense', 'sparse'], 'Latitude': [33.8, 36.0],
+                                 'Longitude': [-118.3, -119.0]})
+
+    def probe_totals(circles):
+        probed.append(list(circles))
+        # only the first probe of the dense city is above the cap
+        return [1500 if len(probed) == 1 and lat == 33.8 else 400 for lat, _, _ in circles]
+
+    df_plan, probe_calls = build_query_plan(df_locations, probe_totals)
+
+    assert [len(level) for level in probed] == [2, 4]
+    assert probe_calls == 6
+    assert sorted(df_plan['Name']) == ['dense_q0', 'dense_q1', 'dense_q2', 'dense_q3', 'sparse']
+
+
+def test_split_stops_at_max_depth_and_marks_the_circle_capped():
+    df_locations = pd.DataFrame({'Name': ['Los Angeles'], 'Latitude': [34.05], 'Longitude': [-118.24]})
+    df_plan, probe_calls = build_query_plan(df_locations, lambda circles: [5000] * len(circles), max_depth=1)
+
+    assert probe_calls == 1 + 4
+    assert len(df_plan) == 4
+    assert df_plan['Capped'].all()
+
+
+def test_expected_call_count_counts_the_pages_of_every_circle():
+    df_plan = pd.DataFrame({'Total': [0, 50, 51, 999, 1000, 5000], 'Capped': [False] * 5 + [True]})
+
+    assert expected_call_count(df_plan, probe_calls=7) == {
+        'circles': 6, 'capped_circles': 1, 'probe_calls': 7,
+        'fetch_calls': 1 + 1 + 2 + 20 + 20 + 20, 'total_calls': 7 + 64}
@@ -0,0 +1,110 @@
+import json
+import pytest
+import response_cache
+from response_cache import ResponseCache
+
+SEARCH_URL = 'https://api.yelp.com/v3/businesses/search'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+    return clock
+
+
+def parameters(offset, term='restaurants'):
+    return {'term': term, 'latitude': 33.83585, 'longitude': -118.340628, 'radius': 10000, 'offset': offset,
+            'limit': 50}
+
+
+def page(offset, size=100):
+    # a response whose JSON body is exactly size bytes
+    data = {'offset': offset, 'padding': ''}
+    data['padding'] = 'x' * (size - len(json.dumps(data)))
+    return data
+
+
+def cached_offsets(cache):
+    return sorted(json.loads(body)['offset'] for body, in cache.conn.execute("SELECT body FROM responses"))
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=3600)
+    cache.put(SEARCH_URL, parameters(0), page(0))
+
+    clock.now += 3600
+    assert cache.get(SEARCH_URL, parameters(0)) == page(0)
+    # reading an entry does not extend its life
+    clock.now += 1
+    assert cache.get(SEARCH_URL, parameters(0)) is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'expired': 1, 'evictions': 0, 'hit_rate': 0.5}
+    assert cached_offsets(cache) == []
+    assert cache.total_bytes == 0
+    cache.close()
+
+
+def test_least_recently_accessed_entries_are_evicted_first(tmp_path, clock):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', max_bytes=300)
+    for offset in (0, 50, 100):
+        cache.put(SEARCH_URL, parameters(offset), page(offset))
+        clock.now += 1
+    # the oldest entry is read again, so the entry of offset 50 is now the least recently used
+    assert cache.get(SEARCH_URL, parameters(0)) == page(0)
+    clock.now += 1
+
+    cache.put(SEARCH_URL, parameters(150), page(150))
+    assert cached_offsets(cache) == [0, 100, 150]
+    clock.now += 1
+    assert cache.get(SEARCH_URL, parameters(0)) == page(0)
+    clock.now += 1
+    # a response twice as large evicts the two least recently used entries
+    cache.put(SEARCH_URL, parameters(200), page(200, size=200))
+    assert cached_offsets(cache) == [0, 200]
+
+    assert cache.evictions == 3
+    assert cache.total_bytes == 300
+    cache.close()
+
+
+def test_running_size_follows_replaced_entries_and_reopened_files(tmp_path, clock):
+    path = tmp_path / 'cache.sqlite'
+    cache = ResponseCache(path, max_bytes=1000)
+    cache.put(SEARCH_URL, parameters(0), page(0, size=100))
+    cache.put(SEARCH_URL, parameters(0), page(0, size=250))
+    cache.put(SEARCH_URL, parameters(0, term='desserts'), page(0, size=100))
+    assert cache.total_bytes == 350
+    cache.close()
+
+    cache = ResponseCache(path, max_bytes=1000)
+    assert cache.total_bytes == 350
+    cache.close()
+
+
+def test_eviction_accounts_for_entries_written_by_another_process(tmp_path, clock):
+    path = tmp_path / 'cache.sqlite'
+    cache = ResponseCache(path, max_bytes=300)
+    other = ResponseCache(path, max_bytes=300)
+    cache.put(SEARCH_URL, parameters(0), page(0))
+    clock.now += 1
+    other.put(SEARCH_URL, parameters(50), page(50))
+    clock.now += 1
+    other.put(SEARCH_URL, parameters(100), page(100))
+    clock.now += 1
+
+    # the running size of the first cache does not know about the two entries of the other one
+    cache.put(SEARCH_URL, parameters(150), page(150, size=150))
+    assert cache.total_bytes == 250
+    cache.put(SEARCH_URL, parameters(200), page(200, size=140))
+    assert cached_offsets(cache) == [150, 200]
+    assert cache.total_bytes == 290
+    cache.close()
+    other.close()
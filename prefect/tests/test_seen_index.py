@@ -0,0 +1,120 @@
+import pytest
+from seen_index import BloomFilter, SeenIndex
+
+
+def business(business_id):
+    return {'id': business_id, 'name': business_id.title()}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / 'seen_ids.sqlite'
+
+
+def test_ids_are_scoped_by_run(db_path):
+    first = SeenIndex(db_path, run_name='plan-v1')
+    first.mark_landed('Restaurants', ['a', 'b'], 'data/Restaurants-Torrance-415.json')
+    first.close()
+
+    # the plan was rebuilt, so the objects are renamed: a new run lands its businesses again
+    second = SeenIndex(db_path, run_name='plan-v2')
+    records, new_ids = second.filter_new('Restaurants', [business('a'), business('c')],
+                                         object_name='data/Restaurants-Torrance-2.json')
+    assert [record['id'] for record in records] == ['a', 'c']
+    assert new_ids == ['a', 'c']
+    second.close()
+
+    # while a resumed attempt of the first run still skips them
+    resumed = SeenIndex(db_path, run_name='plan-v1')
+    records, new_ids = resumed.filter_new('Restaurants', [business('a'), business('c')],
+                                          object_name='data/Restaurants-Irvine-200.json')
+    assert [record['id'] for record in records] == ['c']
+    resumed.close()
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f'Restaurants\x00added-{i}')
+
+    assert all(f'Restaurants\x00added-{i}' in bloom for i in range(10000))
+    false_positives = sum(f'Restaurants\x00other-{i}' in bloom for i in range(10000))
+    assert false_positives < 10000 * 0.02
+
+
+@pytest.mark.parametrize('mode, expected', [
+    ('skip', [business('c')]),
+    ('reference', [{'id': 'a', 'duplicate_of': 'data/Restaurants-Torrance-415.json'}, business('c'),
+                   {'id': 'b', 'duplicate_of': 'data/Restaurants-Torrance-415.json'}])])
+def test_landed_businesses_are_skipped_or_referenced(db_path, mode, expected):
+    index = SeenIndex(db_path, run_name='run')
+    index.mark_landed('Restaurants', ['a', 'b'], 'data/Restaurants-Torrance-415.json')
+
+    records, new_ids = index.filter_new('Restaurants', [business('a'), business('c'), business('b')], mode=mode,
+                                        object_name='data/Restaurants-Irvine-200.json')
+    assert records == expected
+    assert new_ids == ['c']
+    # the ids are per term
+    records, new_ids = index.filter_new('Desserts', [business('a')], mode=mode,
+                                        object_name='data/Desserts-Irvine-200.json')
+    assert (records, new_ids) == ([business('a')], ['a'])
+    index.close()
+
+
+def test_unknown_mode_is_rejected(db_path):
+    index = SeenIndex(db_path)
+    with pytest.raises(ValueError):
+        index.filter_new('Restaurants', [business('a')], mode='drop')
+    index.close()
+
+
+def test_rewriting_the_same_object_is_idempotent(db_path):
+    index = SeenIndex(db_path, run_name='run')
+    page = [business('a'), business('b')]
+    records, new_ids = index.filter_new('Restaurants', page, object_name='data/Restaurants-Torrance-415.json')
+    index.mark_landed('Restaurants', new_ids, 'data/Restaurants-Torrance-415.json')
+
+    # a retried task writes the object again: it gets the same records back
+    for mode in ('skip', 'reference'):
+        retried, retried_ids = index.filter_new('Restaurants', page, mode=mode,
+                                                object_name='data/Restaurants-Torrance-415.json')
+        assert (retried, retried_ids) == (records, new_ids)
+    index.mark_landed('Restaurants', new_ids, 'data/Restaurants-Torrance-415.json')
+    assert index.lookup('Restaurants', ['a', 'b']) == {'a': 'data/Restaurants-Torrance-415.json',
+                                                       'b': 'data/Restaurants-Torrance-415.json'}
+    index.close()
+
+
+def test_business_repeated_in_a_payload_is_written_once(db_path):
+    index = SeenIndex(db_path)
+    records, new_ids = index.filter_new('Restaurants', [business('a'), business('b'), business('a')],
+                                        object_name='data/Restaurants-Torrance-415.json')
+    assert records == [business('a'), business('b')]
+    assert new_ids == ['a', 'b']
+    index.close()
+
+
+def test_bloom_false_positive_falls_back_to_the_database(db_path):
+    index = SeenIndex(db_path, run_name='run', bloom_capacity=1000)
+    index.mark_landed('Restaurants', ['a'], 'data/Restaurants-Torrance-415.json')
+    # a saturated filter reports every id as possibly seen
+    index.bloom.bits = bytearray(b'\xff' * len(index.bloom.bits))
+    assert 'Restaurants\x00c' in index.bloom
+
+    records, new_ids = index.filter_new('Restaurants', [business('a'), business('c')], mode='reference',
+                                        object_name='data/Restaurants-Irvine-200.json')
+    assert records == [{'id': 'a', 'duplicate_of': 'data/Restaurants-Torrance-415.json'}, business('c')]
+    assert new_ids == ['c']
+    index.close()
+
+
+def test_index_without_bloom_filter_gives_the_same_answers(db_path):
+    with_bloom = SeenIndex(db_path, run_name='run')
+    with_bloom.mark_landed('Restaurants', ['a', 'b'], 'data/Restaurants-Torrance-415.json')
+    without_bloom = SeenIndex(db_path, run_name='run', use_bloom=False)
+
+    page = [business(i) for i in ('a', 'c', 'b', 'd')]
+    assert with_bloom.filter_new('Restaurants', page, mode='reference') == \
+        without_bloom.filter_new('Restaurants', page, mode='reference')
+    with_bloom.close()
+    without_bloom.close()
@@ -0,0 +1,107 @@
+import re
+import json
+import random
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from baseline_transform import read_json_transform_df
+from geocode_cache import GeocodeCache
+from yelp_transform import clean_businesses, export_businesses
+
+CITIES = {'Los Angeles', 'Torrance', 'San Jose', 'Irvine', 'Carmel-By-the-Sea', 'Los  Angeles', 'San Jose, '}
+# cities of the payloads, including ones that are not in CITIES
+PAYLOAD_CITIES = sorted(CITIES) + ['Nowhere', 'Reno']
+CATEGORIES = ['pizza', 'mexican', 'korean', 'japanese', 'bars', 'coffee', 'tea', 'desserts', 'cafes', 'icecream',
+              'grocery', 'hardware', 'drugstores', 'gyms', 'convenience']
+# the type label is new in the transform; it is the last column of every exported line
+TYPE_COLUMN = re.compile(r',"type":(?:null|"[^"]*")\}$', re.MULTILINE)
+
+
+def fake_geocode(address):
+    """
+    A deterministic stand-in of Nominatim(...).geocode: some addresses resolve, the others do not.
+    """
+    if len(address) % 3 == 0:
+        return None
+    return SimpleNamespace(latitude=32 + len(address) / 10, longitude=-118 - len(address) / 100)
+
+
+def baseline_geolocate(row):
+    # geolocate_with_address of the baseline, without the Nominatim client and its 1 second sleep
+    if pd.isna(row['latitude']) and pd.isna(row['longitude']):
+        location = fake_geocode(row['address'])
+        if location:
+            row['latitude'] = location.latitude
+            row['longitude'] = location.longitude
+    return row
+
+
+def new_geolocate(df):
+    cache = GeocodeCache(':memory:', min_interval=0)
+    try:
+        return cache.fill_missing(df, fake_geocode)
+    finally:
+        cache.close()
+
+
+def payload(size, seed):
+    """
+    Seeded search results of one location, with missing prices and coordinates, non-food categories,
+    address2/address3 and cities that are not in CITIES.
+    """
+    rng = random.Random(seed)
+    businesses = []
+    for i in range(size):
+        latitude = None if rng.random() < 0.15 else round(rng.uniform(32, 40), 6)
+        longitude = None if (latitude is None and rng.random() < 0.8) or rng.random() < 0.05 \
+            else round(rng.uniform(-124, -115), 6)
+        business = {
+            'id': f'id-{seed}-{i}', 'alias': f'business-{seed}-{i}', 'name': f'Business {i}',
+            'image_url': 'https://s3-media.fl.yelpcdn.com/bphoto/x/o.jpg', 'is_closed': False,
+            'url': f'https://www.yelp.com/biz/business-{seed}-{i}', 'review_count': rng.randint(0, 900),
+            'categories': [{'alias': alias, 'title': alias.title()}
+                           for alias in rng.sample(CATEGORIES, rng.randint(0, 3))],
+            'rating': rng.choice([1.0, 3.5, 4.0, 4.5, 5.0]),
+            'coordinates': {'latitude': latitude, 'longitude': longitude},
+            'transactions': ['pickup', 'delivery'],
+            'location': {'address1': rng.choice(['12 Main St', '5 Elm Ave', '', None]),
+                         'address2': rng.choice([None, '', 'Ste 4', 'Unit B']),
+                         'address3': rng.choice(['', None, 'Building 2']),
+                         'city': rng.choice(PAYLOAD_CITIES), 'zip_code': rng.choice(['90001', '95112', '']),
+                         'country': 'US', 'state': rng.choice(['CA', 'CA', 'CA', 'NV']),
+                         'display_address': ['12 Main St', 'Torrance, CA 90501']},
+            'phone': '+13105550100', 'display_phone': '(310) 555-0100', 'distance': rng.uniform(0, 10000),
+        }
+        if rng.random() < 0.6:
+            business['price'] = rng.choice(['$', '$$', '$$$'])
+        businesses.append(business)
+    if seed % 3 == 0:
+        # no business of the location has a price
+        for business in businesses:
+            business.pop('price', None)
+    return businesses
+
+
+@pytest.mark.parametrize('size, seed', [(0, 0), (1, 1), (5, 2), (40, 3), (40, 4), (300, 5), (300, 6)])
+def test_new_transform_matches_baseline_ndjson(tmp_path, size, seed):
+    path = tmp_path / f"Restaurants-Torrance-{seed}.json"
+    path.write_text(json.dumps(payload(size, seed)))
+
+    expected, expected_rows = read_json_transform_df(path, CITIES, baseline_geolocate)
+    actual, actual_rows = export_businesses(clean_businesses(path, CITIES), new_geolocate)
+
+    assert actual_rows == expected_rows
+    actual, labelled = TYPE_COLUMN.subn('}', actual)
+    assert labelled == actual_rows
+    assert actual.encode() == expected.encode()
+
+
+def test_payloads_cover_the_edge_cases():
+    businesses = [business for seed in range(7) for business in payload(300, seed)]
+    assert any('price' not in business for business in businesses)
+    assert any(business['coordinates']['latitude'] is None and business['coordinates']['longitude'] is None
+               for business in businesses)
+    assert any(all(category['alias'] in {'grocery', 'hardware', 'drugstores', 'gyms', 'convenience'}
+                   for category in business['categories']) for business in businesses)
+    assert any(business['location']['address2'] and business['location']['address3'] for business in businesses)
+    assert any(business['location']['city'] not in CITIES for business in businesses)
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+import yelp_search_client
+from pipeline_metrics import METRICS
+from yelp_search_client import SEARCH_LIMIT, stream_term_across_locations
+
+SEARCH_URL = 'https://api.yelp.com/v3/businesses/search'
+
+
+class ServerError(Exception):
+    pass
+
+
+class StubResponse:
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+        self.headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ServerError(self.status)
+
+    async def json(self):
+        return self.data
+
+
+class StubSession:
+    """
+    Stand-in of aiohttp.ClientSession serving the search endpoint for locations numbered by their latitude:
+    location n holds n + 1 businesses, answers after latency(n) seconds and fails its first failures[n]
+    requests with a server error.
+    """
+
+    def __init__(self, latency, failures):
+        self.latency = latency
+        self.failures = dict(failures)
+        self.requests = []
+        self.started = []
+        self.lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        return self
+
+    async def close(self):
+        pass
+
+    def get(self, url, params):
+        location = int(params['latitude'])
+        with self.lock:
+            self.requests.append(location)
+            if location not in self.started:
+                self.started.append(location)
+        stub = self
+
+        class Pending:
+            async def __aenter__(self):
+                await asyncio.sleep(stub.latency(location))
+                if stub.failures.get(location, 0) > 0:
+                    stub.failures[location] -= 1
+                    return StubResponse(500, None)
+                businesses = [{'id': f'{location}-{i}'} for i in range(location + 1)]
+                return StubResponse(200, {'total': len(businesses), 'businesses': businesses[:SEARCH_LIMIT]})
+
+            async def __aexit__(self, exc_type, exc, tb):
+                pass
+
+        return Pending()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def install(latency=lambda location: 0, failures=()):
+        session = StubSession(latency, failures)
+        monkeypatch.setattr(yelp_search_client.aiohttp, 'ClientSession', session)
+        monkeypatch.setattr(yelp_search_client.aiohttp, 'TCPConnector', lambda **kwargs: None)
+        return session
+    return install
+
+
+def locations(count):
+    return [(float(location), -118.3) for location in range(count)]
+
+
+def test_locations_are_yielded_in_order(session):
+    # the later a location, the sooner it answers
+    session(latency=lambda location: 0.005 * (8 - location))
+
+    stream = list(stream_term_across_locations(SEARCH_URL, {}, 'Restaurants', locations(8), concurrency=8))
+
+    assert [position for position, _, _ in stream] == list(range(8))
+    assert [[business['id'] for business in businesses] for _, businesses, _ in stream] == \
+        [[f'{location}-{i}' for i in range(location + 1)] for location in range(8)]
+    assert [pages for _, _, pages in stream] == [1] * 8
+
+
+def test_fetching_pauses_while_the_consumer_is_behind(session):
+    stub = session()
+    consumed = 0
+    ahead = []
+    lazily_read = (location for location in locations(30))
+
+    for position, _, _ in stream_term_across_locations(SEARCH_URL, {}, 'Restaurants', lazily_read, concurrency=2,
+                                                       max_pending=3):
+        consumed += 1
+        # a slow consumer: give the fetching thread every chance to run ahead
+        threading.Event().wait(0.01)
+        ahead.append(len(stub.started) - consumed)
+
+    assert consumed == 30
+    assert max(ahead) <= 3 - 1
+    assert max(ahead) > 0
+
+
+def test_a_slow_location_holds_back_the_ones_after_it(session):
+    stub = session(latency=lambda location: 0.2 if location == 0 else 0)
+    stream = stream_term_across_locations(SEARCH_URL, {}, 'Restaurants', locations(20), concurrency=4,
+                                          max_pending=5)
+
+    assert next(stream)[0] == 0
+    # while location 0 was fetched, only the locations of its slots were started
+    assert len(stub.started) <= 5
+    assert [position for position, _, _ in stream] == list(range(1, 20))
+
+
+def test_failed_locations_are_retried(session):
+    stub = session(failures={1: 2, 3: 1})
+    retries = METRICS.snapshot()['counters'].get(('api_location_retries_total', ()), 0)
+
+    stream = list(stream_term_across_locations(SEARCH_URL, {}, 'Restaurants', locations(5), location_retries=2,
+                                               retry_delay=0))
+
+    assert [position for position, _, _ in stream] == list(range(5))
+    assert not any(isinstance(businesses, Exception) for _, businesses, _ in stream)
+    assert sorted(stub.requests) == [0, 1, 1, 1, 2, 3, 3, 4]
+    assert METRICS.snapshot()['counters'][('api_location_retries_total', ())] - retries == 3
+
+
+def test_location_failing_every_retry_is_yielded_as_its_error(session):
+    session(failures={2: 3})
+
+    stream = list(stream_term_across_locations(SEARCH_URL, {}, 'Restaurants', locations(5), location_retries=1,
+                                               retry_delay=0, return_exceptions=True))
+
+    assert [position for position, _, _ in stream] == list(range(5))
+    _, error, pages = stream[2]
+    assert isinstance(error, ServerError)
+    assert pages == 0
+    assert all(isinstance(businesses, list) for position, businesses, _ in stream if position != 2)
+
+
+def test_location_failing_every_retry_ends_the_stream(session):
+    session(failures={2: 3})
+    yielded = []
+
+    with pytest.raises(ServerError):
+        for position, _, _ in stream_term_across_locations(SEARCH_URL, {}, 'Restaurants', locations(5),
+                                                           location_retries=1, retry_delay=0):
+            yielded.append(position)
+
+    # the locations before the failed one were handed over first
+    assert yielded == [0, 1]
@@ -1,14 +1,26 @@
 import os
+import uuid
+import time
 import pandas as pd
-import requests
 import json
 import numpy as np
 from pathlib import Path
 from datetime import timedelta
+from collections import deque
 from prefect import flow, task
+from prefect.task_runners import ConcurrentTaskRunner
+from prefect.artifacts import create_markdown_artifact
 from prefect.tasks import task_input_hash
 from prefect_gcp.cloud_storage import GcsBucket
 from dotenv import load_dotenv
+from yelp_search_client import fetch_totals, stream_term_across_locations
+from query_planner import build_query_plan, expected_call_count
+from seen_index import SeenIndex
+from run_manifest import RunManifest, file_checksum
+from parquet_io import write_raw, file_suffix
+from gcs_uploader import GcsUploader
+from response_cache import ResponseCache
+from pipeline_metrics import METRICS
 """
 The URL for the website is: https://fusion.yelp.com/. Create an account and follow the instructions on manage API access.
 For GCS access, create an account in https://cloud.google.com/.
@@ -16,6 +28,8 @@ This script uses prefect to retrieve business data from the Yelp Fusion API at v
 locally write data to JSON files, and then upload the JSON files to Google Cloud Storage. 
 User must specify a list of terms (ex. ['Restaurants', 'Food', 'Coffee & Tea']) to pull data from the API.
 """
+RESPONSE_CACHE_PATH = "/opt/prefect/data/response_cache.sqlite"
+
 @task(log_prints=True)
 def fetch_location_df(filename):
     """
@@ -34,124 +48,280 @@ def fetch_location_df(filename):
     return df_locations
 
 @task()
-def write_local(data: json, term:str, location:str, index:int) -> Path:
+def write_local(data: json, term:str, location:str, index:int, file_format:str = 'json') -> Path:
     """Write DataFrame out locally as json file
 
     :param data: The json format data to write locally.
     :param term: The term corresponding to the data (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
     :param location: The name of location corresponding to the data (ex. Torrance).
     :param index: The index of the location.
-    :return: The path of the written JSON file.
+    :param file_format: 'json', or 'parquet' for a compressed Parquet file (see parquet_io.py).
+    :return: The path of the written file.
     """
-    path = Path(f"/opt/prefect/data/{term}-{location}-{index}.json")
+    path = Path(f"/opt/prefect/data/{term}-{location}-{index}{file_suffix(file_format)}")
     # Write the data to the JSON file # 'yelp_data_torr.json'
-    with open(path, 'w') as f:
-        json.dump(data, f)
+    with METRICS.timer('stage_seconds', stage='write_local'):
+        write_raw(data, path)
+    METRICS.incr('bytes_written_total', path.stat().st_size)
     return path
 
 @task()
-def write_gcs(path: Path) -> None:
+def write_ingest_settings(term:str, dedup_mode:str, run_name:str) -> Path:
+    """Write out the settings a term is landed with as a JSON file, to upload beside its data.
+    The GCS to BQ flow reads them back, ex. CDC loads refuse data landed with deduplication.
+
+    :param term: The term corresponding to the data (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
+    :param dedup_mode: The dedup_mode of the run.
+    :param run_name: The name of the run in the run manifest.
+    :return: The path of the written file.
+    """
+    path = Path(f"/opt/prefect/data/ingest_settings-{term}.json")
+    path.write_text(json.dumps({'term': term, 'dedup_mode': dedup_mode, 'run_name': run_name}))
+    return path
+
+def load_gcs_uploader(block_name="yelp-data-lake-yelp-pipeline-project-production") -> GcsUploader:
+    """Load the bucket block once and wrap its bucket for content-addressed uploads (see gcs_uploader.py).
+
+    :param block_name: The name of the GcsBucket block.
+    :return: A GcsUploader.
+    """
+    gcs_block = GcsBucket.load(block_name)
+    client = gcs_block.gcp_credentials.get_cloud_storage_client()
+    return GcsUploader(client.bucket(gcs_block.bucket), gcs_block.bucket_folder)
+
+@task()
+def write_gcs(path: Path, uploader: GcsUploader = None) -> bool:
     """Upload a local file to Google Cloud Storage.
     
     :param path: The path of the local file to upload into GCS.
+    :param uploader: The GcsUploader of the flow run. The file is then stored as data/<file name>, compressed,
+                     and not uploaded at all when the bucket already holds the same content.
+    :return: False when the upload was skipped.
     """
+    if uploader is not None:
+        with METRICS.timer('stage_seconds', stage='upload'):
+            return uploader.upload(path)
     gcs_block = GcsBucket.load("yelp-data-lake-yelp-pipeline-project-production")
     gcs_block.upload_from_path(
         from_path = f"{path}",
         to_path = path,
         timeout=120)
-    return
+    return True
+
+def open_response_cache(cache_ttl_hours):
+    """Open the on-disk cache of API responses (see response_cache.py).
+
+    :param cache_ttl_hours: How long responses are reused, in hours; 0 or None disables the cache.
+    :return: A ResponseCache, or None when the cache is disabled.
+    """
+    if not cache_ttl_hours:
+        return None
+    return ResponseCache(RESPONSE_CACHE_PATH, ttl=cache_ttl_hours * 3600)
 
-#@task(cache_key_fn=task_input_hash, cache_expiration=timedelta(hours=1))
 @task(log_prints=True, retries=3)
-def get_api_data(url, headers, term, lat, long, limit = 50):
+def plan_queries(url, headers, term, df_locations, concurrency = 8, cache_ttl_hours = 24):
     """
-    Retrieve data from Yelp Fusion API using the provided URL, headers, and parameters,
-    and return the JSON data.
+    Build the coverage-aware set of search circles for a term and write it out locally as a CSV file.
+    Overlapping city circles are merged and circles above the 1000 result cap are split, see query_planner.py.
+    A plan already written for the term is reused, so planning requests are only spent once.
 
     :param url: API Host and search path (ie 'https://api.yelp.com/v3/businesses/search')
     :param headers: a dictionary of headers to send with API requests
     :param term: A term to include in the API query (ie 'Food', 'Restaurants', 'Coffee & Tea')
-    :param lat: A float64 containing df_location's Latitude
-    :param long: A float64 containing df_location's Longitude
-    :return: data
-    """
-    # Initialize variables
-    offset = 0
-    data = []
-    # Retrieve data from the Yelp API using pagination
-    while True:
-
-        # Set the query parameters for this location
-        parameters = {
-            'limit': 50,
-            'term': term,
-            'is_closed': False,
-            'latitude': float(lat),
-            'longitude': float(long),
-            'radius': 10000,
-            'offset': offset
-        }
-        # Make API Request
-        response = requests.get(url, headers=headers, params=parameters)
-
-        # Check for errors and break out of the loop if there are no more results
-        response.raise_for_status()
-        business = response.json().get('businesses', [])
-        if not business:
-            break
-
-        # Append the retrieved data to the overall data list and increment the offset
-        data.extend(business)
-        offset += limit
-
-        # This endpoint returns up to 1000 businesses
-        if offset == 1000:
-            break
-
-    return data
-
-@flow(name="Subflow", log_prints=True)
-def pull_data_across_locations(url, headers, terms, df_locations, start_slice, end_slice):
-    """
-    Tap into get_api_data function to retrieve data from Yelp Fusion API
-    using the provided URL, headers, and parameters, and return the JSON data.
+    :param df_locations: A dataframe containing location data like place name, Latitude, and Longitude
+    :param concurrency: The maximum number of API requests in flight at the same time
+    :param cache_ttl_hours: Probes sent less than this many hours ago are read from the response cache
+    :return: The plan DataFrame (Name, Latitude, Longitude, Radius, ...) and the path of the plan CSV file.
+    """
+    path = Path(f"/opt/prefect/data/query_plan-{term}.csv")
+    probe_calls = 0
+    if path.exists():
+        print(f"Reusing query plan {path}")
+        df_plan = pd.read_csv(path)
+    else:
+        cache = open_response_cache(cache_ttl_hours)
+        try:
+            df_plan, probe_calls = build_query_plan(
+                df_locations, lambda circles: fetch_totals(url, headers, term, circles, concurrency, cache))
+        finally:
+            if cache is not None:
+                cache.close()
+        df_plan.to_csv(path, index=False)
+
+    print(term, expected_call_count(df_plan, probe_calls))
+    # Prefect would not accept float64 that is non native Python floats
+    return df_plan.astype('object'), path
+
+@flow(name="Subflow", log_prints=True, task_runner=ConcurrentTaskRunner())
+def pull_data_across_locations(url, headers, terms, df_locations, start_slice = 0, end_slice = None,
+                               concurrency = 8, dedup_mode = None, run_name = None, file_format = 'json',
+                               cache_ttl_hours = 24, task_concurrency = 8, location_retries = 3):
+    """
+    Stream data from Yelp Fusion API (see stream_term_across_locations) using the provided URL, headers,
+    and parameters, and land every location as soon as it is fetched.
+
+    Each location is deduplicated as soon as it is fetched and then gets its own chain of tasks on the
+    flow's task runner, write_local -> write_gcs, so up to task_concurrency locations are written and
+    uploaded at the same time. The next location is only taken from the stream once there is room for
+    its chain, so fetching pauses while the writes and uploads are behind, and memory stays flat whatever
+    the number of terms and locations.
+    With a run_name, every uploaded location is recorded in the run manifest and locations already
+    completed by an earlier attempt of the same run are skipped.
+    A location whose fetch still fails after location_retries retries, or whose write or upload fails, is
+    counted in locations_failed_total, recorded as failed in the run manifest and skipped; the other
+    locations go on, and the next attempt of the run fetches it again. The chains already started are
+    finished even when the flow stops on an error, so what was uploaded is recorded as landed.
 
     :param url: API Host and search path (ie 'https://api.yelp.com/v3/businesses/search')
     :param headers: a dictionary of headers to send with API requests
     :param terms: A list of terms to include in the API query (ie ['Food', 'Restaurants', 'Coffee & Tea'])
-    :param df_locations: A dataframe containing location data like place name, Latitude, and Longitude
-    :return: data
+    :param df_locations: A dataframe containing location data like place name, Latitude, and Longitude,
+                         and optionally a search Radius per row (ex. a plan from plan_queries)
+    :param concurrency: The maximum number of API requests in flight at the same time
+    :param dedup_mode: None to write every business; 'skip' or 'reference' to check businesses against the
+                       seen-id index of the run and drop or reference the ones already landed for the term
+    :param run_name: The name of the run in the run manifest; None disables resuming
+    :param file_format: 'json' or 'parquet'; the format the raw data is landed in
+    :param cache_ttl_hours: Pages fetched less than this many hours ago are read from the response cache
+    :param task_concurrency: The maximum number of locations written and uploaded at the same time
+    :param location_retries: The number of times a location whose fetch failed is fetched again
+    :return: The number of businesses landed.
     """
-    results = []
+    rows_landed = 0
+    uploader = load_gcs_uploader()
+    cache = open_response_cache(cache_ttl_hours)
+    # without a run name, only the businesses of this invocation are deduplicated
+    seen_index = SeenIndex("/opt/prefect/data/seen_ids.sqlite", run_name or f"unnamed-{uuid.uuid4().hex}") \
+        if dedup_mode else None
+    manifest = RunManifest("/opt/prefect/data/run_manifest.sqlite", run_name) if run_name else None
+    columns = ['Latitude', 'Longitude', 'Radius'] if 'Radius' in df_locations.columns else ['Latitude', 'Longitude']
+    end_slice = df_locations.shape[0] if end_slice is None else min(end_slice, df_locations.shape[0])
+    chains = deque()
+
+    def fail(term, i, error):
+        """Record a location that could not be landed, and go on with the others."""
+        print(f"{term} {df_locations.iloc[i]['Name']} {i} failed: {error!r}")
+        METRICS.incr('locations_failed_total', term=term)
+        if manifest is not None:
+            manifest.fail('ingest', term, i, df_locations.iloc[i]['Name'], error)
+
+    def finish(chain):
+        """Wait for the upload of a location, then record it as landed."""
+        nonlocal rows_landed
+        term, i, object_name, path, upload, new_ids, pages, rows = chain
+        try:
+            upload.result()
+        except Exception as error:
+            fail(term, i, error)
+            return
+        if seen_index is not None:
+            # only mark ids as landed once the object holding them is uploaded
+            seen_index.mark_landed(term, new_ids, object_name)
+        if manifest is not None:
+            manifest.complete('ingest', term, i, df_locations.iloc[i]['Name'], object_name,
+                              file_checksum(path.result()), pages=pages, rows=rows)
+        rows_landed += rows
 
-    for term in terms:
+    try:
+        for term in terms:
+
+            pending = list(range(start_slice, end_slice))
+            if manifest is not None:
+                pending = manifest.pending('ingest', term, pending)
+                print(f"{term}: resuming with {len(pending)} of {end_slice - start_slice} locations left")
+            # one listing request for the stored hashes of every object of the term
+            uploader.prefetch(f"data/{term}-")
+            write_gcs(write_ingest_settings(term, dedup_mode, run_name), uploader)
 
-        for i in range(start_slice, end_slice): # df_locations.shape[0]
-            print(term, df_locations.iloc[i]['Name'], i)
-            # Get results from get_api_data
-            result = get_api_data(url, headers, term, df_locations.iloc[i]['Latitude'],
-                                  df_locations.iloc[i]['Longitude'])
-            path = write_local(result, term, df_locations.iloc[i]['Name'], i)
-            write_gcs(path)
-            
-            # Write into MySQL Workbench Server; all db_variables are global except result
-            # insert_data_to_db(result, db_HOST, db_USER, db_PASSWORD, db_DATABASE, db_TABLE_NAME)
-            results.extend(result)
+            coordinates = (tuple(df_locations.iloc[i][columns]) for i in pending)
+            stream = stream_term_across_locations(url, headers, term, coordinates, concurrency=concurrency,
+                                                  radius=10000, cache=cache, max_pending=concurrency * 4,
+                                                  location_retries=location_retries, return_exceptions=True)
+            waiting = time.perf_counter()
+            for position, result, pages in stream:
+                # time spent waiting on the API, as opposed to writing and uploading
+                METRICS.observe('stage_seconds', time.perf_counter() - waiting, stage='fetch')
+                i = pending[position]
+                if isinstance(result, Exception):
+                    fail(term, i, result)
+                    waiting = time.perf_counter()
+                    continue
+                print(term, df_locations.iloc[i]['Name'], i)
+                object_name = f"data/{term}-{df_locations.iloc[i]['Name']}-{i}{file_suffix(file_format)}"
+                new_ids = None
+                if seen_index is not None:
+                    records, new_ids = seen_index.filter_new(term, result, mode=dedup_mode, object_name=object_name)
+                    print(f"{len(result) - len(new_ids)} of {len(result)} businesses already landed for {term}")
+                    METRICS.incr('dedup_businesses_total', len(result) - len(new_ids), result='seen')
+                    METRICS.incr('dedup_businesses_total', len(new_ids), result='new')
+                else:
+                    records = result
+                path = write_local.submit(records, term, df_locations.iloc[i]['Name'], i, file_format)
+                upload = write_gcs.submit(path, uploader)
+                chains.append((term, i, object_name, path, upload, new_ids, pages, len(records)))
+                while len(chains) >= task_concurrency:
+                    finish(chains.popleft())
 
-    return results
+                # Write into MySQL Workbench Server; all db_variables are global except result
+                # insert_data_to_db(result, db_HOST, db_USER, db_PASSWORD, db_DATABASE, db_TABLE_NAME)
+                waiting = time.perf_counter()
+    finally:
+        # record what was already uploaded even when the flow stops on an error
+        while chains:
+            finish(chains.popleft())
+        print(f"{uploader.uploaded} file(s) uploaded, {uploader.skipped} unchanged file(s) skipped")
+        print(f"total rows: {rows_landed}")
+        if cache is not None:
+            print(f"response cache: {cache.stats()}")
+            cache.close()
+        if seen_index is not None:
+            seen_index.close()
+        if manifest is not None:
+            manifest.close()
+    return rows_landed
+
+@task(log_prints=True)
+def publish_metrics(run_name:str) -> None:
+    """
+    Publish the metrics of the run (see pipeline_metrics.py) as a Prefect markdown artifact,
+    and export them as JSON and as a Prometheus textfile next to the landed data.
+
+    :param run_name: The name of the run, used in the artifact title and the JSON file name.
+    """
+    create_markdown_artifact(key="ingest-metrics", markdown=METRICS.to_markdown(f"Ingest metrics ({run_name})"),
+                             description="Per-stage timings and counters of the ingest flow")
+    METRICS.export(json_path=f"/opt/prefect/data/metrics-api_to_gcs-{run_name}.json",
+                   prometheus_path="/opt/prefect/data/yelp_api_to_gcs.prom")
 
-@flow(name="Ingest Flow")
-def etl_api_to_gcs(terms: list, start_slice: int, end_slice: int) -> None:
+@flow(name="Ingest Flow", task_runner=ConcurrentTaskRunner())
+def etl_api_to_gcs(terms: list, start_slice: int = 0, end_slice: int = None, concurrency: int = 8,
+                   use_query_plan: bool = True, dedup_mode: str = None, run_name: str = 'default',
+                   file_format: str = 'json', cache_ttl_hours: float = 24, task_concurrency: int = 8) -> int:
     """
     Execute the full ETL process: fetch location data, retrieve data from Yelp Fusion API, 
     write the data to local JSON files, and upload the files to Google Cloud Storage.
     
     :param terms: A list of terms to search for.
     :param start_slice: The start index for slicing the location DataFrame.
-    :param end_slice: The end index for slicing the location DataFrame.
+    :param end_slice: The end index for slicing the location DataFrame; None runs every location.
+    :param concurrency: The maximum number of Yelp API requests in flight at the same time.
+    :param use_query_plan: Search the circles built by plan_queries instead of one fixed circle per city.
+                           The slice bounds then index into the plan of each term.
+    :param dedup_mode: None (the default) writes every business; 'skip' drops businesses the run already
+                       landed for a term, 'reference' writes them as {'id', 'duplicate_of'} references
+                       (see seen_index.py). The seen ids are kept per run_name.
+    :param run_name: Locations already uploaded under this run name are skipped, so re-running the flow
+                     after a failure resumes it; use a new name for a fresh backfill (see run_manifest.py).
+    :param file_format: 'json' lands the raw data as JSON files, 'parquet' as compressed Parquet files;
+                        run the GCS to BQ flow with the same format.
+    :param cache_ttl_hours: API responses are cached on disk per page and reused for this many hours,
+                            so reruns cost no quota for recently fetched pages; 0 disables the cache.
+    :param task_concurrency: The maximum number of locations written and uploaded at the same time.
+    :return: The number of businesses landed.
     """
 
+    total_rows = 0
+    METRICS.reset()
     df_locations = fetch_location_df("/usr/local/share/california_lat_long_cities.csv") # for local testing, simply use fetch_location_df("california_lat_long_cities.csv")
     # df_county = fetch_location_df("california_county_cities.csv")
     # print(df_locations[233::])
@@ -161,12 +331,33 @@ def etl_api_to_gcs(terms: list, start_slice: int, end_slice: int) -> None:
     API_KEY = os.getenv("YELP_API_KEY")  # your api key
     HEADERS = {'Authorization': 'Bearer %s' % API_KEY}
     
-    pull_data_across_locations(URL, HEADERS, terms, df_locations, start_slice, end_slice) # df_locations[0:233] is AtoL; df_locations[233:469] is MtoZ
+    if use_query_plan:
+        uploader = load_gcs_uploader()
+        for term in terms:
+            df_plan, plan_path = plan_queries(URL, HEADERS, term, df_locations, concurrency, cache_ttl_hours)
+            # send the plan to GCS so the GCS to BQ flow walks the same circles
+            write_gcs(plan_path, uploader)
+            total_rows += pull_data_across_locations(URL, HEADERS, [term], df_plan, start_slice, end_slice,
+                                                     concurrency, dedup_mode, run_name, file_format, cache_ttl_hours,
+                                                     task_concurrency)
+    else:
+        total_rows += pull_data_across_locations(URL, HEADERS, terms, df_locations, start_slice, end_slice, concurrency,
+                                                 dedup_mode, run_name, file_format, cache_ttl_hours,
+                                                 task_concurrency) # df_locations[0:233] is AtoL; df_locations[233:469] is MtoZ
     
     # send local csv lat long file to GCS
     write_gcs("/usr/local/share/california_lat_long_cities.csv") # for local testing, simply do write_gcs("california_lat_long_cities.csv")
     # send local csv counties cities file to GCS
     write_gcs("/usr/local/share/california_county_cities.csv") # for local testing, simply do write_gcs("california_county_cities.csv")
+    print(f"total rows: {total_rows} landed for {len(terms)} term(s)")
+    publish_metrics(run_name)
+    failed = sum(value for (name, _), value in METRICS.snapshot()['counters'].items()
+                 if name == 'locations_failed_total')
+    if failed:
+        # the flow run fails, once everything else is landed; the run manifest holds the errors
+        raise RuntimeError(f"{failed} location(s) could not be landed; run the flow again with "
+                           f"run_name={run_name!r} to retry them")
+    return total_rows
 
     # print(api_results)
     # 
@@ -175,13 +366,12 @@ def etl_api_to_gcs(terms: list, start_slice: int, end_slice: int) -> None:
 
 if __name__ == "__main__":
     """
-    Main entry point of the script. Sets the terms and DataFrame slice bounds, 
-    and then executes the ETL process.
+    Main entry point of the script. Sets the terms and the run name, and then executes the ETL process.
+    Re-running with the same run name resumes from the locations that have not been uploaded yet.
     """
     load_dotenv()
     TERMS = ['Juice Bars & Smoothies'] # ['Juice Bars & Smoothies', 'Desserts', 'Bakeries', 'Coffee & Tea', 'Bubble Tea'] ['Restaurants', 'Food']
-    START_SLICE = 0
-    END_SLICE = 459
-    etl_api_to_gcs(TERMS, START_SLICE, END_SLICE)
+    RUN_NAME = 'default'
+    etl_api_to_gcs(TERMS, run_name=RUN_NAME)
 
 
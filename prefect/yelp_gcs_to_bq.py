@@ -1,17 +1,26 @@
 import os
-import io
 import json
-import time
 import re
 import pandas as pd
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from geopy.geocoders import Nominatim
-from datetime import timedelta
 from prefect import flow, task
-from prefect.tasks import task_input_hash
+from prefect.task_runners import ConcurrentTaskRunner
+from prefect.artifacts import create_markdown_artifact
 from prefect_gcp.cloud_storage import GcsBucket
 from prefect_gcp import GcpCredentials
 from google.cloud import bigquery
+from run_manifest import RunManifest, file_checksum
+from bq_loader import BatchedBigQueryLoader, yelp_load_job_config
+from cdc import ChangeSet, BigQueryMergeExecutor, export_records
+from yelp_transform import clean_businesses, clean_and_export, export_businesses, transform_file
+from geocode_cache import GeocodeCache
+from city_index import CityIndex
+from business_grid import BusinessGrid, grid_frame
+from parquet_io import file_suffix
+from pipeline_metrics import METRICS
 
 """
 This script uses prefect to send JSON files from Google Cloud Storage (Dake Lake) to BigQuery (Data Warehouse).
@@ -21,21 +30,75 @@ Table names created should be documented in terraform to create appropriate tabl
 
 """
 
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "../data/geocode_cache.sqlite")
+
 # extract paths for data from GCS to be put into BQ; credentials might be needed
 @task(retries=3)
-def extract_from_gcs(term:str, location:str, index:int) -> Path:
+def extract_from_gcs(term:str, location:str, index:int, file_format:str = 'json') -> Path:
     """Download JSON files from GCS
     
     :param term: The term corresponding to the data (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
     :param location: The name of location corresponding to the data (ex. Torrance).
     :param index: The index of the location.
+    :param file_format: The format the data was landed in, 'json' or 'parquet'.
     :return: The path of the written JSON file.
     """
-    gcs_path = f"data/{term}-{location}-{index}.json"
+    gcs_path = f"data/{term}-{location}-{index}{file_suffix(file_format)}"
+    with METRICS.timer('stage_seconds', stage='download'):
+        gcs_block = GcsBucket.load("yelp-data-lake-yelp-pipeline-project")
+        gcs_block.get_directory(from_path=gcs_path, local_path=f"../data/")
+    path = Path(f"../data/{gcs_path}")
+    if path.exists():
+        METRICS.incr('bytes_downloaded_total', path.stat().st_size)
+    return path
+
+@task(retries=3)
+def extract_query_plan(term:str) -> Path:
+    """Download the query plan CSV written by the ingest flow for a term from GCS
+
+    :param term: The term corresponding to the plan (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
+    :return: The path of the downloaded CSV file; it does not exist when the term was ingested without a plan.
+    """
+    gcs_path = f"data/query_plan-{term}.csv"
     gcs_block = GcsBucket.load("yelp-data-lake-yelp-pipeline-project")
     gcs_block.get_directory(from_path=gcs_path, local_path=f"../data/")
     return Path(f"../data/{gcs_path}")
 
+@task(retries=3)
+def extract_ingest_settings(term:str) -> dict:
+    """Download the settings the ingest flow landed a term with (see write_ingest_settings) from GCS
+
+    :param term: The term corresponding to the data (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
+    :return: The settings; empty when the term was landed before the ingest flow wrote them.
+    """
+    gcs_path = f"data/ingest_settings-{term}.json"
+    gcs_block = GcsBucket.load("yelp-data-lake-yelp-pipeline-project")
+    gcs_block.get_directory(from_path=gcs_path, local_path=f"../data/")
+    path = Path(f"../data/{gcs_path}")
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def check_cdc_source(term:str, settings:dict) -> None:
+    """
+    Refuse CDC loads of a term landed with deduplication: its files miss the businesses already landed
+    by other locations, which the merge would close.
+
+    :param term: The term to load.
+    :param settings: The settings of extract_ingest_settings.
+    """
+    if 'dedup_mode' not in settings:
+        raise ValueError(f"{term}: the ingest settings are missing, so the data may be deduplicated; land it "
+                         f"again with dedup_mode=None and a new run_name before loading it with load_mode='cdc'")
+    if settings['dedup_mode'] is not None:
+        raise ValueError(f"{term}: landed with dedup_mode={settings['dedup_mode']!r} by run "
+                         f"{settings.get('run_name')!r}; load_mode='cdc' needs data landed with dedup_mode=None")
+
+def dropped_references() -> int:
+    """
+    :return: The number of duplicate_of references the transforms of the run dropped (see seen_index.py).
+    """
+    return sum(value for (name, labels), value in METRICS.snapshot()['counters'].items()
+               if name == 'transform_rows_dropped_total' and ('filter', 'duplicate_of') in labels)
+
 @task(log_prints=True)
 def fetch_location_df(filename):
     """
@@ -70,190 +133,243 @@ def fetch_location_df(filename):
     
 #     return path
 
-@task(log_prints=True, retries=3, cache_key_fn=task_input_hash, cache_expiration=timedelta(hours=1))
-def geolocate_with_address(row):
+@task(log_prints=True, retries=3)
+def geolocate_with_address(df:pd.DataFrame, cache:GeocodeCache = None) -> pd.DataFrame:
+    """
+    Fill the missing coordinates of a cleaned DataFrame from its addresses.
+    Addresses are looked up in the persistent geocode cache first (see geocode_cache.py); only addresses
+    never resolved before are sent to Nominatim, once each and at most one per second.
+
+    :param cache: The GeocodeCache of the flow run. The cache spaces out the requests, so one cache shared
+                  by every file keeps to the rate limit across files; None opens one for this call only.
+    """
     geolocator = Nominatim(user_agent='my-applications', timeout=10)
+    own_cache = cache is None
+    if own_cache:
+        cache = GeocodeCache(GEOCODE_CACHE_PATH)
+    requests, hits = cache.requests, cache.hits
+    try:
+        with METRICS.timer('stage_seconds', stage='geocode'):
+            df = cache.fill_missing(df, geolocator.geocode)
+        print(f"geocoded {cache.requests - requests} new addresses, {cache.hits - hits} from cache")
+    finally:
+        METRICS.incr('geocode_requests_total', cache.requests - requests)
+        METRICS.incr('geocode_cache_hits_total', cache.hits - hits)
+        if own_cache:
+            cache.close()
+    return df
 
-    time.sleep(1)
-    if pd.isna(row['latitude']) and pd.isna(row['longitude']):
-        location = geolocator.geocode(row['address'])
-        if location:
-            row['latitude'] = location.latitude
-            row['longitude'] = location.longitude
-    return row
+@task(log_prints=True)
+def publish_metrics(run_name:str) -> None:
+    """
+    Publish the metrics of the run (see pipeline_metrics.py) as a Prefect markdown artifact,
+    and export them as JSON and as a Prometheus textfile next to the downloaded data.
+
+    :param run_name: The name of the run, used in the artifact title and the JSON file name.
+    """
+    create_markdown_artifact(key="gcs-to-bq-metrics", markdown=METRICS.to_markdown(f"GCS to BQ metrics ({run_name})"),
+                             description="Per-stage timings and counters of the GCS to BQ flow")
+    METRICS.export(json_path=f"../data/metrics-gcs_to_bq-{run_name}.json",
+                   prometheus_path="../data/yelp_gcs_to_bq.prom")
 
 
 @flow(log_prints=True)
-def read_json_transform_df(path:Path, set_cities:set) -> pd.DataFrame:
+def read_json_transform_df(path:Path, set_cities:set, city_index:CityIndex = None,
+                           file_format:str = 'json') -> pd.DataFrame:
     """
-    Data cleaning and transformation before putting it into BigQuery.
+    Data cleaning and transformation before putting it into BigQuery; see yelp_transform.py.
     Section 1. Clean categories
     1. convert categories from string to python dictionary
     2. clean categories to have only alias in a list and get rid of non-related categories
-    3. 
 
-    Section 2. Clean coordinates
-    Section 3. Clean coordinates and locations
+    Section 2. Clean coordinates and locations
+    Section 3. Geocode missing coordinates and export as newline delimited JSON
 
 
     :param path: The path url of Google Cloud Storage to transform from JSON file to pd.DataFrame
+    :param city_index: Assigns businesses whose city is not in set_cities to their nearest city.
+    :param file_format: 'json' exports newline delimited JSON, 'parquet' an Arrow table.
+    :return: The newline delimited JSON export and its row count.
     """
 
-    # Below sets were obtained after EDA into categories.
-    # NONFOOD_CATEGORIES and DEFINITELY_NO_CATEGORIES need to be cleaned out since they are nonrelated categories
-    NONFOOD_CATEGORIES = {'copyshops', 'bikes', 'seafoodmarkets', 'cheese','importedfood','buildingsupplies', 'pumpkinpatches', 'hardware', 'vitaminssupplements', 'cannabisdispensaries', 'artclasses', 'horse_boarding', 'pilates', 'sewingalterations', 'reiki', 'musicians', 'educationservices', 'servicestations', 'skishops',  'marketing', 'fleamarkets', 'spiritual_shop', 'tiling', 'carwash', 'selfstorage',  'hiking', 'accessories', 'alternativemedicine', 'localservices', 'convenience', 'indoor_playcenter', 'saunas', 'grocery', 'shipping_centers', 'playgrounds', 'markets', 'weddingchappels', 'bouncehouserentals', 'tabletopgames', 'doulas', 'photographystores', 'tcm', 'icedelivery', 'pettingzoos', 'wholesalers', 'pianobars', 'surfshop', 'couriers', 'homecleaning', 'foodbanks', 'acupuncture', 'personal_shopping', 'computers', 'oilchange', 'boattours', 'escapegames', 'shavedice', 'brasseries', 'custommerchandise', 'sportswear', 'drivethrubars', 'buddhist_temples', 'weightlosscenters', 'balloonservices', 'registrationservices', 'catering', 'usedbooks', 'karaoke', 'thrift_stores', 'vintage', 'autocustomization', 'souvenirs', 'brewingsupplies', 'parking', 'vocation', 'beautysvc', 'tastingclasses', 'hottubandpool', 'flowers', 'distilleries', 'csa', 'ranches', 'eventservices', 'paintball', 'interiordesign', 'wigs', 'magicians', 'appliances', 'limos', 'plumbing', 'irrigation', 'spraytanning', 'organic_stores', 'candlestores', 'airport_shuttles', 'fishing', 'dog_parks', 'horseracing', 'bingo', 'cookingclasses', 'bike_repair_maintenance', 'animalshelters', 'homedecor', 'gardens', 'tours', 'womenscloth', 'laboratorytesting', 'firewood', 'paydayloans', 'eventplanning', 'headshops', 'hobbyshops', 'publicmarkets', 'bocceball', 'gyms', 'grillservices', 'cardioclasses', 'countryclubs', 'reststops', 'nonprofit', 'shoppingcenters', 'gamemeat', 'religiousitems', 'electronics', 'eatertainment', 'aerialfitness', 'pest_control', 'florists', 'stadiumsarenas', 'kitchenincubators', 'costumes', 'waterpurification', 'hookah_bars', 'djs', 'football', 'shopping', 'physicaltherapy', 'cafeteria', 'barcrawl', 'amateursportsteams', 'suppliesrestaurant', 'bikerentals', 'campgrounds', 'tobaccoshops', 'boating', 'beaches', 'farms', 'vapeshops', 'countrydancehalls', 'gardening', 'cyclingclasses', 'partyequipmentrentals', 'pet_sitting', 'gemstonesandminerals', 'religiousorgs', 'cigarbars', 'elementaryschools', 'supperclubs', 'watersuppliers', 'culturalcenter', 'hotels', 'travelservices', 'mini_golf', 'evchargingstations', 'childcloth', 'artschools', 'outdoorgear', 'vinyl_records', 'reflexology', 'waterdelivery', 'international', 'butcher', 'fitness', 'laundryservices', 'videoandgames', 'paintandsip', 'visitorcenters', 'attractionfarms', 'bootcamps', 'farmersmarket', 'beachequipmentrental', 'trains', 'landmarks', 'golf', 'resorts', 'petadoption', 'winetasteclasses', 'partycharacters', 'mobilephones', 'outlet_stores', 'boatcharters', 'groomer', 'itservices', 'petboarding', 'homehealthcare', 'customcakes', 'chiropractors', 'sommelierservices', 'healthcoach', 'nutritionists', 'artmuseums', 'popupshops', 'museums', 'service_stations', 'fireworks', 'wholesale_stores', 'battingcages', 'fueldocks', 'antiques', 'homeandgarden', 'artsandcrafts', 'galleries', 'livestocksupply', 'surfing', 'personalchefs', 'vacation_rentals', 'amusementparks', 'hats', 'bodyshops', 'cosmetics', 'casinos', 'hospitals', 'eyebrowservices', 'postoffices', 'musicvenues', 'giftshops', 'tennis', 'guesthouses', 'opticians', 'swimmingpools', 'yoga', 'stationery', 'christmastrees', 'beer_and_wine', 'cookingschools', 'bedbreakfast', 'rvparks', 'rugs', 'autorepair', 'autopartssupplies', 'discountstore', 'tradclothing', 'discgolf', 'fashion', 'foodtours', 'recreation', 'pharmacy', 'petstore', 'meats', 'paddleboarding', 'hotelstravel', 'kiteboarding', 'psychic_astrology', 'parks', 'internetcafe', 'specialtyschools', 'kitchensupplies', 'lingerie', 'bookstores', 'arcades', 'lancenters', 'toys', 'threadingservices', 'lifecoach', 'herbsandspices', 'publicservicesgovt', 'auto', 'marinas', 'taxis', 'huntingfishingsupplies', 'health', 'medcenters', 'kitchenandbath', 'kids_activities', 'dancestudio', 'massage_therapy', 'pet_training', 'oliveoil', 'axethrowing', 'bowling', 'barbers', 'kiosk', 'intlgrocery', 'localflavor', 'bartenders', 'petbreeders', 'laundromat', 'musicvideo', 'arts', 'yelpevents', 'candy', 'watches', 'churches', 'waterstores', 'winetours', 'herbalshops', 'popcorn', 'deptstores', 'medicalspa', 'pickyourown', 'jewelry', 'fabricstores', 'truckrepair', 'movietheaters', 'guns_and_ammo', 'education', 'advertising', 'sportgoods', 'partysupplies', 'floraldesigners', 'skincare', 'popuprestaurants', 'horsebackriding', 'healthtrainers', 'poolhalls', 'mags', 'homeappliancerepair', 'golflessons', 'beverage_stores', 'smog_check_stations', 'businessconsulting', 'beertours', 'propane', 'nikkei', 'walkingtours', 'cosmeticdentists', 'artspacerentals', 'sharedofficespaces', 'fooddeliveryservices', 'menscloth', 'clothingrental', 'venues', 'shoes', 'nightlife', 'massage', 'drugstores', 'cabaret', 'lounges', 'active', 'healthmarkets', 'specialed', 'photoboothrentals', 'spas', 'wedding_planning', 'teambuilding', 'festivals', 'naturopathic', 'comedyclubs', 'social_clubs', 'danceclubs', 'jazzandblues', 'wildlifecontrol', 'outdoormovies', 'furniture', 'mobilephonerepair', 'internalmed', 'meditationcenters', 'theater', 'virtualrealitycenters'}
-    DEFINITELY_NO_CATEGORIES = {'grocery', 'convenience', 'drugstores'}
-    # All categories in the dataset
-    ALL_CATEGORIES = {'delis', 'copyshops', 'japanese', 'bikes', 'buildingsupplies', 'pumpkinpatches', 'hardware', 'greek', 'honey', 'winetastingroom', 'vitaminssupplements', 'cannabisdispensaries', 'acaibowls', 'artclasses', 'horse_boarding', 'diners', 'foodtrucks', 'pilates', 'sewingalterations', 'reiki', 'musicians', 'educationservices', 'servicestations', 'skishops', 'bistros', 'mideastern', 'raw_food', 'marketing', 'fleamarkets', 'cheesesteaks', 'hotpot', 'uzbek', 'spiritual_shop', 'tiling', 'breweries', 'diyfood', 'carwash', 'selfstorage', 'southern', 'arabian', 'coffee', 'eritrean', 'hiking', 'fishnchips', 'accessories', 'alternativemedicine', 'kombucha', 'localservices', 'convenience', 'indoor_playcenter', 'sushi', 'pubs', 'irish', 'oaxacan', 'cantonese', 'japacurry', 'saunas', 'grocery', 'colombian', 'szechuan', 'shipping_centers', 'izakaya', 'playgrounds', 'markets', 'weddingchappels', 'bouncehouserentals', 'tabletopgames', 'cocktailbars', 'doulas', 'photographystores', 'chocolate', 'tcm', 'dinnertheater', 'icedelivery', 'food', 'pettingzoos', 'puertorican', 'halal', 'wholesalers', 'pianobars', 'surfshop', 'laotian', 'couriers', 'homecleaning', 'foodbanks', 'armenian', 'divebars', 'acupuncture', 'basque', 'austrian', 'personal_shopping', 'computers', 'korean', 'oilchange', 'boattours', 'escapegames', 'shavedice', 'brasseries', 'custommerchandise', 'falafel', 'sportswear', 'drivethrubars', 'buddhist_temples', 'bangladeshi', 'poutineries', 'weightlosscenters', 'balloonservices', 'somali', 'gourmet', 'registrationservices', 'catering', 'streetvendors', 'usedbooks', 'karaoke', 'thrift_stores', 'themedcafes', 'vintage', 'autocustomization', 'souvenirs', 'brewingsupplies', 'italian', 'bulgarian', 'parking', 'yucatan', 'russian', 'cakeshop', 'vocation', 'beautysvc', 'tastingclasses', 'hottubandpool', 'flowers', 'distilleries', 'csa', 'ranches', 'teppanyaki', 'cupcakes', 'eventservices', 'paintball', 'interiordesign', 'dominican', 'latin', 'wigs', 'magicians', 'sardinian', 'appliances', 'limos', 'plumbing', 'irrigation', 'churros', 'spraytanning', 'filipino', 'lebanese', 'organic_stores', 'candlestores', 'airport_shuttles', 'coffeeroasteries', 'fishing', 'asianfusion', 'newmexican', 'dog_parks', 'horseracing', 'bingo', 'cookingclasses', 'bike_repair_maintenance', 'animalshelters', 'champagne_bars', 'homedecor', 'senegalese', 'ukrainian', 'gardens', 'tours', 'womenscloth', 'laboratorytesting', 'firewood', 'paydayloans', 'eventplanning', 'headshops', 'noodles', 'hobbyshops', 'publicmarkets', 'wine_bars', 'sicilian', 'tea', 'bocceball', 'gyms', 'juicebars', 'grillservices', 'cardioclasses', 'comfortfood', 'soup', 'wraps', 'countryclubs', 'reststops', 'nonprofit', 'australian', 'restaurants', 'vermouthbars', 'shoppingcenters', 'gastropubs', 'gamemeat', 'bakeries', 'bagels', 'religiousitems', 'desserts', 'electronics', 'eatertainment', 'aerialfitness', 'pest_control', 'florists', 'chicken_wings', 'stadiumsarenas', 'seafood', 'kitchenincubators', 'costumes', 'waterpurification', 'hookah_bars', 'djs', 'football', 'shopping', 'physicaltherapy', 'cafeteria', 'rotisserie_chicken', 'cideries', 'barcrawl', 'amateursportsteams', 'suppliesrestaurant', 'bikerentals', 'campgrounds', 'vietnamese', 'tobaccoshops', 'boating', 'gaybars', 'polynesian', 'beaches', 'pancakes', 'farms', 'vapeshops', 'countrydancehalls', 'gardening', 'cyclingclasses', 'partyequipmentrentals', 'pet_sitting', 'gemstonesandminerals', 'religiousorgs', 'cigarbars', 'elementaryschools', 'supperclubs', 'watersuppliers', 'georgian', 'macarons', 'culturalcenter', 'southafrican', 'hotels', 'travelservices', 'mini_golf', 'evchargingstations', 'hkcafe', 'childcloth', 'artschools', 'outdoorgear', 'vinyl_records', 'reflexology', 'waterdelivery', 'international', 'butcher', 'pakistani', 'fitness', 'piadina', 'mexican', 'tamales', 'brewpubs', 'laundryservices', 'poke', 'videoandgames', 'empanadas', 'paintandsip', 'visitorcenters', 'attractionfarms', 'buffets', 'chickenshop', 'peruvian', 'tradamerican', 'bootcamps', 'mongolian', 'farmersmarket', 'beachequipmentrental', 'trains', 'landmarks', 'golf', 'resorts', 'portuguese', 'tikibars', 'petadoption', 'winetasteclasses', 'partycharacters', 'shavedsnow', 'pastashops', 'gelato', 'burmese', 'mobilephones', 'outlet_stores', 'boatcharters', 'gluten_free', 'chimneycakes', 'moroccan', 'cajun', 'breakfast_brunch', 'speakeasies', 'hainan', 'groomer', 'itservices', 'petboarding', 'homehealthcare', 'customcakes', 'brazilian', 'caribbean', 'chiropractors', 'sommelierservices', 'healthcoach', 'nutritionists', 'artmuseums', 'popupshops', 'museums', 'honduran', 'service_stations', 'fireworks', 'himalayan', 'wholesale_stores', 'venezuelan', 'battingcages', 'fueldocks', 'kosher', 'antiques', 'foodstands', 'bubbletea', 'scottish', 'homeandgarden', 'artsandcrafts', 'galleries', 'livestocksupply', 'surfing', 'pretzels', 'personalchefs', 'hotdogs', 'donuts', 'vacation_rentals', 'amusementparks', 'hats', 'bodyshops', 'cosmetics', 'casinos', 'northernmexican', 'hospitals', 'eyebrowservices', 'vegetarian', 'postoffices', 'musicvenues', 'giftshops', 'cheese', 'calabrian', 'tennis', 'guesthouses', 'opticians', 'swimmingpools', 'yoga', 'stationery', 'tuscan', 'singaporean', 'cuban', 'christmastrees', 'beer_and_wine', 'cookingschools', 'bedbreakfast', 'chinese', 'rvparks', 'rugs', 'autorepair', 'autopartssupplies', 'discountstore', 'tradclothing', 'discgolf', 'fashion', 'foodtours', 'recreation', 'pharmacy', 'petstore', 'hungarian', 'srilankan', 'panasian', 'food_court', 'meats', 'paddleboarding', 'syrian', 'hotelstravel', 'kiteboarding', 'sandwiches', 'seafoodmarkets', 'soulfood', 'psychic_astrology', 'conveyorsushi', 'parks', 'internetcafe', 'specialtyschools', 'kitchensupplies', 'lingerie', 'bookstores', 'arcades', 'lancenters', 'toys', 'kebab', 'threadingservices', 'lifecoach', 'herbsandspices', 'publicservicesgovt', 'auto', 'cafes', 'afghani', 'marinas', 'taxis', 'huntingfishingsupplies', 'fondue', 'argentine', 'health', 'sportsbars', 'spanish', 'modern_european', 'medcenters', 'kitchenandbath', 'kids_activities', 'dancestudio', 'massage_therapy', 'tex-mex', 'pet_training', 'slovakian', 'importedfood', 'oliveoil', 'burgers', 'axethrowing', 'bowling', 'barbers', 'kiosk', 'intlgrocery', 'cambodian', 'localflavor', 'bartenders', 'petbreeders', 'laundromat', 'musicvideo', 'arts', 'yelpevents', 'candy', 'thai', 'watches', 'churches', 'belgian', 'waterstores', 'winetours', 'herbalshops', 'czech', 'popcorn', 'deptstores', 'jaliscan', 'medicalspa', 'taiwanese', 'meaderies', 'pickyourown', 'jewelry', 'icecream', 'fabricstores', 'creperies', 'truckrepair', 'newamerican', 'scandinavian', 'salad', 'movietheaters', 'malaysian', 'guns_and_ammo', 'education', 'advertising', 'sportgoods', 'partysupplies', 'floraldesigners', 'skincare', 'african', 'popuprestaurants', 'horsebackriding', 'mediterranean', 'vegan', 'healthtrainers', 'poolhalls', 'french', 'guamanian', 'beerbar', 'mags', 'beergardens', 'homeappliancerepair', 'golflessons', 'beverage_stores', 'smog_check_stations', 'shanghainese', 'businessconsulting', 'beertours', 'propane', 'smokehouse', 'tapas', 'nikkei', 'british', 'walkingtours', 'indonesian', 'cosmeticdentists', 'artspacerentals', 'wineries', 'sharedofficespaces', 'irish_pubs', 'fooddeliveryservices', 'menscloth', 'clothingrental', 'venues', 'shoes', 'nightlife', 'massage', 'bars', 'drugstores', 'trinidadian', 'cabaret', 'lounges', 'iberian', 'ramen', 'salvadoran', 'steak', 'dimsum', 'indpak', 'pizza', 'waffles', 'active', 'healthmarkets', 'ethiopian', 'persian', 'specialed', 'photoboothrentals', 'spas', 'wedding_planning', 'teambuilding', 'tapasmallplates', 'polish', 'hotdog', 'nicaraguan', 'festivals', 'newcanadian', 'hawaiian', 'naturopathic', 'comedyclubs', 'haitian', 'social_clubs', 'danceclubs', 'whiskeybars', 'german', 'jazzandblues', 'wildlifecontrol', 'outdoormovies', 'furniture', 'mobilephonerepair', 'internalmed', 'bbq', 'meditationcenters', 'tacos', 'theater', 'egyptian', 'virtualrealitycenters', 'turkish'}
-    
-    # Food and Bars categories - this includes bars that serve food or restaurants that serve drinks
-    FOOD_AND_BARS_CATEGORIES = {'poutineries', 'sardinian', 'bars', 'divebars', 'tamales', 'winetastingroom', 'comfortfood', 'somali', 'rotisserie_chicken', 'cuban', 'puertorican', 'pastashops', 'meaderies', 'whiskeybars', 'indpak', 'vermouthbars', 'moroccan', 'cupcakes', 'newmexican', 'polynesian', 'falafel', 'pancakes', 'yucatan', 'bbq', 'oaxacan', 'ukrainian', 'arabian', 'foodstands', 'brazilian', 'wineries', 'japacurry', 'pubs', 'himalayan', 'newcanadian', 'tacos', 'australian', 'hainan', 'dinnertheater', 'foodtrucks', 'acaibowls', 'georgian', 'sicilian', 'calabrian', 'irish_pubs', 'dimsum', 'kebab', 'teppanyaki', 'colombian', 'newamerican', 'chinese', 'vietnamese', 'delis', 'irish', 'eritrean', 'southern', 'wraps', 'senegalese', 'tapasmallplates', 'hawaiian', 'guamanian', 'mediterranean', 'hotdog', 'vegan', 'laotian', 'panasian', 'polish', 'beerbar', 'argentine', 'steak', 'sandwiches', 'tex-mex', 'bagels', 'german', 'salad', 'creperies', 'gluten_free', 'pretzels', 'poke', 'jaliscan', 'noodles', 'buffets', 'basque', 'iberian', 'chickenshop', 'singaporean', 'modern_european', 'desserts', 'donuts', 'food_court', 'breweries', 'mexican', 'sushi', 'dominican', 'salvadoran', 'restaurants', 'hotdogs', 'gelato', 'kosher', 'bulgarian', 'burgers', 'raw_food', 'icecream', 'brewpubs', 'mideastern', 'syrian', 'cheesesteaks', 'belgian', 'food', 'peruvian', 'filipino', 'korean', 'soulfood', 'pizza', 'russian', 'bangladeshi', 'caribbean', 'cocktailbars', 'churros', 'tradamerican', 'indonesian', 'wine_bars', 'coffeeroasteries', 'greek', 'french', 'cambodian', 'conveyorsushi', 'themedcafes', 'thai', 'piadina', 'honey', 'fondue', 'sportsbars', 'asianfusion', 'cakeshop', 'slovakian', 'ramen', 'british', 'southafrican', 'empanadas', 'chimneycakes', 'latin', 'tapas', 'diners', 'chicken_wings', 'northernmexican', 'macarons', 'italian', 'beergardens', 'hungarian', 'hotpot', 'cideries', 'shavedsnow', 'vegetarian', 'egyptian', 'ethiopian', 'trinidadian', 'taiwanese', 'portuguese', 'chocolate', 'cafes', 'lebanese', 'soup', 'hkcafe', 'burmese', 'bubbletea', 'bistros', 'malaysian', 'seafood', 'austrian', 'japanese', 'cantonese', 'halal', 'nicaraguan', 'srilankan', 'juicebars', 'diyfood', 'scottish', 'honduran', 'scandinavian', 'gastropubs', 'venezuelan', 'armenian', 'speakeasies', 'coffee', 'spanish', 'tikibars', 'bakeries', 'tea', 'smokehouse', 'turkish', 'izakaya', 'champagne_bars', 'waffles', 'gaybars', 'cajun', 'haitian', 'szechuan', 'fishnchips', 'afghani', 'african', 'czech', 'kombucha', 'shanghainese', 'breakfast_brunch', 'mongolian', 'pakistani', 'gourmet', 'tuscan', 'uzbek', 'persian', 'streetvendors'}
-    # Just bars
-    BARS_CATEGORIES = {'bars', 'divebars', 'winetastingroom', 'meaderies', 'whiskeybars', 'vermouthbars', 'wineries', 'pubs', 'irish_pubs', 'beerbar', 'tapas', 'breweries', 'brewpubs', 'cocktailbars', 'winebars', 'sportsbars', 'beergardens', 'gastropubs', 'tikibars', 'champagne_bars', 'gaybars'}
-    # Just food no alcohol
-    FOOD_CATEGORIES = {'waffles', 'haitian', 'filipino', 'diners', 'afghani', 'belgian', 'teppanyaki', 'lebanese', 'piadina', 'hotpot', 'cuban', 'bistros', 'singaporean', 'comfortfood', 'buffets', 'soup', 'vegetarian', 'newcanadian', 'tradamerican', 'himalayan', 'dominican', 'themedcafes', 'austrian', 'japanese', 'modern_european', 'ramen', 'hotdog', 'cakeshop', 'portuguese', 'newmexican', 'taiwanese', 'vegan', 'uzbek', 'fishnchips', 'british', 'kosher', 'guamanian', 'szechuan', 'mexican', 'macarons', 'acaibowls', 'georgian', 'bagels', 'cheesesteaks', 'food', 'bakeries', 'persian', 'arabian', 'mediterranean', 'colombian', 'burgers', 'food_court', 'sandwiches', 'shavedsnow', 'coffee', 'trinidadian', 'russian', 'italian', 'diyfood', 'sicilian', 'ukrainian', 'churros', 'tuscan', 'cantonese', 'spanish', 'foodtrucks', 'moroccan', 'sardinian', 'cideries', 'hawaiian', 'soulfood', 'thai', 'falafel', 'gourmet', 'chimneycakes', 'scandinavian', 'izakaya', 'honey', 'cupcakes', 'japacurry', 'bulgarian', 'streetvendors', 'pretzels', 'pancakes', 'salvadoran', 'srilankan', 'delis', 'tex-mex', 'cajun', 'polish', 'dimsum', 'bangladeshi', 'eritrean', 'halal', 'african', 'turkish', 'somali', 'hotdogs', 'slovakian', 'chicken_wings', 'southern', 'brazilian', 'hainan', 'venezuelan', 'winebars', 'dinnertheater', 'empanadas', 'hungarian', 'pakistani', 'poutineries', 'irish', 'cafes', 'asianfusion', 'speakeasies', 'chocolate', 'basque', 'chinese', 'syrian', 'calabrian', 'armenian', 'puertorican', 'southafrican', 'polynesian', 'senegalese', 'donuts', 'german', 'scottish', 'kombucha', 'jaliscan', 'seafood', 'indpak', 'czech', 'juicebars', 'mongolian', 'tapasmallplates', 'australian', 'noodles', 'oaxacan', 'shanghainese', 'wraps', 'bbq', 'burmese', 'foodstands', 'kebab', 'honduran', 'salad', 'gelato', 'korean', 'panasian', 'rotisserie_chicken', 'pizza', 'greek', 'ethiopian', 'laotian', 'malaysian', 'smokehouse', 'nicaraguan', 'vietnamese', 'caribbean', 'hkcafe', 'steak', 'raw_food', 'restaurants', 'peruvian', 'bubbletea', 'poke', 'pastashops', 'tea', 'yucatan', 'sushi', 'wine_bars', 'conveyorsushi', 'french', 'tacos', 'argentine', 'northernmexican', 'fondue', 'chickenshop', 'gluten_free', 'icecream', 'breakfast_brunch', 'tamales', 'cambodian', 'mideastern', 'indonesian', 'latin', 'coffeeroasteries', 'newamerican', 'desserts', 'creperies', 'egyptian', 'iberian'}
-    # Ethnicities for subset analysis
-    ETHNICITIES_CATEGORIES = {'japanese', 'greek', 'mideastern', 'uzbek', 'southern', 'arabian', 'eritrean', 'irish', 'oaxacan', 'cantonese', 'colombian', 'szechuan', 'puertorican', 'halal', 'laotian', 'armenian', 'basque', 'austrian', 'korean', 'bangladeshi', 'poutineries', 'somali', 'italian', 'bulgarian', 'yucatan', 'russian', 'dominican', 'latin', 'sardinian', 'filipino', 'lebanese', 'asianfusion', 'newmexican', 'senegalese', 'ukrainian', 'sicilian', 'australian', 'vietnamese', 'polynesian', 'georgian', 'southafrican', 'hkcafe', 'pakistani', 'mexican', 'peruvian', 'tradamerican', 'mongolian', 'portuguese', 'burmese', 'moroccan', 'cajun', 'hainan', 'brazilian', 'caribbean', 'honduran', 'himalayan', 'venezuelan', 'kosher', 'scottish', 'northernmexican', 'calabrian', 'tuscan', 'singaporean', 'cuban', 'chinese', 'hungarian', 'srilankan', 'panasian', 'syrian', 'afghani', 'argentine', 'spanish', 'modern_european', 'tex-mex', 'slovakian', 'cambodian', 'thai', 'belgian', 'czech', 'jaliscan', 'taiwanese', 'newamerican', 'scandinavian', 'malaysian', 'african', 'french', 'guamanian', 'shanghainese', 'british', 'indonesian', 'trinidadian', 'iberian', 'salvadoran', 'indpak', 'ethiopian', 'persian', 'polish', 'nicaraguan', 'newcanadian', 'hawaiian', 'haitian', 'german', 'egyptian', 'turkish'}
-
-    df = pd.read_json(path)
-    transformed_dataframe = df.copy()
-
-    # if data frame is completely empty to begin with:
-    if transformed_dataframe.empty:
-        print("Dataframe is empty")
-        export_data = transformed_dataframe.to_json(orient='records', lines=True)
-        return export_data, 0
-
-    # create column named "price" if data frame does not have it and fill it with None for the whole dataset. 
-    if 'price' not in transformed_dataframe.columns:
-        transformed_dataframe['price'] = None
-
-
-    # Section 2. Clean categories
-    # convert 'categories' that were imported as strings to list of dictionaries
-    transformed_dataframe['categories'] = transformed_dataframe['categories'].apply(lambda x: json.loads(json.dumps(x)))
-    # then transform them into lists that only have alias
-    transformed_dataframe['categories'] = transformed_dataframe['categories'].apply(
-        lambda x: [category['alias'] for category in x])
-    # filter for restaurant categories that are included in food and bars categories
-    transformed_dataframe = transformed_dataframe[transformed_dataframe['categories'].apply(
-        lambda x: any(cat in FOOD_AND_BARS_CATEGORIES for cat in x))]
-    # filter out categories that are definitely useless
-    transformed_dataframe = transformed_dataframe[transformed_dataframe['categories'].apply(
-        lambda x: not any(cat in DEFINITELY_NO_CATEGORIES for cat in x))]
-    transformed_dataframe['ethnic_category'] = transformed_dataframe['categories'].apply(
-        lambda x: [category for category in x if category in ETHNICITIES_CATEGORIES]
-                    if any(category in ETHNICITIES_CATEGORIES for category in x)
-                    else ['Not Specified'])
-
-    if transformed_dataframe.empty:
-
-        print("Dataframe is empty")
-        export_data = transformed_dataframe.to_json(orient='records', lines=True)
-        return export_data, 0
-    
-    else:
-        # Section 3. Clean coordinates and locations
-        # convert 'coordinates' that were imported as strings to python dictionaries
-        transformed_dataframe['coordinates'] = transformed_dataframe['coordinates'].apply(lambda x: json.loads(json.dumps(x)))
-        transformed_dataframe['latitude'] = transformed_dataframe['coordinates'].apply(lambda x: x['latitude'])
-        transformed_dataframe['longitude'] = transformed_dataframe['coordinates'].apply(lambda x: x['longitude'])
-        
-        # convert 'location' that were imported as strings to dictionaries
-        transformed_dataframe['location'] = transformed_dataframe['location'].apply(lambda x: json.loads(json.dumps(x)))
-        # only have addresses that are in "CA" for state and start with 9 for 'zip_code'
-        transformed_dataframe = transformed_dataframe[transformed_dataframe['location'].apply(
-            lambda x: x['state'] == 'CA' and x['city'] in set_cities)]
-        # add 'city' column for easy parsing in the future
-        transformed_dataframe['city'] = transformed_dataframe['location'].apply(
-            lambda x: (str(x['city']).replace('  ', ' ').replace(',', '').lower().rstrip()))
-        # clean up 'location' column from dictionary to usual address
-        transformed_dataframe['address'] = transformed_dataframe['location'].apply(
-            lambda x: (str(x['address1']) + ', ' + str(x['city'].rstrip()) + ' ' + str(x['state']) + ' ' + str(x['zip_code'])) if (
-                        x['address2'] is None or x['address2'] == '') else (
-                        str(x['address1']) + ' ' + str(x['address2']) + ', '
-                        + str(x['city'].replace('  ', ' ').replace(',', '').rstrip())
-                        + ' ' + str(x['state']) + ' ' + str(x['zip_code'])))
-        # find missing coordinates
-        c = transformed_dataframe.loc[transformed_dataframe['latitude'].isna()]\
-            .apply(lambda x: geolocate_with_address(x), axis = 1)
-        transformed_dataframe.loc[transformed_dataframe['latitude'].isna()] = c
-
-
-        # delete any 'address' that start with ',' (ex. ', San Jose CA')
-        transformed_dataframe['address'] = transformed_dataframe['address'].str.lstrip(', ')
-
-        
-        transformed_dataframe = transformed_dataframe[['id', 'alias', 'name', 'url', 'review_count',
-            'categories', 'ethnic_category', 'rating', 'price', 'latitude', 'longitude', 'city', 'address']] # .reset_index(drop=True)
-        
-        # transformed_dataframe = transformed_dataframe.astype(str)
-        row_count = len(transformed_dataframe)
-        export_data = transformed_dataframe.to_json(orient='records', lines=True)
-        
-        return export_data, row_count
+    with METRICS.timer('stage_seconds', stage='transform'):
+        transformed_dataframe = clean_businesses(path, set_cities, city_index)
+    return export_businesses(transformed_dataframe, geolocate_with_address, file_format)
 
 @task()
-def write_bq(df:json, term:str) -> "bigquery.Table":
+def transform_landed_file(path:Path, set_cities:set, city_index:CityIndex = None, file_format:str = 'json',
+                          pool:ProcessPoolExecutor = None):
     """
-    Write DataFrame to BigQuery
+    Clean a downloaded file (see yelp_transform.py) in the task runner, or in a worker process of a pool.
+
+    :param path: The path of the downloaded file.
+    :param set_cities: The set of city names a business must be located in.
+    :param city_index: Assigns businesses whose city is not in set_cities to their nearest city.
+    :param file_format: The format of the landed file and of the export, 'json' or 'parquet'.
+    :param pool: A ProcessPoolExecutor to run the pandas transform in; None transforms in this thread.
+    :return: (export_data, row_count), or the cleaned DataFrame when some rows still need geocoding.
     """
-    # Construct a BigQuery client object.
-
-    project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
-    table_id =f"yelp_data_raw_prod.{term}_data_raw"
-    client = bigquery.Client(project=project_id)
-    job_config = bigquery.LoadJobConfig(
-        schema=[
-            bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("alias", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("url", "STRING"),
-            bigquery.SchemaField("review_count", "INTEGER"),
-            bigquery.SchemaField("categories", "STRING", mode="REPEATED"),
-            bigquery.SchemaField("ethnic_category", "STRING", mode="REPEATED"),
-            bigquery.SchemaField("rating", "FLOAT"),
-            bigquery.SchemaField("price", "STRING"),
-            bigquery.SchemaField("latitude", "FLOAT"),
-            bigquery.SchemaField("longitude", "FLOAT"),
-            bigquery.SchemaField("city", "STRING"),
-            bigquery.SchemaField("address", "STRING")
-            ],
-        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-
-    )
-
-
-    job = client.load_table_from_file(
-        io.StringIO(df), table_id, job_config=job_config)
-    
-    # path = Path(f"transformed_data/transformed_{term}-{location}-{index}.json")
-    # with open(path, 'rb') as f:
-    #     job = client.load_table_from_file(f, table_id, job_config=job_config)
+    if pool is None:
+        return clean_and_export(path, set_cities, city_index, file_format)
+    result, worker_metrics = pool.submit(transform_file, path, set_cities, city_index, file_format).result()
+    METRICS.merge(worker_metrics)
+    return result
+
+@task(log_prints=True, retries=3)
+def write_grid(term:str, frames:list) -> Path:
+    """
+    Build the geohash grid index of the businesses of a term (see business_grid.py), store it next to the
+    landed files and upload it beside them in GCS.
 
-    try:
-        job.result()
-    except Exception as e:
-        print(job.errors)
-   
+    :param term: The term corresponding to the data (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
+    :param frames: The grid_frame of every location of the term transformed by the run.
+    :return: The path of the grid file.
+    """
+    grid = BusinessGrid(pd.concat(frames, ignore_index=True))
+    path = grid.save(Path(f"../data/data/business_grid-{term}.parquet"))
+    gcs_block = GcsBucket.load("yelp-data-lake-yelp-pipeline-project")
+    gcs_block.upload_from_path(from_path=path, to_path=f"data/{path.name}")
+    print(f"{term}: {len(grid)} businesses in {len(grid.cells)} grid cells")
+    return path
 
-@flow(log_prints=True)
-def etl_gcs_to_bq(terms: list, start_slice: int, end_slice: int):
+@task(log_prints=True, retries=3)
+def merge_changes(executor, table:str, change_set:ChangeSet) -> dict:
     """
-    
+    Apply the inserts, updates and closures of a term to its current-state table (see cdc.py).
+    The change table is overwritten on every attempt, so retrying the MERGE is safe.
+
+    :param executor: A BigQueryMergeExecutor, or the SQLite stand-in.
+    :param table: The name of the current-state table (ex. Restaurants_current).
+    :param change_set: The changes of the run against the snapshot of the table.
+    :return: The number of inserts, updates, closures and unchanged businesses.
+    """
+    change_set.close_missing()
+    counts = change_set.counts()
+    print(f"{table}: {counts}")
+    with METRICS.timer('stage_seconds', stage='merge'):
+        executor.merge(table, change_set)
+    for op, count in counts.items():
+        METRICS.incr('cdc_rows_total', count, op=op)
+    return counts
+
+def transform_locations(term, df_plan, indexes, set_cities, workers=1, city_index=None, file_format='json',
+                        task_concurrency=8, geocode_cache=None):
+    """
+    Download and transform the landed files of many locations, yielding the results in input order.
+
+    Every location is its own chain of tasks submitted to the flow's task runner, extract_from_gcs ->
+    transform_landed_file, and up to task_concurrency chains run at the same time. With more than one
+    worker, the pandas transform runs in a process pool, so the CPU bound cleaning of many files happens
+    at once. Rows missing coordinates are geocoded back in the flow, since geocoding is rate limited.
+
+    :param term: The term corresponding to the data (ex. ['Restaurants', 'Food', 'Coffee & Tea']).
+    :param df_plan: A dataframe with the Name of every location (or query plan circle).
+    :param indexes: The location indexes to transform, in order.
+    :param set_cities: The set of city names a business must be located in.
+    :param workers: The number of worker processes; 1 transforms in the task runner threads.
+    :param city_index: Assigns businesses whose city is not in set_cities to their nearest city.
+    :param file_format: The format of the landed files and of the exports, 'json' or 'parquet'.
+    :param task_concurrency: The maximum number of location chains submitted at the same time.
+    :param geocode_cache: The GeocodeCache of the flow run the missing coordinates are geocoded through.
+    :return: A generator of (index, path, export_data, row_count).
+    """
+    indexes = iter(indexes)
+    chains = deque()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while True:
+            # keep up to task_concurrency locations downloading and transforming
+            while len(chains) < task_concurrency:
+                i = next(indexes, None)
+                if i is None:
+                    break
+                download = extract_from_gcs.submit(term, df_plan.iloc[i]['Name'], i, file_format)
+                transform = transform_landed_file.submit(download, set_cities, city_index, file_format, pool)
+                chains.append((i, download, transform))
+            if not chains:
+                break
+
+            i, download, transform = chains.popleft()
+            result = transform.result()
+            if isinstance(result, pd.DataFrame):
+                result = export_businesses(result, lambda df: geolocate_with_address(df, geocode_cache),
+                                           file_format)
+            yield (i, download.result(), *result)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+@flow(log_prints=True, task_runner=ConcurrentTaskRunner())
+def etl_gcs_to_bq(terms: list, start_slice: int = 0, end_slice: int = None, run_name: str = 'default',
+                  flush_rows: int = 50000, workers: int = 1, file_format: str = 'json',
+                  task_concurrency: int = 8, load_mode: str = 'append', build_grid: bool = True) -> int:
+    """
+    Download the landed JSON files of every location from GCS, clean them and load them into BigQuery.
+    The cleaned rows of many locations are loaded together in a few large load jobs per table through
+    one BigQuery client (see bq_loader.py). Every location loaded successfully is recorded in the run
+    manifest, so re-running the flow with the same run name resumes from the locations that have not
+    been loaded yet (see run_manifest.py).
+    Each location is downloaded and transformed in its own chain of concurrent tasks, see transform_locations.
+
+    :param terms: A list of terms to load.
+    :param start_slice: The start index for slicing the location DataFrame.
+    :param end_slice: The end index for slicing the location DataFrame; None loads every location.
+    :param run_name: The name of the run in the run manifest; use a new name for a fresh reload.
+    :param flush_rows: The number of buffered rows that triggers a load job for a table.
+    :param workers: The number of processes transforming files in parallel; 1 transforms in the flow itself.
+    :param file_format: The format the ingest flow landed the data in; 'parquet' also loads into BigQuery
+                        from Parquet instead of newline delimited JSON.
+    :param task_concurrency: The maximum number of locations downloaded and transformed at the same time.
+    :param load_mode: 'append' loads every cleaned business into the {term}_data_raw tables; 'cdc' only
+                      merges the inserts, updates and closures since the last run into the
+                      yelp_data_current.{term}_current tables (see cdc.py). CDC needs the data landed with
+                      dedup_mode=None, so that every file holds all the businesses of its location; the flow
+                      raises a ValueError before loading anything otherwise.
+    :param build_grid: Store a geohash grid index of the businesses of each term transformed by the run
+                       next to the landed files, for radius and nearest queries (see business_grid.py).
+    :return: The number of rows loaded; raises a RuntimeError, once the metrics are published, when a load job failed.
     """
     total_rows = 0
+    METRICS.reset()
+    if load_mode == 'cdc':
+        for term in terms:
+            check_cdc_source(term, extract_ingest_settings(term))
+    manifest = RunManifest("../data/run_manifest.sqlite", run_name)
+    # one cache for the whole run, so Nominatim's 1 request per second holds across files
+    geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH)
+    source_format = bigquery.SourceFormat.PARQUET if file_format == 'parquet' else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+    client = bigquery.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
+    loader = BatchedBigQueryLoader(client, job_config=yelp_load_job_config(source_format), flush_rows=flush_rows)
+    executor = BigQueryMergeExecutor(client) if load_mode == 'cdc' else None
+    merged = []
     df_locations = fetch_location_df("/usr/local/share/california_lat_long_cities.csv") # for local testing, simply do fetch_location_df("california_lat_long_cities.csv")
     set_cities = set(df_locations['Name'])
+    city_index = CityIndex(df_locations)
     for term in terms: 
-        for i in range(start_slice, end_slice):
-            print(term, df_locations.iloc[i]['Name'], i)
-    
-            gcs_path = extract_from_gcs(term, df_locations.iloc[i]['Name'], i)
-            df, row_count = read_json_transform_df(gcs_path, set_cities)
+        # landed files are named after the query plan circles when the ingest flow used one
+        plan_path = extract_query_plan(term)
+        df_plan = fetch_location_df(plan_path) if plan_path.exists() else df_locations
+        stop = len(df_plan) if end_slice is None else min(end_slice, len(df_plan))
+        pending = manifest.pending('load', term, range(start_slice, stop))
+        print(f"{term}: resuming with {len(pending)} of {stop - start_slice} locations left")
+        if executor is not None:
+            current_table = "{}_current".format(re.split('\s+',term)[0])
+            change_set = ChangeSet(executor.snapshot(current_table))
+            tags = []
+        grid_frames = []
+        for i, gcs_path, df, row_count in transform_locations(term, df_plan, pending, set_cities, workers, city_index,
+                                                              file_format, task_concurrency, geocode_cache):
+            print(term, df_plan.iloc[i]['Name'], i)
             # path_for_file_save = write_local(df, term, df_locations.iloc[i]['Name'], i)
-            write_bq(df, re.split('\s+',term)[0])
-            
+            tag = (term, i, df_plan.iloc[i]['Name'], f"data/{gcs_path.name}", file_checksum(gcs_path), row_count)
+            if build_grid and row_count:
+                grid_frames.append(grid_frame(df))
+            if executor is not None:
+                change_set.add(gcs_path.stem, export_records(df))
+                tags.append(tag)
+            else:
+                table_id = "yelp_data_raw_prod.{}_data_raw".format(re.split('\s+',term)[0])
+                loader.add(table_id, df, row_count, tag=tag)
     
             # pd.set_option('display.max_columns', 500)
             # pd.set_option('display.width', 1000)
@@ -261,12 +377,46 @@ def etl_gcs_to_bq(terms: list, start_slice: int, end_slice: int):
             total_rows += row_count
             print(f"total rows: {total_rows} for {term}")
 
+        if grid_frames:
+            write_grid(term, grid_frames)
+        if executor is not None:
+            if dropped_references():
+                manifest.close()
+                geocode_cache.close()
+                raise ValueError(f"{term}: the landed files hold duplicate_of references (dedup_mode='reference'); "
+                                 f"load_mode='cdc' needs data landed with dedup_mode=None")
+            counts = merge_changes(executor, current_table, change_set)
+            merged.append((tags, counts['insert'] + counts['update'] + counts['move'] + counts['close']))
+
+    # wait for the submitted load jobs; only locations whose rows were loaded are marked as done
+    with METRICS.timer('stage_seconds', stage='load_wait'):
+        loaded, errors = loader.close()
+    loaded_rows = 0
+    for term, i, location, object_name, checksum, row_count in loaded:
+        manifest.complete('load', term, i, location, object_name, checksum, rows=row_count)
+        loaded_rows += row_count
+    for tags, change_count in merged:
+        for term, i, location, object_name, checksum, row_count in tags:
+            manifest.complete('load', term, i, location, object_name, checksum, rows=row_count)
+        loaded_rows += change_count
+    for table_id, error in errors:
+        print(f"Load job into {table_id} failed: {error}")
+    print(f"total rows: {total_rows} transformed, {loaded_rows} loaded")
+    manifest.close()
+    geocode_cache.close()
+    publish_metrics(run_name)
+    if errors:
+        # the flow run fails; the locations of the failed jobs stay pending in the run manifest
+        raise RuntimeError(f"{len(errors)} load job(s) failed: "
+                           + "; ".join(f"{table_id}: {error}" for table_id, error in errors)
+                           + f"; run the flow again with run_name={run_name!r} to retry them")
+    return loaded_rows
+
 if __name__ == "__main__":
     TERMS = ['Juice Bars & Smoothies'] # ['Juice Bars & Smoothies', 'Desserts', 'Bakeries', 'Coffee & Tea', 'Bubble Tea'] ['Restaurants', 'Food']
-    START_SLICE = 0 #For all, START_SLICE = 0, END_SLICE = 459; For LA, START_SLICE = 229 END_SLICE = 230
-    END_SLICE = 459
+    RUN_NAME = 'default' # re-running with the same RUN_NAME resumes after the last loaded location
     
-    etl_gcs_to_bq(TERMS, START_SLICE, END_SLICE)
+    etl_gcs_to_bq(TERMS, run_name=RUN_NAME)
 
     # prefect deployment build prefect/yelp_gcs_to_bq.py:etl_gcs_to_bq -n "Yelp ELT GCS to BQ"
     # prefect deployment apply etl_gcs_to_bq-deployment.yaml 
\ No newline at end of file
@@ -0,0 +1,306 @@
+import time
+import queue
+import asyncio
+import aiohttp
+import threading
+import functools
+from pipeline_metrics import METRICS
+
+"""
+Asynchronous fetch engine for the Yelp Fusion business search endpoint.
+
+A single keep-alive aiohttp session is shared by every request of a run, and a semaphore caps the
+number of requests in flight so one flow run can use most of the API rate budget without tripping it.
+Each (term, location, offset) page is an independent unit of work scheduled through that semaphore,
+so pages of many locations are fetched side by side instead of one after another.
+With a ResponseCache (see response_cache.py), pages fetched recently are served from disk instead.
+
+stream_term_across_locations hands locations over in order as soon as they are fetched instead of
+returning them all at the end, and pauses fetching while the consumer is behind, so ingest memory does
+not grow with the number of terms and locations.
+"""
+
+SEARCH_LIMIT = 50
+# The search endpoint returns up to 1000 businesses for a single query
+MAX_RESULTS = 1000
+_DONE = object()
+
+
+class YelpSearchClient:
+    """
+    Pooled HTTP client for https://api.yelp.com/v3/businesses/search.
+
+    Use it as an async context manager so the session and its connection pool are closed at the end:
+
+        async with YelpSearchClient(url, headers, concurrency=8) as client:
+            data = await client.fetch_location('Restaurants', 33.83585, -118.340628)
+    """
+
+    def __init__(self, url, headers, concurrency=8, radius=10000, limit=SEARCH_LIMIT, timeout=30, retries=3,
+                 cache=None):
+        """
+        :param url: API Host and search path (ie 'https://api.yelp.com/v3/businesses/search')
+        :param headers: a dictionary of headers to send with API requests
+        :param concurrency: The maximum number of requests in flight at the same time.
+        :param radius: Default search radius in meters when a location does not specify one.
+        :param limit: The number of businesses requested per page (max 50).
+        :param timeout: Total timeout in seconds for a single request.
+        :param retries: How many times a page is retried after a 429 (rate limited) response.
+        :param cache: A ResponseCache to serve and store pages from; None always requests the API.
+        """
+        self.url = url
+        self.headers = headers
+        self.concurrency = concurrency
+        self.radius = radius
+        self.limit = limit
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(headers=self.headers, connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    async def fetch_page(self, term, lat, long, offset, radius=None, limit=None):
+        """
+        Request a single page of search results.
+
+        :param term: A term to include in the API query (ie 'Food', 'Restaurants', 'Coffee & Tea')
+        :param lat: Latitude of the search centre
+        :param long: Longitude of the search centre
+        :param offset: The offset of the first business of the page
+        :param radius: Search radius in meters; defaults to the client radius
+        :param limit: Page size; defaults to the client limit
+        :return: The decoded JSON response
+        """
+        # aiohttp only accepts str/int/float query values; 'False' matches what requests sends
+        parameters = {
+            'limit': limit or self.limit,
+            'term': term,
+            'is_closed': 'False',
+            'latitude': float(lat),
+            'longitude': float(long),
+            'radius': int(radius or self.radius),
+            'offset': offset
+        }
+        if self.cache is not None:
+            data = self.cache.get(self.url, parameters)
+            if data is not None:
+                METRICS.incr('api_cache_hits_total')
+                return data
+        for attempt in range(self.retries + 1):
+            async with self._semaphore:
+                start = time.perf_counter()
+                async with self._session.get(self.url, params=parameters) as response:
+                    METRICS.observe('api_request_seconds', time.perf_counter() - start)
+                    METRICS.incr('api_requests_total', status=response.status)
+                    if response.status != 429 or attempt == self.retries:
+                        response.raise_for_status()
+                        data = await response.json()
+                        if self.cache is not None:
+                            self.cache.put(self.url, parameters, data)
+                        return data
+                    delay = float(response.headers.get('Retry-After', 2 ** attempt))
+            # back off outside of the semaphore so other work items can use the slot
+            await asyncio.sleep(delay)
+
+    async def fetch_location(self, term, lat, long, radius=None):
+        """
+        Fetch every page of one location, up to the 1000 result cap.
+
+        :return: A list of businesses
+        """
+        businesses, _ = await self.fetch_location_pages(term, lat, long, radius)
+        return businesses
+
+    async def fetch_location_pages(self, term, lat, long, radius=None):
+        """
+        Fetch every page of one location, and report how many pages were requested.
+
+        The first page reports the 'total' of the query, so the remaining pages are requested
+        concurrently instead of walking offsets one after another, and no empty page is requested
+        to find the end. A short first page means there is nothing more to fetch.
+
+        :return: A list of businesses and the number of pages requested
+        """
+        first = await self.fetch_page(term, lat, long, 0, radius)
+        data = list(first.get('businesses', []))
+        offsets = []
+        if len(data) == self.limit:
+            offsets = range(self.limit, min(first.get('total', 0), MAX_RESULTS), self.limit)
+        pages = await asyncio.gather(*(self.fetch_page(term, lat, long, offset, radius) for offset in offsets))
+        for page in pages:
+            data.extend(page.get('businesses', []))
+
+        METRICS.observe('pages_per_location', 1 + len(offsets), buckets=(1, 2, 5, 10, 15, 20))
+        return data, 1 + len(offsets)
+
+    async def fetch_total(self, term, lat, long, radius=None):
+        """
+        Ask the API how many businesses match a circle, spending a single one-business page.
+        """
+        return (await self.fetch_page(term, lat, long, 0, radius, limit=1)).get('total', 0)
+
+    async def fetch_locations(self, term, locations):
+        """
+        Fetch many locations for one term concurrently.
+
+        :param term: A term to include in the API query
+        :param locations: An iterable of (lat, long) or (lat, long, radius) tuples
+        :return: A list with one list of businesses per location, in the input order
+        """
+        return await asyncio.gather(*(self.fetch_location(term, *location) for location in locations))
+
+
+def fetch_location_data(url, headers, term, lat, long, radius=10000, limit=SEARCH_LIMIT, cache=None):
+    """
+    Blocking wrapper that fetches all pages of a single location.
+    """
+    async def run():
+        async with YelpSearchClient(url, headers, concurrency=1, radius=radius, limit=limit, cache=cache) as client:
+            return await client.fetch_location(term, lat, long)
+
+    return asyncio.run(run())
+
+
+def fetch_totals(url, headers, term, locations, concurrency=8, cache=None):
+    """
+    Blocking wrapper that probes the reported 'total' of many (lat, long, radius) circles at once.
+    """
+    async def run():
+        async with YelpSearchClient(url, headers, concurrency=concurrency, cache=cache) as client:
+            return await asyncio.gather(*(client.fetch_total(term, *location) for location in locations))
+
+    return asyncio.run(run())
+
+
+def fetch_term_across_locations(url, headers, term, locations, concurrency=8, radius=10000, cache=None):
+    """
+    Blocking wrapper that fetches every location of a term through one pooled session.
+
+    :param locations: An iterable of (lat, long) or (lat, long, radius) tuples
+    :param cache: A ResponseCache shared by every request; None always requests the API
+    :return: A list with one list of businesses per location, in the input order
+    """
+    async def run():
+        async with YelpSearchClient(url, headers, concurrency=concurrency, radius=radius, cache=cache) as client:
+            return await client.fetch_locations(term, locations)
+
+    return asyncio.run(run())
+
+
+def stream_term_across_locations(url, headers, term, locations, concurrency=8, radius=10000, cache=None,
+                                 max_pending=None, location_retries=0, retry_delay=10, return_exceptions=False):
+    """
+    Generator version of fetch_term_across_locations, for ingesting with bounded memory.
+
+    Locations are fetched on an event loop in a background thread and yielded in the order of locations,
+    each one as soon as it and the locations before it are fetched, so which location first lands a
+    business does not depend on the timing of the API. At most max_pending locations are being fetched,
+    waiting or being processed by the consumer at any time: a location only frees its slot once the
+    consumer asks for the next one, so when writing and uploading are slower than the API, or a slow
+    location holds the others back, fetching pauses until they catch up.
+
+        for position, businesses, pages in stream_term_across_locations(url, headers, term, coordinates):
+            write_local(businesses, ...)
+
+    A location that fails (timeout, server error, 429 after the client retries) is fetched again up to
+    location_retries times. When it still fails, the stream raises its error, or with return_exceptions
+    yields the error in place of the businesses and goes on with the other locations.
+
+    :param locations: An iterable of (lat, long) or (lat, long, radius) tuples; it is read lazily
+    :param max_pending: The maximum number of locations held in memory; defaults to twice the concurrency
+    :param location_retries: The number of times a failed location is fetched again
+    :param retry_delay: Seconds before the first retry of a location; doubled on every retry
+    :param return_exceptions: Yield the error of a failed location instead of raising it
+    :return: A generator of (position, businesses, pages) tuples in the order of locations, position being
+             the index of the location in locations and pages the number of pages requested for it
+    """
+    max_pending = max_pending or 2 * concurrency
+    # never holds more than max_pending items, the slots bound it
+    results = queue.Queue()
+    control = {}
+
+    async def fetch(client, position, location):
+        for attempt in range(location_retries + 1):
+            try:
+                results.put((position, *await client.fetch_location_pages(term, *location)))
+                return
+            except Exception as error:
+                if attempt == location_retries:
+                    results.put((position, error, 0))
+                    return
+                METRICS.incr('api_location_retries_total')
+            await asyncio.sleep(retry_delay * 2 ** attempt)
+
+    async def produce():
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(max_pending)
+        control['release'] = functools.partial(loop.call_soon_threadsafe, slots.release)
+        control['cancel'] = functools.partial(loop.call_soon_threadsafe, asyncio.current_task().cancel)
+        async with YelpSearchClient(url, headers, concurrency=concurrency, radius=radius, cache=cache) as client:
+            tasks = set()
+            try:
+                for position, location in enumerate(locations):
+                    await slots.acquire()
+                    task = asyncio.ensure_future(fetch(client, position, location))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            finally:
+                # the consumer stopped early: do not leave requests running on a closed session
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except asyncio.CancelledError:
+            pass
+        except Exception as error:
+            results.put((None, error, 0))
+        results.put(_DONE)
+
+    thread = threading.Thread(target=run, name=f"yelp-search-{term}", daemon=True)
+    thread.start()
+    # locations fetched ahead of an earlier one; they keep their slot until they are yielded
+    fetched = {}
+    next_position = 0
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            position, data, pages = item
+            # errors of the stream itself (position None) always end it
+            if position is None:
+                raise data
+            fetched[position] = (data, pages)
+            while next_position in fetched:
+                data, pages = fetched.pop(next_position)
+                if isinstance(data, Exception) and not return_exceptions:
+                    raise data
+                yield next_position, data, pages
+                next_position += 1
+                try:
+                    control['release']()
+                except RuntimeError:
+                    # every location was fetched and the loop closed: there is no slot left to free
+                    pass
+    finally:
+        if thread.is_alive() and 'cancel' in control:
+            try:
+                control['cancel']()
+            except RuntimeError:
+                # the loop closed in the meantime
+                pass
+        thread.join()
@@ -0,0 +1,168 @@
+import pandas as pd
+from pathlib import Path
+from category_index import CATEGORY_INDEX, FOOD_AND_BARS, DEFINITELY_NO, ETHNICITY
+from parquet_io import read_raw, cleaned_table
+from business_type import business_types, term_group
+from location_normalizer import CITIES, build_addresses
+from pipeline_metrics import METRICS
+
+"""
+Data cleaning and transformation of the landed Yelp Fusion JSON files before they go into BigQuery.
+
+The functions here are plain pandas (no Prefect), so they can run inside worker processes of a process
+pool as well as inside the read_json_transform_df flow. Geocoding of missing coordinates is kept out of
+clean_businesses because it is rate limited to 1 request per second and has to stay in one process.
+"""
+
+EXPORT_COLUMNS = ['id', 'alias', 'name', 'url', 'review_count',
+                  'categories', 'ethnic_category', 'rating', 'price', 'latitude', 'longitude', 'city', 'address',
+                  'type']
+
+
+def clean_businesses(path, set_cities, city_index=None):
+    """
+    Section 1. Clean categories: keep only alias in a list, drop non-related categories
+    and derive ethnic_category.
+    Section 2. Clean coordinates and locations: extract latitude/longitude, keep businesses in CA
+    cities and build 'city' and 'address'.
+    Section 4. Label the businesses restaurants/desserts/cafe for fact_yelp_all (see business_type.py).
+
+    :param path: The path of the landed JSON or Parquet file to transform into a pd.DataFrame;
+                 its name starts with the search term ({term}-{location}-{index}).
+    :param set_cities: The set of city names a business must be located in.
+    :param city_index: A CityIndex (see city_index.py); businesses whose city is not in the list are then
+                       assigned to their nearest city by coordinates instead of being dropped.
+    :return: The cleaned DataFrame; coordinates that are missing still have to be geocoded.
+    """
+    df = read_raw(path)
+    transformed_dataframe = df.copy()
+    METRICS.incr('transform_rows_in_total', len(transformed_dataframe))
+
+    # drop compact references to businesses already landed in another object (see seen_index.py)
+    if 'duplicate_of' in transformed_dataframe.columns:
+        transformed_dataframe = transformed_dataframe[transformed_dataframe['duplicate_of'].isna()]\
+            .drop(columns='duplicate_of')
+        METRICS.incr('transform_rows_dropped_total', len(df) - len(transformed_dataframe), filter='duplicate_of')
+
+    # if data frame is completely empty to begin with:
+    if transformed_dataframe.empty:
+        print("Dataframe is empty")
+        return transformed_dataframe
+
+    # create column named "price" if data frame does not have it and fill it with None for the whole dataset. 
+    if 'price' not in transformed_dataframe.columns:
+        transformed_dataframe['price'] = None
+
+
+    # Section 2. Clean categories
+    # explode into one row per (business, category) holding only the alias; rows keep the business index
+    aliases = transformed_dataframe['categories'].explode().dropna().str.get('alias')
+    # class bitmask of every alias and of every business (see category_index.py)
+    alias_masks = CATEGORY_INDEX.alias_masks(aliases)
+    business_masks = CATEGORY_INDEX.business_masks(aliases).reindex(transformed_dataframe.index, fill_value=0)
+    # filter for restaurant categories that are included in food and bars categories
+    # and filter out categories that are definitely useless
+    keep = (business_masks & FOOD_AND_BARS).astype(bool) & ~(business_masks & DEFINITELY_NO).astype(bool)
+    transformed_dataframe = transformed_dataframe[keep]
+    METRICS.incr('transform_rows_dropped_total', int((~keep).sum()), filter='category')
+    # then transform categories into lists that only have alias
+    transformed_dataframe['categories'] = aliases.groupby(level=0).agg(list).reindex(transformed_dataframe.index)
+    ethnic = aliases[(alias_masks & ETHNICITY).astype(bool)].groupby(level=0).agg(list)\
+        .reindex(transformed_dataframe.index)
+    transformed_dataframe['ethnic_category'] = ethnic.where(
+        ethnic.notna(), pd.Series([['Not Specified']] * len(ethnic), index=ethnic.index, dtype=object))
+
+    if transformed_dataframe.empty:
+
+        print("Dataframe is empty")
+        return transformed_dataframe
+    
+    else:
+        # Section 3. Clean coordinates and locations
+        coordinates = pd.json_normalize(transformed_dataframe['coordinates'].tolist(), max_level=0)\
+            .set_index(transformed_dataframe.index)
+        transformed_dataframe['latitude'] = coordinates['latitude']
+        transformed_dataframe['longitude'] = coordinates['longitude']
+        
+        location = pd.json_normalize(transformed_dataframe['location'].tolist(), max_level=0)\
+            .set_index(transformed_dataframe.index)
+        # only have addresses that are in "CA" for state and in the list of cities
+        if city_index is None:
+            list_city = location['city'].where(location['city'].isin(set_cities))
+        else:
+            # neighbourhoods and misspelled cities go to the nearest city of the list
+            list_city = city_index.assign(location['city'], transformed_dataframe['latitude'],
+                                          transformed_dataframe['longitude'])
+        in_california = (location['state'] == 'CA') & list_city.notna()
+        transformed_dataframe = transformed_dataframe[in_california]
+        location = location[in_california]
+        METRICS.incr('transform_rows_dropped_total', int((~in_california).sum()), filter='location')
+        # add 'city' column for easy parsing in the future; cities and addresses are normalized once per
+        # distinct value (see location_normalizer.py)
+        transformed_dataframe['city'] = CITIES.normalize(list_city[in_california])
+        # clean up 'location' column from dictionary to usual address
+        transformed_dataframe['address'] = build_addresses(location)
+
+        # Section 4. Label for fact_yelp_all, from the table the term is loaded into
+        transformed_dataframe['type'] = business_types(transformed_dataframe,
+                                                       term_group(Path(path).name.split('-', 1)[0]))
+
+        return transformed_dataframe
+
+
+def export_businesses(transformed_dataframe, geolocate=None, file_format='json'):
+    """
+    Geocode missing coordinates, finish the address and serialize the cleaned businesses.
+
+    :param transformed_dataframe: A DataFrame returned by clean_businesses.
+    :param geolocate: A callable taking the DataFrame and returning it with the missing 'latitude'/'longitude'
+                      filled from 'address' (ex. GeocodeCache.fill_missing); None leaves them as they are.
+    :param file_format: 'json' exports newline delimited JSON, 'parquet' an Arrow table (see parquet_io.py).
+    :return: The newline delimited JSON export (or Arrow table) and its row count.
+    """
+    if transformed_dataframe.empty:
+        if file_format == 'parquet':
+            return cleaned_table(transformed_dataframe), 0
+        return transformed_dataframe.to_json(orient='records', lines=True), 0
+
+    # find missing coordinates
+    if geolocate is not None:
+        transformed_dataframe = geolocate(transformed_dataframe)
+
+    # delete any 'address' that start with ',' (ex. ', San Jose CA')
+    transformed_dataframe['address'] = transformed_dataframe['address'].str.lstrip(', ')
+
+    transformed_dataframe = transformed_dataframe[EXPORT_COLUMNS] # .reset_index(drop=True)
+
+    row_count = len(transformed_dataframe)
+    METRICS.incr('transform_rows_out_total', row_count)
+    if file_format == 'parquet':
+        return cleaned_table(transformed_dataframe), row_count
+    export_data = transformed_dataframe.to_json(orient='records', lines=True)
+
+    return export_data, row_count
+
+
+def clean_and_export(path, set_cities, city_index=None, file_format='json'):
+    """
+    Clean a file and, when no coordinates are missing, export it too.
+
+    :return: (export_data, row_count) in file_format, or the cleaned DataFrame when some rows still need
+             geocoding so the caller can geocode them itself.
+    """
+    with METRICS.timer('stage_seconds', stage='transform'):
+        transformed_dataframe = clean_businesses(path, set_cities, city_index)
+        if not transformed_dataframe.empty and transformed_dataframe['latitude'].isna().any():
+            return transformed_dataframe
+        return export_businesses(transformed_dataframe, file_format=file_format)
+
+
+def transform_file(path, set_cities, city_index=None, file_format='json'):
+    """
+    Process pool entry point for clean_and_export.
+
+    :return: The clean_and_export result, and the metrics recorded by the worker for the caller to merge
+             into its own (see pipeline_metrics.py).
+    """
+    result = clean_and_export(path, set_cities, city_index, file_format)
+    return result, METRICS.snapshot(reset=True)
@@ -55,3 +55,9 @@ resource "google_bigquery_dataset" "yelp_data_dbt_prod" {
   project    = var.project
   location   = var.region
 }
+
+resource "google_bigquery_dataset" "yelp_data_current" {
+  dataset_id = var.CURRENT_DATASET
+  project    = var.project
+  location   = var.region
+}
@@ -31,6 +31,12 @@ variable "BQ_DATASET" {
   default = "yelp_data_raw_prod"
 }
 
+variable "CURRENT_DATASET" {
+  description = "BigQuery Dataset that the current-state tables (CDC merges from the GCS to BQ flow) will be written to"
+  type = string
+  default = "yelp_data_current"
+}
+
 variable "DBT_DATASET" {
   description = "BigQuery Dataset that transformed data (from dbt) will be written to and connected to the presentation layer"
   type = string
@@ -0,0 +1,25 @@
+-- The LIKE rules of macros/yelp_type.sql must give the labels of the golden file, which
+-- `python prefect/business_type.py seeds/business_type_golden.csv` checks the transform against.
+-- Any row returned is a case where the SQL and the Python labels disagree.
+
+with golden as (
+    select
+        source_group,
+        COALESCE(categories, '') as categories,
+        alias,
+        name,
+        expected_type
+    from {{ ref('business_type_golden') }}
+),
+
+labelled as (
+    select *, {{ yelp_type('restaurants') }} as sql_type from golden where source_group = 'restaurants'
+    union all
+    select *, {{ yelp_type('desserts') }} as sql_type from golden where source_group = 'desserts'
+    union all
+    select *, {{ yelp_type('cafe') }} as sql_type from golden where source_group = 'cafe'
+)
+
+select *
+from labelled
+where sql_type IS DISTINCT FROM expected_type
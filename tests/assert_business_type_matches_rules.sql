@@ -0,0 +1,17 @@
+-- The type label computed in the transform must match the LIKE rules on the loaded data.
+-- Any row returned is a business whose loaded label and SQL label disagree.
+
+with labelled as (
+    select id, 'restaurants' as source_group, type, {{ yelp_type('restaurants') }} as sql_type
+    from {{ ref('stg_restaurants') }}
+    union all
+    select id, 'desserts' as source_group, type, {{ yelp_type('desserts') }} as sql_type
+    from {{ ref('stg_desserts') }}
+    union all
+    select id, 'cafe' as source_group, type, {{ yelp_type('cafe') }} as sql_type
+    from {{ ref('stg_cafes') }}
+)
+
+select *
+from labelled
+where type IS DISTINCT FROM sql_type